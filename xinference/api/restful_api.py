@@ -14,11 +14,13 @@
 
 import asyncio
 import inspect
+import itertools
 import json
 import logging
 import multiprocessing
 import os
 import pprint
+import socket
 import sys
 import time
 import warnings
@@ -52,9 +54,13 @@ from xoscar.utils import get_next_port
 
 from .._compat import BaseModel, Field
 from .._version import get_versions
-from ..constants import XINFERENCE_DEFAULT_ENDPOINT_PORT
+from ..constants import (
+    XINFERENCE_DEFAULT_ENDPOINT_PORT,
+    XINFERENCE_PREFIX_AFFINITY_LENGTH,
+)
 from ..core.event import Event, EventCollectorActor, EventType
-from ..core.supervisor import SupervisorActor
+from ..core.model import ModelActor
+from ..core.supervisor import SupervisorActor, choose_replica
 from ..core.utils import json_dumps
 from ..types import (
     SPECIAL_TOOL_PROMPT,
@@ -72,6 +78,19 @@ from .oauth2.types import LoginUserForm
 
 logger = logging.getLogger(__name__)
 
+# The seconds of a long polling on the supervisor for the model changes.
+MODEL_CHANGES_WAIT_TIMEOUT = 30
+
+
+def _get_routing_key(*texts: Any) -> str:
+    """
+    Get the key of a request for the prefix affinity routing, from its leading
+    texts, e.g. the system prompt and the first message of a chat.
+    """
+    return "\n".join(str(text) for text in texts if text)[
+        :XINFERENCE_PREFIX_AFFINITY_LENGTH
+    ]
+
 
 class JSONResponse(StarletteJSONResponse):  # type: ignore # noqa: F811
     def render(self, content: Any) -> bytes:
@@ -162,6 +181,12 @@ class RESTfulAPI:
         self._port = port
         self._supervisor_ref = None
         self._event_collector_ref = None
+        # Model uid -> the replica refs, routing policy and description.
+        self._model_cache: Dict[str, Dict[str, Any]] = {}
+        # The version of the running models in the supervisor that the cache
+        # is consistent with, None if it's unknown and the cache is disabled.
+        self._model_cache_version: Optional[int] = None
+        self._model_cache_watcher: Optional[asyncio.Task] = None
         self._auth_service = AuthService(auth_config_file)
         self._router = APIRouter()
         self._app = FastAPI()
@@ -174,6 +199,16 @@ class RESTfulAPI:
         if "Rate limit reached" in str(e):
             raise HTTPException(status_code=429, detail=str(e))
 
+    @staticmethod
+    async def _abort_generation(iterator):
+        """Destroy the generator in the model actor, so it stops generating."""
+        if iterator is None:
+            return
+        try:
+            await asyncio.shield(iterator.destroy())
+        except (Exception, asyncio.CancelledError):
+            logger.debug("Destroy generator failed.", exc_info=True)
+
     async def _get_supervisor_ref(self) -> xo.ActorRefType[SupervisorActor]:
         if self._supervisor_ref is None:
             self._supervisor_ref = await xo.actor_ref(
@@ -181,6 +216,59 @@ class RESTfulAPI:
             )
         return self._supervisor_ref
 
+    async def _watch_model_changes(self):
+        while True:
+            try:
+                version = await (await self._get_supervisor_ref()).wait_model_changes(
+                    self._model_cache_version, MODEL_CHANGES_WAIT_TIMEOUT
+                )
+            except Exception:
+                logger.debug("Watch model changes failed.", exc_info=True)
+                # Disable the cache until the supervisor is back.
+                self._model_cache_version = None
+                self._model_cache.clear()
+                await asyncio.sleep(1)
+                continue
+            if version != self._model_cache_version:
+                self._model_cache.clear()
+                self._model_cache_version = version
+
+    async def _get_model_info(self, model_uid: str) -> Dict[str, Any]:
+        if self._model_cache_watcher is None or self._model_cache_watcher.done():
+            self._model_cache_watcher = asyncio.create_task(self._watch_model_changes())
+        info = self._model_cache.get(model_uid)
+        if info is None:
+            version = self._model_cache_version
+            info = await (await self._get_supervisor_ref()).get_model_replicas(
+                model_uid
+            )
+            info["scheduler"] = itertools.count()
+            # Not cached if the models changed while getting it.
+            if version is not None and version == self._model_cache_version:
+                self._model_cache[model_uid] = info
+        return info
+
+    async def _get_model_ref(
+        self, model_uid: str, routing_key: Optional[str] = None
+    ) -> xo.ActorRefType[ModelActor]:
+        info = await self._get_model_info(model_uid)
+        if not info["model_refs"]:
+            # Scaled to zero or lazy, the supervisor gets the model loaded.
+            return await (await self._get_supervisor_ref()).get_model(model_uid)
+        return await choose_replica(
+            info["model_refs"],
+            info["scheduler"],
+            info["routing_policy"],
+            routing_key=routing_key,
+        )
+
+    async def _get_model_description(self, model_uid: str) -> Dict[str, Any]:
+        info = await self._get_model_info(model_uid)
+        if info["lazy"]:
+            # The description is complete once the model is loaded.
+            return await (await self._get_supervisor_ref()).describe_model(model_uid)
+        return info["description"]
+
     async def _get_event_collector_ref(self) -> xo.ActorRefType[EventCollectorActor]:
         if self._event_collector_ref is None:
             self._event_collector_ref = await xo.actor_ref(
@@ -214,7 +302,11 @@ class RESTfulAPI:
     async def is_cluster_authenticated(self) -> JSONResponse:
         return JSONResponse(content={"auth": self.is_authenticated()})
 
-    def serve(self, logging_conf: Optional[dict] = None):
+    def serve(
+        self,
+        logging_conf: Optional[dict] = None,
+        sockets: Optional[List[socket.socket]] = None,
+    ):
         self._app.add_middleware(
             CORSMiddleware,
             allow_origins=["*"],
@@ -562,7 +654,7 @@ class RESTfulAPI:
             app=self._app, host=self._host, port=self._port, log_config=logging_conf
         )
         server = Server(config)
-        server.run()
+        server.run(sockets=sockets)
 
     async def _get_builtin_prompts(self) -> JSONResponse:
         """
@@ -653,9 +745,15 @@ class RESTfulAPI:
         replica = payload.get("replica", 1)
         n_gpu = payload.get("n_gpu", "auto")
         request_limits = payload.get("request_limits", None)
+        routing_policy = payload.get("routing_policy", "round_robin")
+        min_replica = payload.get("min_replica", None)
+        max_replica = payload.get("max_replica", None)
+        lazy = payload.get("lazy", False)
+        pinned = payload.get("pinned", False)
         peft_model_config = payload.get("peft_model_config", None)
         worker_ip = payload.get("worker_ip", None)
         gpu_idx = payload.get("gpu_idx", None)
+        gpu_memory = payload.get("gpu_memory", None)
 
         exclude_keys = {
             "model_uid",
@@ -668,9 +766,15 @@ class RESTfulAPI:
             "replica",
             "n_gpu",
             "request_limits",
+            "routing_policy",
+            "min_replica",
+            "max_replica",
+            "lazy",
+            "pinned",
             "peft_model_config",
             "worker_ip",
             "gpu_idx",
+            "gpu_memory",
         }
 
         kwargs = {
@@ -700,10 +804,16 @@ class RESTfulAPI:
                 replica=replica,
                 n_gpu=n_gpu,
                 request_limits=request_limits,
+                routing_policy=routing_policy,
+                min_replica=min_replica,
+                max_replica=max_replica,
+                lazy=lazy,
+                pinned=pinned,
                 wait_ready=wait_ready,
                 peft_model_config=peft_model_config,
                 worker_ip=worker_ip,
                 gpu_idx=gpu_idx,
+                gpu_memory=gpu_memory,
                 **kwargs,
             )
 
@@ -925,7 +1035,9 @@ class RESTfulAPI:
         model_uid = body.model
 
         try:
-            model = await (await self._get_supervisor_ref()).get_model(model_uid)
+            model = await self._get_model_ref(
+                model_uid, routing_key=_get_routing_key(body.prompt)
+            )
         except ValueError as ve:
             logger.error(str(ve), exc_info=True)
             await self._report_error_event(model_uid, str(ve))
@@ -951,6 +1063,7 @@ class RESTfulAPI:
                     logger.info(
                         f"Disconnected from client (via refresh/close) {request.client} during generate."
                     )
+                    await self._abort_generation(iterator)
                     return
                 except Exception as ex:
                     logger.exception("Completion stream got an error: %s", ex)
@@ -983,7 +1096,7 @@ class RESTfulAPI:
         kwargs = {key: value for key, value in payload.items() if key not in exclude}
 
         try:
-            model = await (await self._get_supervisor_ref()).get_model(model_uid)
+            model = await self._get_model_ref(model_uid)
         except ValueError as ve:
             logger.error(str(ve), exc_info=True)
             await self._report_error_event(model_uid, str(ve))
@@ -1017,7 +1130,7 @@ class RESTfulAPI:
         }
 
         try:
-            model = await (await self._get_supervisor_ref()).get_model(model_uid)
+            model = await self._get_model_ref(model_uid)
         except ValueError as ve:
             logger.error(str(ve), exc_info=True)
             await self._report_error_event(model_uid, str(ve))
@@ -1064,7 +1177,7 @@ class RESTfulAPI:
             timestamp_granularities = [timestamp_granularities]
         model_uid = model
         try:
-            model_ref = await (await self._get_supervisor_ref()).get_model(model_uid)
+            model_ref = await self._get_model_ref(model_uid)
         except ValueError as ve:
             logger.error(str(ve), exc_info=True)
             await self._report_error_event(model_uid, str(ve))
@@ -1115,7 +1228,7 @@ class RESTfulAPI:
             timestamp_granularities = [timestamp_granularities]
         model_uid = model
         try:
-            model_ref = await (await self._get_supervisor_ref()).get_model(model_uid)
+            model_ref = await self._get_model_ref(model_uid)
         except ValueError as ve:
             logger.error(str(ve), exc_info=True)
             await self._report_error_event(model_uid, str(ve))
@@ -1153,7 +1266,7 @@ class RESTfulAPI:
         body = TextToImageRequest.parse_obj(await request.json())
         model_uid = body.model
         try:
-            model = await (await self._get_supervisor_ref()).get_model(model_uid)
+            model = await self._get_model_ref(model_uid)
         except ValueError as ve:
             logger.error(str(ve), exc_info=True)
             await self._report_error_event(model_uid, str(ve))
@@ -1196,7 +1309,7 @@ class RESTfulAPI:
     ) -> Response:
         model_uid = model
         try:
-            model_ref = await (await self._get_supervisor_ref()).get_model(model_uid)
+            model_ref = await self._get_model_ref(model_uid)
         except ValueError as ve:
             logger.error(str(ve), exc_info=True)
             await self._report_error_event(model_uid, str(ve))
@@ -1287,7 +1400,13 @@ class RESTfulAPI:
         model_uid = body.model
 
         try:
-            model = await (await self._get_supervisor_ref()).get_model(model_uid)
+            model = await self._get_model_ref(
+                model_uid,
+                routing_key=_get_routing_key(
+                    system_prompt,
+                    non_system_messages[0]["content"] if non_system_messages else None,
+                ),
+            )
         except ValueError as ve:
             logger.error(str(ve), exc_info=True)
             await self._report_error_event(model_uid, str(ve))
@@ -1298,7 +1417,7 @@ class RESTfulAPI:
             raise HTTPException(status_code=500, detail=str(e))
 
         try:
-            desc = await (await self._get_supervisor_ref()).describe_model(model_uid)
+            desc = await self._get_model_description(model_uid)
         except ValueError as ve:
             logger.error(str(ve), exc_info=True)
             await self._report_error_event(model_uid, str(ve))
@@ -1367,6 +1486,7 @@ class RESTfulAPI:
                     logger.info(
                         f"Disconnected from client (via refresh/close) {request.client} during chat."
                     )
+                    await self._abort_generation(iterator)
                     # See https://github.com/sysid/sse-starlette/blob/main/examples/error_handling.py#L13
                     # Use return to stop the generator from continuing.
                     # TODO: Cannot yield here. Yield here would leads to error for the next streaming request.
@@ -1514,15 +1634,32 @@ class RESTfulAPI:
             raise HTTPException(status_code=500, detail=str(e))
 
 
-def run(
+def _run_api_worker(
     supervisor_address: str,
     host: str,
     port: int,
-    logging_conf: Optional[dict] = None,
-    auth_config_file: Optional[str] = None,
+    logging_conf: Optional[dict],
+    auth_config_file: Optional[str],
+    sock: socket.socket,
 ):
-    logger.info(f"Starting Xinference at endpoint: http://{host}:{port}")
-    try:
+    api = RESTfulAPI(
+        supervisor_address=supervisor_address,
+        host=host,
+        port=port,
+        auth_config_file=auth_config_file,
+    )
+    api.serve(logging_conf=logging_conf, sockets=[sock])
+
+
+def _serve(
+    supervisor_address: str,
+    host: str,
+    port: int,
+    logging_conf: Optional[dict],
+    auth_config_file: Optional[str],
+    api_workers: int,
+):
+    if api_workers <= 1:
         api = RESTfulAPI(
             supervisor_address=supervisor_address,
             host=host,
@@ -1530,6 +1667,60 @@ def run(
             auth_config_file=auth_config_file,
         )
         api.serve(logging_conf=logging_conf)
+        return
+
+    # Bind the socket once and share it with the API worker processes, which
+    # accept connections from it independently. Each worker is stateless,
+    # with its own connection to the supervisor and cache of the models.
+    sock = Config(app=None, host=host, port=port).bind_socket()
+    ctx = multiprocessing.get_context("spawn")
+    args = (supervisor_address, host, port, logging_conf, auth_config_file, sock)
+
+    def _start_api_worker() -> multiprocessing.process.BaseProcess:
+        p = ctx.Process(target=_run_api_worker, args=args)
+        p.daemon = True
+        p.start()
+        return p
+
+    processes = [_start_api_worker() for _ in range(api_workers)]
+    logger.info("Started %d API worker processes", api_workers)
+    try:
+        while True:
+            for i, p in enumerate(processes):
+                if not p.is_alive():
+                    logger.error(
+                        "API worker process %s exited with code %s, restart it",
+                        p.pid,
+                        p.exitcode,
+                    )
+                    processes[i] = _start_api_worker()
+            time.sleep(1)
+    finally:
+        for p in processes:
+            p.terminate()
+        for p in processes:
+            p.join()
+        sock.close()
+
+
+def run(
+    supervisor_address: str,
+    host: str,
+    port: int,
+    logging_conf: Optional[dict] = None,
+    auth_config_file: Optional[str] = None,
+    api_workers: int = 1,
+):
+    logger.info(f"Starting Xinference at endpoint: http://{host}:{port}")
+    try:
+        _serve(
+            supervisor_address,
+            host,
+            port,
+            logging_conf,
+            auth_config_file,
+            api_workers,
+        )
     except SystemExit:
         logger.warning("Failed to create socket with port %d", port)
         # compare the reference to differentiate between the cases where the user specify the
@@ -1538,13 +1729,14 @@ def run(
             port = get_next_port()
             logger.info(f"Found available port: {port}")
             logger.info(f"Starting Xinference at endpoint: http://{host}:{port}")
-            api = RESTfulAPI(
-                supervisor_address=supervisor_address,
-                host=host,
-                port=port,
-                auth_config_file=auth_config_file,
+            _serve(
+                supervisor_address,
+                host,
+                port,
+                logging_conf,
+                auth_config_file,
+                api_workers,
             )
-            api.serve(logging_conf=logging_conf)
         else:
             raise
 
@@ -787,6 +787,12 @@ class Client:
         request_limits: Optional[int] = None,
         worker_ip: Optional[str] = None,
         gpu_idx: Optional[Union[int, List[int]]] = None,
+        gpu_memory: Optional[Union[float, str]] = None,
+        routing_policy: str = "round_robin",
+        min_replica: Optional[int] = None,
+        max_replica: Optional[int] = None,
+        lazy: bool = False,
+        pinned: bool = False,
         **kwargs,
     ) -> str:
         """
@@ -824,6 +830,31 @@ class Client:
             Specify the worker ip where the model is located in a distributed scenario.
         gpu_idx: Optional[Union[int, List[int]]]
             Specify the GPU index where the model is located.
+        gpu_memory: Optional[Union[float, str]]
+            The GPU memory in GiB the model uses on each of its GPUs, default is None.
+            The models with this budget share the GPUs as long as the budgets fit,
+            ``gpu_memory="auto"`` estimates it from the size of the LLM.
+            ``gpu_memory=None`` gives the model its GPUs exclusively.
+        routing_policy: str
+            How requests are routed among the replicas, default is "round_robin".
+            ``routing_policy="least_requests"`` routes a request to the replica
+            with the least queued and running requests.
+            ``routing_policy="prefix_affinity"`` routes the requests with the same
+            system prompt and first message to the same replica to reuse its
+            prefix cache, and to the least loaded replica if it is much busier.
+        min_replica: Optional[int]
+            The minimum replica of the model when autoscaling, default is 1.
+            ``min_replica=0`` scales the model to zero when it is idle,
+            and the model is launched again on the next request.
+        max_replica: Optional[int]
+            The maximum replica of the model, default is None.
+            The replicas are scaled by the load if it is specified.
+        lazy: bool
+            Load the model on its first request instead of now, default is False.
+            A lazy model is unloaded when its GPUs are needed by another model
+            and it is the least recently used idle lazy model on the worker.
+        pinned: bool
+            Never unload the lazy model once it is loaded, default is False.
         **kwargs:
             Any other parameters been specified.
 
@@ -854,6 +885,12 @@ class Client:
             "request_limits": request_limits,
             "worker_ip": worker_ip,
             "gpu_idx": gpu_idx,
+            "gpu_memory": gpu_memory,
+            "routing_policy": routing_policy,
+            "min_replica": min_replica,
+            "max_replica": max_replica,
+            "lazy": lazy,
+            "pinned": pinned,
         }
 
         for key, value in kwargs.items():
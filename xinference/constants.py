@@ -26,6 +26,40 @@ XINFERENCE_ENV_HEALTH_CHECK_TIMEOUT = "XINFERENCE_HEALTH_CHECK_TIMEOUT"
 XINFERENCE_ENV_DISABLE_HEALTH_CHECK = "XINFERENCE_DISABLE_HEALTH_CHECK"
 XINFERENCE_ENV_DISABLE_VLLM = "XINFERENCE_DISABLE_VLLM"
 XINFERENCE_ENV_ENABLE_SGLANG = "XINFERENCE_ENABLE_SGLANG"
+XINFERENCE_ENV_TRANSFORMERS_ENABLE_BATCHING = "XINFERENCE_TRANSFORMERS_ENABLE_BATCHING"
+XINFERENCE_ENV_REQUEST_QUEUE_SIZE = "XINFERENCE_REQUEST_QUEUE_SIZE"
+XINFERENCE_ENV_REQUEST_QUEUE_TIMEOUT = "XINFERENCE_REQUEST_QUEUE_TIMEOUT"
+XINFERENCE_ENV_EMBEDDING_BATCH_WAIT_MS = "XINFERENCE_EMBEDDING_BATCH_WAIT_MS"
+XINFERENCE_ENV_EMBEDDING_MAX_BATCH_SIZE = "XINFERENCE_EMBEDDING_MAX_BATCH_SIZE"
+XINFERENCE_ENV_RERANK_BATCH_WAIT_MS = "XINFERENCE_RERANK_BATCH_WAIT_MS"
+XINFERENCE_ENV_RERANK_MAX_BATCH_PAIRS = "XINFERENCE_RERANK_MAX_BATCH_PAIRS"
+XINFERENCE_ENV_METRICS_LATENCY_BUCKETS = "XINFERENCE_METRICS_LATENCY_BUCKETS"
+XINFERENCE_ENV_METRICS_TOKENS_BUCKETS = "XINFERENCE_METRICS_TOKENS_BUCKETS"
+XINFERENCE_ENV_METRICS_FLUSH_INTERVAL = "XINFERENCE_METRICS_FLUSH_INTERVAL"
+XINFERENCE_ENV_WORKER_PLACEMENT_STRATEGY = "XINFERENCE_WORKER_PLACEMENT_STRATEGY"
+XINFERENCE_ENV_MAX_CONCURRENT_LAUNCHES_PER_WORKER = (
+    "XINFERENCE_MAX_CONCURRENT_LAUNCHES_PER_WORKER"
+)
+XINFERENCE_ENV_AUTOSCALE_INTERVAL = "XINFERENCE_AUTOSCALE_INTERVAL"
+XINFERENCE_ENV_AUTOSCALE_TARGET_PENDING_REQUESTS = (
+    "XINFERENCE_AUTOSCALE_TARGET_PENDING_REQUESTS"
+)
+XINFERENCE_ENV_AUTOSCALE_QUEUE_WAIT_THRESHOLD = (
+    "XINFERENCE_AUTOSCALE_QUEUE_WAIT_THRESHOLD"
+)
+XINFERENCE_ENV_AUTOSCALE_SCALE_DOWN_DELAY = "XINFERENCE_AUTOSCALE_SCALE_DOWN_DELAY"
+XINFERENCE_ENV_AUTOSCALE_DRAIN_TIMEOUT = "XINFERENCE_AUTOSCALE_DRAIN_TIMEOUT"
+XINFERENCE_ENV_PREFIX_AFFINITY_LENGTH = "XINFERENCE_PREFIX_AFFINITY_LENGTH"
+XINFERENCE_ENV_PREFIX_AFFINITY_MAX_IMBALANCE = (
+    "XINFERENCE_PREFIX_AFFINITY_MAX_IMBALANCE"
+)
+XINFERENCE_ENV_ROUTING_PENDING_REQUESTS_TTL = "XINFERENCE_ROUTING_PENDING_REQUESTS_TTL"
+XINFERENCE_ENV_WARM_SUBPOOL_SIZE = "XINFERENCE_WARM_SUBPOOL_SIZE"
+XINFERENCE_ENV_WARM_SUBPOOL_MODULES = "XINFERENCE_WARM_SUBPOOL_MODULES"
+XINFERENCE_ENV_WEIGHT_CACHE_DIR = "XINFERENCE_WEIGHT_CACHE_DIR"
+XINFERENCE_ENV_WEIGHT_CACHE_SIZE = "XINFERENCE_WEIGHT_CACHE_SIZE"
+XINFERENCE_ENV_GPU_SAMPLE_INTERVAL = "XINFERENCE_GPU_SAMPLE_INTERVAL"
+XINFERENCE_ENV_PREFIX_CACHE_SIZE = "XINFERENCE_PREFIX_CACHE_SIZE"
 
 
 def get_xinference_home() -> str:
@@ -66,3 +100,85 @@ XINFERENCE_DISABLE_HEALTH_CHECK = bool(
 )
 XINFERENCE_DISABLE_VLLM = bool(int(os.environ.get(XINFERENCE_ENV_DISABLE_VLLM, 0)))
 XINFERENCE_ENABLE_SGLANG = bool(int(os.environ.get(XINFERENCE_ENV_ENABLE_SGLANG, 0)))
+XINFERENCE_TRANSFORMERS_ENABLE_BATCHING = bool(
+    int(os.environ.get(XINFERENCE_ENV_TRANSFORMERS_ENABLE_BATCHING, 0))
+)
+XINFERENCE_REQUEST_QUEUE_SIZE = int(
+    os.environ.get(XINFERENCE_ENV_REQUEST_QUEUE_SIZE, 0)
+)
+XINFERENCE_REQUEST_QUEUE_TIMEOUT = float(
+    os.environ.get(XINFERENCE_ENV_REQUEST_QUEUE_TIMEOUT, 30)
+)
+XINFERENCE_EMBEDDING_BATCH_WAIT_MS = float(
+    os.environ.get(XINFERENCE_ENV_EMBEDDING_BATCH_WAIT_MS, 0)
+)
+XINFERENCE_EMBEDDING_MAX_BATCH_SIZE = int(
+    os.environ.get(XINFERENCE_ENV_EMBEDDING_MAX_BATCH_SIZE, 256)
+)
+XINFERENCE_RERANK_BATCH_WAIT_MS = float(
+    os.environ.get(XINFERENCE_ENV_RERANK_BATCH_WAIT_MS, 0)
+)
+XINFERENCE_RERANK_MAX_BATCH_PAIRS = int(
+    os.environ.get(XINFERENCE_ENV_RERANK_MAX_BATCH_PAIRS, 256)
+)
+# Comma separated upper bounds of the histogram buckets.
+XINFERENCE_METRICS_LATENCY_BUCKETS = os.environ.get(
+    XINFERENCE_ENV_METRICS_LATENCY_BUCKETS,
+    "10,25,50,100,250,500,1000,2500,5000,10000,30000,60000",
+)
+XINFERENCE_METRICS_TOKENS_BUCKETS = os.environ.get(
+    XINFERENCE_ENV_METRICS_TOKENS_BUCKETS,
+    "16,32,64,128,256,512,1024,2048,4096,8192,16384,32768",
+)
+XINFERENCE_METRICS_FLUSH_INTERVAL = float(
+    os.environ.get(XINFERENCE_ENV_METRICS_FLUSH_INTERVAL, 1)
+)
+XINFERENCE_WORKER_PLACEMENT_STRATEGY = os.environ.get(
+    XINFERENCE_ENV_WORKER_PLACEMENT_STRATEGY, "spread"
+)
+XINFERENCE_MAX_CONCURRENT_LAUNCHES_PER_WORKER = int(
+    os.environ.get(XINFERENCE_ENV_MAX_CONCURRENT_LAUNCHES_PER_WORKER, 4)
+)
+XINFERENCE_AUTOSCALE_INTERVAL = float(
+    os.environ.get(XINFERENCE_ENV_AUTOSCALE_INTERVAL, 10)
+)
+XINFERENCE_AUTOSCALE_TARGET_PENDING_REQUESTS = float(
+    os.environ.get(XINFERENCE_ENV_AUTOSCALE_TARGET_PENDING_REQUESTS, 8)
+)
+XINFERENCE_AUTOSCALE_QUEUE_WAIT_THRESHOLD = float(
+    os.environ.get(XINFERENCE_ENV_AUTOSCALE_QUEUE_WAIT_THRESHOLD, 1)
+)
+XINFERENCE_AUTOSCALE_SCALE_DOWN_DELAY = float(
+    os.environ.get(XINFERENCE_ENV_AUTOSCALE_SCALE_DOWN_DELAY, 300)
+)
+XINFERENCE_AUTOSCALE_DRAIN_TIMEOUT = float(
+    os.environ.get(XINFERENCE_ENV_AUTOSCALE_DRAIN_TIMEOUT, 60)
+)
+XINFERENCE_PREFIX_AFFINITY_LENGTH = int(
+    os.environ.get(XINFERENCE_ENV_PREFIX_AFFINITY_LENGTH, 4096)
+)
+XINFERENCE_PREFIX_AFFINITY_MAX_IMBALANCE = int(
+    os.environ.get(XINFERENCE_ENV_PREFIX_AFFINITY_MAX_IMBALANCE, 4)
+)
+XINFERENCE_ROUTING_PENDING_REQUESTS_TTL = float(
+    os.environ.get(XINFERENCE_ENV_ROUTING_PENDING_REQUESTS_TTL, 0.5)
+)
+XINFERENCE_WARM_SUBPOOL_SIZE = int(os.environ.get(XINFERENCE_ENV_WARM_SUBPOOL_SIZE, 0))
+# Comma separated modules imported by the warm sub pools.
+XINFERENCE_WARM_SUBPOOL_MODULES = os.environ.get(
+    XINFERENCE_ENV_WARM_SUBPOOL_MODULES, "torch"
+)
+XINFERENCE_WEIGHT_CACHE_DIR = os.environ.get(
+    XINFERENCE_ENV_WEIGHT_CACHE_DIR, "/dev/shm/xinference"
+)
+# In GiB, 0 disables the weight cache.
+XINFERENCE_WEIGHT_CACHE_SIZE = float(
+    os.environ.get(XINFERENCE_ENV_WEIGHT_CACHE_SIZE, 0)
+)
+XINFERENCE_GPU_SAMPLE_INTERVAL = float(
+    os.environ.get(XINFERENCE_ENV_GPU_SAMPLE_INTERVAL, 1)
+)
+# In GiB, 0 disables the prefix cache.
+XINFERENCE_PREFIX_CACHE_SIZE = float(
+    os.environ.get(XINFERENCE_ENV_PREFIX_CACHE_SIZE, 0)
+)
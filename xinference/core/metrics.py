@@ -13,16 +13,29 @@
 # limitations under the License.
 
 import asyncio
+from typing import Any, Dict, List, Tuple
 
 import uvicorn
-from aioprometheus import Counter, Gauge
+from aioprometheus import Counter, Gauge, Histogram, histogram
 from aioprometheus.asgi.starlette import metrics
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 
+from ..constants import (
+    XINFERENCE_METRICS_LATENCY_BUCKETS,
+    XINFERENCE_METRICS_TOKENS_BUCKETS,
+)
+
 DEFAULT_METRICS_SERVER_LOG_LEVEL = "warning"
 
 
+def parse_buckets(value: str) -> List[float]:
+    return sorted({float(v) for v in value.split(",") if v.strip()})
+
+
+latency_buckets = parse_buckets(XINFERENCE_METRICS_LATENCY_BUCKETS)
+tokens_buckets = parse_buckets(XINFERENCE_METRICS_TOKENS_BUCKETS)
+
 generate_throughput = Gauge(
     "xinference:generate_tokens_per_s", "Generate throughput in tokens/s."
 )
@@ -30,6 +43,59 @@ generate_throughput = Gauge(
 time_to_first_token = Gauge(
     "xinference:time_to_first_token_ms", "First token latency in ms."
 )
+time_to_first_token_histogram = Histogram(
+    "xinference:time_to_first_token_latency_ms",
+    "Distribution of the first token latency in ms.",
+    buckets=latency_buckets,
+)
+time_per_output_token = Histogram(
+    "xinference:time_per_output_token_ms",
+    "Distribution of the latency per output token after the first one in ms.",
+    buckets=latency_buckets,
+)
+e2e_request_latency = Histogram(
+    "xinference:e2e_request_latency_ms",
+    "Distribution of the end-to-end request latency in ms.",
+    buckets=latency_buckets,
+)
+# Request queue
+request_queue_size = Gauge(
+    "xinference:request_queue_size",
+    "Number of requests waiting in the model request queue.",
+)
+request_queue_wait_time = Histogram(
+    "xinference:request_queue_wait_time_ms",
+    "Distribution of the time a request waited in the model request queue in ms.",
+    buckets=latency_buckets,
+)
+# Request length
+request_prompt_tokens = Histogram(
+    "xinference:request_prompt_tokens",
+    "Distribution of the number of prompt tokens per request.",
+    buckets=tokens_buckets,
+)
+request_completion_tokens = Histogram(
+    "xinference:request_completion_tokens",
+    "Distribution of the number of completion tokens per request.",
+    buckets=tokens_buckets,
+)
+# GPU
+gpu_utilization = Gauge(
+    "xinference:gpu_utilization", "GPU utilization in the last sample period."
+)
+gpu_memory_used_bytes = Gauge(
+    "xinference:gpu_memory_used_bytes", "Used GPU memory in bytes."
+)
+gpu_memory_total_bytes = Gauge(
+    "xinference:gpu_memory_total_bytes", "Total GPU memory in bytes."
+)
+gpu_power_watts = Gauge("xinference:gpu_power_watts", "GPU power draw in watts.")
+gpu_temperature_celsius = Gauge(
+    "xinference:gpu_temperature_celsius", "GPU temperature in degrees Celsius."
+)
+model_gpu_memory_used_bytes = Gauge(
+    "xinference:model_gpu_memory_used_bytes", "GPU memory used by a model in bytes."
+)
 # Tokens counter
 input_tokens_total_counter = Counter(
     "xinference:input_tokens_total_counter", "Total number of input tokens."
@@ -37,6 +103,19 @@ input_tokens_total_counter = Counter(
 output_tokens_total_counter = Counter(
     "xinference:output_tokens_total_counter", "Total number of output tokens."
 )
+# Speculative decoding
+spec_decode_draft_tokens_total_counter = Counter(
+    "xinference:spec_decode_draft_tokens_total_counter",
+    "Total number of draft tokens of speculative decoding.",
+)
+spec_decode_accepted_tokens_total_counter = Counter(
+    "xinference:spec_decode_accepted_tokens_total_counter",
+    "Total number of accepted draft tokens of speculative decoding.",
+)
+spec_decode_acceptance_rate = Gauge(
+    "xinference:spec_decode_acceptance_rate",
+    "Acceptance rate of draft tokens of speculative decoding.",
+)
 
 
 def record_metrics(name, op, kwargs):
@@ -44,6 +123,72 @@ def record_metrics(name, op, kwargs):
     getattr(collector, op)(**kwargs)
 
 
+# (name, op, labels, value), the value of an `observe` record is the
+# aggregated histogram: {"buckets": [...], "sum": float, "count": int}.
+MetricsRecord = Tuple[str, str, Dict[str, str], Any]
+
+
+def record_metrics_batch(records: List[MetricsRecord]):
+    for name, op, labels, value in records:
+        collector = globals().get(name)
+        if op == "observe":
+            assert isinstance(collector, Histogram)
+            try:
+                h = collector.get_value(labels)
+            except KeyError:
+                h = histogram.Histogram(*collector.upper_bounds)
+                collector.set_value(labels, h)
+            for upper_bound, count in zip(h.buckets, value["buckets"]):
+                h.buckets[upper_bound] += count
+            h.sum += value["sum"]
+            h.observations += value["count"]
+        else:
+            getattr(collector, op)(labels=labels, value=value)
+
+
+class MetricsAggregator:
+    """
+    Aggregate the metrics in the model process, so the metrics overhead does not
+    grow with the traffic. Counters are summed, gauges keep the last value and
+    histograms are bucketed locally, then `collect` returns one record per metric
+    and labels to be applied by `record_metrics_batch` in the worker.
+    """
+
+    def __init__(self):
+        self._values: Dict[Tuple[str, str, Tuple[Tuple[str, str], ...]], Any] = {}
+
+    def record(self, name: str, op: str, kwargs: Dict[str, Any]):
+        labels = tuple(sorted(kwargs.get("labels", {}).items()))
+        if op == "set":
+            self._values[(name, op, labels)] = kwargs["value"]
+        elif op in ("add", "inc"):
+            key = (name, "add", labels)
+            self._values[key] = self._values.get(key, 0) + kwargs.get("value", 1)
+        elif op == "observe":
+            key = (name, op, labels)
+            h = self._values.get(key)
+            if h is None:
+                h = self._values[key] = histogram.Histogram(
+                    *globals()[name].upper_bounds
+                )
+            h.observe(kwargs["value"])
+        else:
+            raise ValueError(f"Unsupported metrics op to aggregate: {op}")
+
+    def collect(self) -> List[MetricsRecord]:
+        records: List[MetricsRecord] = []
+        for (name, op, labels), value in self._values.items():
+            if op == "observe":
+                value = {
+                    "buckets": list(value.buckets.values()),
+                    "sum": value.sum,
+                    "count": value.observations,
+                }
+            records.append((name, op, dict(labels), value))
+        self._values = {}
+        return records
+
+
 def launch_metrics_export_server(q, host=None, port=None):
     app = FastAPI()
     app.add_route("/metrics", metrics)
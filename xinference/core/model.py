@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import asyncio
+import collections
 import functools
 import inspect
 import json
@@ -22,14 +23,18 @@ import types
 import weakref
 from typing import (
     TYPE_CHECKING,
+    Any,
     AsyncGenerator,
     Callable,
+    Deque,
     Dict,
-    Generator,
     Iterator,
     List,
     Optional,
+    Set,
+    Tuple,
     Union,
+    cast,
 )
 
 import sse_starlette.sse
@@ -45,7 +50,19 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+from ..constants import (
+    XINFERENCE_EMBEDDING_BATCH_WAIT_MS,
+    XINFERENCE_EMBEDDING_MAX_BATCH_SIZE,
+    XINFERENCE_METRICS_FLUSH_INTERVAL,
+    XINFERENCE_REQUEST_QUEUE_SIZE,
+    XINFERENCE_REQUEST_QUEUE_TIMEOUT,
+    XINFERENCE_RERANK_BATCH_WAIT_MS,
+    XINFERENCE_RERANK_MAX_BATCH_PAIRS,
+    XINFERENCE_TRANSFORMERS_ENABLE_BATCHING,
+)
 from ..device_utils import empty_cache
+from .metrics import MetricsAggregator
+from .scheduler import BatchScheduler, MicroBatcher
 from .utils import json_dumps, log_async
 
 try:
@@ -63,24 +80,37 @@ def request_limit(fn):
     Used by ModelActor.
     As a decorator, added to a ModelActor method to control
     how many requests are accessing that method at the same time.
+    Requests beyond the limit wait in a bounded FIFO queue,
+    they are rejected if the queue is full or the wait times out.
+    A stream keeps its slot until its generator is destroyed.
     """
 
     async def wrapped_func(self, *args, **kwargs):
         logger.debug(
             f"Request {fn.__name__}, current serve request count: {self._serve_count}, request limit: {self._request_limits} for the model {self.model_uid()}"
         )
-        if self._request_limits is not None:
-            if 1 + self._serve_count <= self._request_limits:
-                self._serve_count += 1
-            else:
-                raise RuntimeError(
-                    f"Rate limit reached for the model. Request limit {self._request_limits} for the model: {self.model_uid()}"
-                )
+        self._pending_requests_count += 1
+        stream = False
         try:
-            ret = await fn(self, *args, **kwargs)
-        finally:
             if self._request_limits is not None:
-                self._serve_count -= 1
+                if (
+                    1 + self._serve_count <= self._request_limits
+                    and not self._request_waiters
+                ):
+                    self._serve_count += 1
+                else:
+                    await self._wait_for_request_slot()
+            try:
+                ret = await fn(self, *args, **kwargs)
+                if inspect.isgenerator(ret) or inspect.isasyncgen(ret):
+                    self._stream_requests.add(ret)
+                    stream = True
+            finally:
+                if self._request_limits is not None and not stream:
+                    self._release_request_slot()
+        finally:
+            if not stream:
+                self._pending_requests_count -= 1
             logger.debug(
                 f"After request {fn.__name__}, current serve request count: {self._serve_count} for the model {self.model_uid()}"
             )
@@ -125,6 +155,19 @@ class ModelActor(xo.StatelessActor):
         from ..model.llm.pytorch.core import PytorchModel as LLMPytorchModel
         from ..model.llm.vllm.core import VLLMModel as LLMVLLMModel
 
+        if self._metrics_flush_task is not None:
+            self._metrics_flush_task.cancel()
+            try:
+                await self.flush_metrics()
+            except Exception as e:  # pragma: no cover
+                logger.warning(
+                    "Failed to flush metrics of the model %s: %s", self.model_uid(), e
+                )
+
+        # The scheduler serves the gptq and awq models too.
+        if self._scheduler is not None:
+            await self._scheduler.stop()
+
         if (
             isinstance(self._model, (LLMPytorchModel, LLMVLLMModel))
             and self._model.model_spec.model_format == "pytorch"
@@ -153,6 +196,7 @@ class ModelActor(xo.StatelessActor):
         request_limits: Optional[int] = None,
     ):
         super().__init__()
+        from ..model.llm.ggml.llamacpp import LlamaCppModel
         from ..model.llm.pytorch.core import PytorchModel
         from ..model.llm.vllm.core import VLLMModel
 
@@ -162,16 +206,28 @@ class ModelActor(xo.StatelessActor):
             model_description.to_dict() if model_description else {}
         )
         self._request_limits = request_limits
+        self._request_waiters: Deque[asyncio.Future] = collections.deque()
 
         self._generators: Dict[str, Union[Iterator, AsyncGenerator]] = {}
+        # The generators of the unfinished streams holding the request slots.
+        self._stream_requests: Set[Union[Iterator, AsyncGenerator]] = set()
         self._current_generator = lambda: None
         self._lock = (
             None
             if isinstance(self._model, (PytorchModel, VLLMModel))
+            or (isinstance(self._model, LlamaCppModel) and self._model.n_parallel > 1)
             else asyncio.locks.Lock()
         )
         self._worker_ref = None
         self._serve_count = 0
+        # The queued and running requests, including the unfinished streams,
+        # used by the supervisor to route requests among replicas.
+        self._pending_requests_count = 0
+        # (dequeued time, wait time) of the recently queued requests,
+        # used by the supervisor to autoscale the replicas.
+        self._queue_wait_times: Deque[Tuple[float, float]] = collections.deque(
+            maxlen=1024
+        )
         self._metrics_labels = {
             "type": self._model_description.get("model_type", "unknown"),
             "model": self.model_uid(),
@@ -180,46 +236,189 @@ class ModelActor(xo.StatelessActor):
             "quantization": self._model_description.get("quantization", "none"),
         }
         self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._metrics_aggregator = MetricsAggregator()
+        self._metrics_flush_task: Optional[asyncio.Task] = None
+        self._scheduler: Optional[BatchScheduler] = None
+        self._embedding_batcher: Optional[MicroBatcher] = None
+        self._rerank_batcher: Optional[MicroBatcher] = None
 
     async def __post_create__(self):
         self._loop = asyncio.get_running_loop()
+        self._metrics_flush_task = asyncio.create_task(self._periodical_flush_metrics())
 
-    async def _record_completion_metrics(
-        self, duration, completion_tokens, prompt_tokens
+    async def __xoscar_destroy_generator__(self, generator_uid: str):
+        gen = self._generators.get(generator_uid)
+        await super().__xoscar_destroy_generator__(generator_uid)
+        if gen is not None:
+            try:
+                # The generator is destroyed by the caller before it is exhausted,
+                # e.g. the client is disconnected, close it to abort the generation.
+                await self._close_generator(gen)
+            finally:
+                self._release_stream_request(gen)
+
+    def _release_stream_request(self, gen: Union[Iterator, AsyncGenerator]):
+        if gen in self._stream_requests:
+            self._stream_requests.remove(gen)
+            if self._request_limits is not None:
+                self._release_request_slot()
+            self._pending_requests_count -= 1
+
+    @staticmethod
+    async def _close_generator(gen: Union[Iterator, AsyncGenerator]):
+        # Wait for the running step to finish, a running generator can't be closed.
+        if inspect.isasyncgen(gen):
+            while gen.ag_running:
+                await asyncio.sleep(0.1)
+            await gen.aclose()
+        elif inspect.isgenerator(gen):
+            while gen.gi_running:
+                await asyncio.sleep(0.1)
+            await asyncio.to_thread(gen.close)
+
+    def _record_completion_metrics(
+        self,
+        duration,
+        completion_tokens,
+        prompt_tokens,
+        time_to_first_token: Optional[float] = None,
     ):
-        coros = []
+        labels = self._metrics_labels
+        self._record_metrics(
+            "e2e_request_latency",
+            "observe",
+            {"labels": labels, "value": duration * 1000},
+        )
+        self._record_metrics(
+            "request_prompt_tokens",
+            "observe",
+            {"labels": labels, "value": prompt_tokens},
+        )
+        self._record_metrics(
+            "request_completion_tokens",
+            "observe",
+            {"labels": labels, "value": completion_tokens},
+        )
         if completion_tokens > 0:
-            coros.append(
-                self.record_metrics(
-                    "output_tokens_total_counter",
-                    "add",
-                    {
-                        "labels": self._metrics_labels,
-                        "value": completion_tokens,
-                    },
-                )
+            self._record_metrics(
+                "output_tokens_total_counter",
+                "add",
+                {
+                    "labels": labels,
+                    "value": completion_tokens,
+                },
             )
         if prompt_tokens > 0:
-            coros.append(
-                self.record_metrics(
-                    "input_tokens_total_counter",
-                    "add",
-                    {"labels": self._metrics_labels, "value": prompt_tokens},
-                )
+            self._record_metrics(
+                "input_tokens_total_counter",
+                "add",
+                {"labels": labels, "value": prompt_tokens},
             )
         if completion_tokens > 0:
             generate_throughput = completion_tokens / duration
-            coros.append(
-                self.record_metrics(
-                    "generate_throughput",
-                    "set",
-                    {
-                        "labels": self._metrics_labels,
-                        "value": generate_throughput,
-                    },
+            self._record_metrics(
+                "generate_throughput",
+                "set",
+                {
+                    "labels": labels,
+                    "value": generate_throughput,
+                },
+            )
+        if time_to_first_token is not None and completion_tokens > 1:
+            # The decode latency, the first token is counted by TTFT.
+            time_per_output_token = (duration * 1000 - time_to_first_token) / (
+                completion_tokens - 1
+            )
+            self._record_metrics(
+                "time_per_output_token",
+                "observe",
+                {"labels": labels, "value": time_per_output_token},
+            )
+
+    def _record_time_to_first_token(self, time_to_first_token: float):
+        kwargs = {"labels": self._metrics_labels, "value": time_to_first_token}
+        self._record_metrics("time_to_first_token", "set", kwargs)
+        self._record_metrics("time_to_first_token_histogram", "observe", kwargs)
+
+    async def _record_response_metrics(self, duration: float, response: Any):
+        """Record the metrics of a non stream completion or chat completion."""
+        if isinstance(response, bytes):
+            response = await asyncio.to_thread(json.loads, response)
+        if not isinstance(response, dict):
+            return
+        usage = response.get("usage")
+        # Some backends may not have a valid usage, we just skip them.
+        if not isinstance(usage, dict) or "completion_tokens" not in usage:
+            return
+        self._record_completion_metrics(
+            duration,
+            usage["completion_tokens"],
+            usage.get("prompt_tokens", 0),
+        )
+
+    def _rate_limit_error(self, reason: str = "") -> RuntimeError:
+        return RuntimeError(
+            f"Rate limit reached for the model. Request limit {self._request_limits} for the model: {self.model_uid()}"
+            + (f", {reason}" if reason else "")
+        )
+
+    def _record_request_queue_size(self):
+        self._record_metrics(
+            "request_queue_size",
+            "set",
+            {"labels": self._metrics_labels, "value": len(self._request_waiters)},
+        )
+
+    async def _wait_for_request_slot(self):
+        if len(self._request_waiters) >= XINFERENCE_REQUEST_QUEUE_SIZE:
+            raise self._rate_limit_error(
+                f"request queue size {XINFERENCE_REQUEST_QUEUE_SIZE}"
+                if XINFERENCE_REQUEST_QUEUE_SIZE > 0
+                else ""
+            )
+        waiter = asyncio.get_running_loop().create_future()
+        self._request_waiters.append(waiter)
+        start_time = time.time()
+        self._record_request_queue_size()
+        try:
+            # The slot is handed over by `_release_request_slot`,
+            # so the serve count is not changed here.
+            await asyncio.wait_for(
+                waiter, timeout=XINFERENCE_REQUEST_QUEUE_TIMEOUT or None
+            )
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over right before giving up, pass it on.
+                self._release_request_slot()
+            try:
+                self._request_waiters.remove(waiter)
+            except ValueError:
+                pass
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._rate_limit_error(
+                    f"waited in queue for {XINFERENCE_REQUEST_QUEUE_TIMEOUT}s"
                 )
+            raise
+        finally:
+            end_time = time.time()
+            self._queue_wait_times.append((end_time, end_time - start_time))
+            self._record_request_queue_size()
+            self._record_metrics(
+                "request_queue_wait_time",
+                "observe",
+                {
+                    "labels": self._metrics_labels,
+                    "value": (end_time - start_time) * 1000,
+                },
             )
-        await asyncio.gather(*coros)
+
+    def _release_request_slot(self):
+        while self._request_waiters:
+            waiter = self._request_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._serve_count -= 1
 
     async def _get_worker_ref(self) -> xo.ActorRefType["WorkerActor"]:
         from .worker import WorkerActor
@@ -230,13 +429,64 @@ class ModelActor(xo.StatelessActor):
             )
         return self._worker_ref
 
+    def get_pending_requests_count(self) -> int:
+        return self._pending_requests_count
+
+    def get_load_stats(self, window: float) -> Dict[str, Any]:
+        """
+        Get the load of the model for the supervisor to autoscale the replicas,
+        the queue wait time is the mean of the requests dequeued in the last
+        `window` seconds.
+        """
+        since = time.time() - window
+        wait_times = [t for end, t in self._queue_wait_times if end >= since]
+        return {
+            "pending_requests": self._pending_requests_count,
+            "queued_requests": len(self._request_waiters),
+            "queue_wait_time": (
+                sum(wait_times) / len(wait_times) if wait_times else 0.0
+            ),
+        }
+
     def is_vllm_backend(self) -> bool:
         from ..model.llm.vllm.core import VLLMModel
 
         return isinstance(self._model, VLLMModel)
 
-    def load(self):
+    def allow_batching(self) -> bool:
+        from ..model.llm.pytorch.core import PytorchModel
+
+        return (
+            XINFERENCE_TRANSFORMERS_ENABLE_BATCHING
+            and isinstance(self._model, PytorchModel)
+            and self._model.support_batching()
+        )
+
+    async def load(self):
+        from ..model.embedding.core import EmbeddingModel
+        from ..model.rerank.core import RerankModel
+
         self._model.load()
+        if isinstance(self._model, EmbeddingModel):
+            self._embedding_batcher = MicroBatcher(
+                self._model.batch_create_embedding,
+                max_wait=XINFERENCE_EMBEDDING_BATCH_WAIT_MS / 1000,
+                max_batch_size=XINFERENCE_EMBEDDING_MAX_BATCH_SIZE,
+            )
+        elif isinstance(self._model, RerankModel):
+            self._rerank_batcher = MicroBatcher(
+                self._model.batch_rerank,
+                max_wait=XINFERENCE_RERANK_BATCH_WAIT_MS / 1000,
+                max_batch_size=XINFERENCE_RERANK_MAX_BATCH_PAIRS,
+            )
+        if self.allow_batching():
+            self._scheduler = BatchScheduler(
+                self._model, self._model.get_max_num_seqs()
+            )
+            self._scheduler.start()
+            logger.info(
+                "Continuous batching is enabled for the model %s", self.model_uid()
+            )
 
     def model_uid(self):
         return (
@@ -266,22 +516,25 @@ class ModelActor(xo.StatelessActor):
             )
             os._exit(1)
         finally:
+            # Stop the backend generation if the generator is aborted.
+            gen.close()
+            # The metrics are aggregated in the actor's event loop.
             if self._loop is not None and time_to_first_token is not None:
-                coro = self.record_metrics(
-                    "time_to_first_token",
-                    "set",
-                    {"labels": self._metrics_labels, "value": time_to_first_token},
+                self._loop.call_soon_threadsafe(
+                    self._record_time_to_first_token, time_to_first_token
                 )
-                asyncio.run_coroutine_threadsafe(coro, loop=self._loop)
             if self._loop is not None and final_usage is not None:
-                coro = self._record_completion_metrics(
-                    time.time() - start_time,
-                    completion_tokens=final_usage["completion_tokens"],
-                    prompt_tokens=final_usage["prompt_tokens"],
+                self._loop.call_soon_threadsafe(
+                    functools.partial(
+                        self._record_completion_metrics,
+                        time.time() - start_time,
+                        completion_tokens=final_usage["completion_tokens"],
+                        prompt_tokens=final_usage["prompt_tokens"],
+                        time_to_first_token=time_to_first_token,
+                    )
                 )
-                asyncio.run_coroutine_threadsafe(coro, loop=self._loop)
 
-    async def _to_json_async_gen(self, gen: types.AsyncGeneratorType):
+    async def _to_json_async_gen(self, gen: AsyncGenerator):
         start_time = time.time()
         time_to_first_token = None
         final_usage = None
@@ -299,24 +552,17 @@ class ModelActor(xo.StatelessActor):
             )
             os._exit(1)
         finally:
-            coros = []
+            # Stop the backend generation if the generator is aborted.
+            await gen.aclose()
             if time_to_first_token is not None:
-                coros.append(
-                    self.record_metrics(
-                        "time_to_first_token",
-                        "set",
-                        {"labels": self._metrics_labels, "value": time_to_first_token},
-                    )
-                )
+                self._record_time_to_first_token(time_to_first_token)
             if final_usage is not None:
-                coros.append(
-                    self._record_completion_metrics(
-                        time.time() - start_time,
-                        completion_tokens=final_usage["completion_tokens"],
-                        prompt_tokens=final_usage["prompt_tokens"],
-                    )
+                self._record_completion_metrics(
+                    time.time() - start_time,
+                    completion_tokens=final_usage["completion_tokens"],
+                    prompt_tokens=final_usage["prompt_tokens"],
+                    time_to_first_token=time_to_first_token,
                 )
-            await asyncio.gather(*coros)
 
     @oom_check
     async def _call_wrapper(self, fn: Callable, *args, **kwargs):
@@ -345,27 +591,64 @@ class ModelActor(xo.StatelessActor):
             return gen
         return await asyncio.to_thread(json_dumps, ret)
 
+    @oom_check
+    async def _handle_batching_request(
+        self, prompt: str, call_ability: str, *args, **kwargs
+    ):
+        from ..model.llm.pytorch.core import PytorchModel
+
+        assert self._scheduler is not None
+        # Only the transformers models are served by the scheduler.
+        model = cast(PytorchModel, self._model)
+        prepare = getattr(model, f"prepare_batch_{call_ability}_request")
+        req = prepare(prompt, *args, **kwargs)
+        self._scheduler.add_request(req)
+        if req.stream:
+            gen = model.batch_stream_response(req, self._scheduler.stream_results(req))
+            return self._to_json_async_gen(gen)
+        ret = model.batch_response(req, await self._scheduler.wait_result(req))
+        return await asyncio.to_thread(json_dumps, ret)
+
     @log_async(logger=logger)
-    @request_limit
     @xo.generator
+    @request_limit
     async def generate(self, prompt: str, *args, **kwargs):
-        if hasattr(self._model, "generate"):
-            return await self._call_wrapper(
-                self._model.generate, prompt, *args, **kwargs
-            )
-        if hasattr(self._model, "async_generate"):
-            return await self._call_wrapper(
-                self._model.async_generate, prompt, *args, **kwargs
-            )
-        raise AttributeError(f"Model {self._model.model_spec} is not for generate.")
+        start_time = time.time()
+        response = None
+        try:
+            if self._scheduler is not None:
+                response = await self._handle_batching_request(
+                    prompt, "generate", *args, **kwargs
+                )
+                return response
+            if hasattr(self._model, "generate"):
+                response = await self._call_wrapper(
+                    self._model.generate, prompt, *args, **kwargs
+                )
+                return response
+            if hasattr(self._model, "async_generate"):
+                response = await self._call_wrapper(
+                    self._model.async_generate, prompt, *args, **kwargs
+                )
+                return response
+            raise AttributeError(f"Model {self._model.model_spec} is not for generate.")
+        finally:
+            # For the non stream result, the stream result is recorded
+            # by the json generators.
+            await self._record_response_metrics(time.time() - start_time, response)
 
     @log_async(logger=logger)
-    @request_limit
     @xo.generator
+    @request_limit
     async def chat(self, prompt: str, *args, **kwargs):
         start_time = time.time()
         response = None
         try:
+            if self._scheduler is not None and hasattr(self._model, "chat"):
+                response = await self._handle_batching_request(
+                    prompt, "chat", *args, **kwargs
+                )
+                return response
             if hasattr(self._model, "chat"):
                 response = await self._call_wrapper(
                     self._model.chat, prompt, *args, **kwargs
@@ -378,26 +661,22 @@ class ModelActor(xo.StatelessActor):
                 return response
             raise AttributeError(f"Model {self._model.model_spec} is not for chat.")
         finally:
-            # For the non stream result.
-            record = None
-            if isinstance(response, Generator) or isinstance(response, AsyncGenerator):
-                record = response
-            elif isinstance(response, bytes):
-                record = json.loads(response)
-            if record and isinstance(record, dict):
-                usage = record["usage"]
-                # Some backends may not have a valid usage, we just skip them.
-                completion_tokens = usage["completion_tokens"]
-                prompt_tokens = usage["prompt_tokens"]
-                await self._record_completion_metrics(
-                    time.time() - start_time,
-                    completion_tokens,
-                    prompt_tokens,
-                )
+            # For the non stream result, the stream result is recorded
+            # by the json generators.
+            await self._record_response_metrics(time.time() - start_time, response)
+
+    @oom_check
+    async def _batch_create_embedding(self, input: Union[str, List[str]], **kwargs):
+        assert self._embedding_batcher is not None
+        size = 1 if isinstance(input, str) else len(input)
+        ret = await self._embedding_batcher.submit((input, kwargs), size)
+        return await asyncio.to_thread(json_dumps, ret)
 
     @log_async(logger=logger)
     @request_limit
     async def create_embedding(self, input: Union[str, List[str]], *args, **kwargs):
+        if self._embedding_batcher is not None and not args:
+            return await self._batch_create_embedding(input, **kwargs)
         if hasattr(self._model, "create_embedding"):
             return await self._call_wrapper(
                 self._model.create_embedding, input, *args, **kwargs
@@ -407,6 +686,23 @@ class ModelActor(xo.StatelessActor):
             f"Model {self._model.model_spec} is not for creating embedding."
         )
 
+    @oom_check
+    async def _batch_rerank(
+        self,
+        documents: List[str],
+        query: str,
+        top_n: Optional[int],
+        max_chunks_per_doc: Optional[int],
+        return_documents: Optional[bool],
+        **kwargs,
+    ):
+        assert self._rerank_batcher is not None
+        ret = await self._rerank_batcher.submit(
+            (documents, query, top_n, max_chunks_per_doc, return_documents, kwargs),
+            max(1, len(documents)),
+        )
+        return await asyncio.to_thread(json_dumps, ret)
+
     @log_async(logger=logger)
     @request_limit
     async def rerank(
@@ -419,6 +715,15 @@ class ModelActor(xo.StatelessActor):
         *args,
         **kwargs,
     ):
+        if self._rerank_batcher is not None and not args:
+            return await self._batch_rerank(
+                documents,
+                query,
+                top_n,
+                max_chunks_per_doc,
+                return_documents,
+                **kwargs,
+            )
         if hasattr(self._model, "rerank"):
             return await self._call_wrapper(
                 self._model.rerank,
@@ -537,3 +842,52 @@ class ModelActor(xo.StatelessActor):
     async def record_metrics(self, name, op, kwargs):
         worker_ref = await self._get_worker_ref()
         await worker_ref.record_metrics(name, op, kwargs)
+
+    def _record_metrics(self, name, op, kwargs):
+        # Aggregated locally and sent to the worker by `flush_metrics`.
+        self._metrics_aggregator.record(name, op, kwargs)
+
+    def _record_spec_decode_metrics(self):
+        from ..model.llm.pytorch.core import PytorchModel
+
+        if not isinstance(self._model, PytorchModel):
+            return
+        num_draft_tokens, num_accepted_tokens = self._model.get_spec_decode_stats()
+        if num_draft_tokens == 0:
+            return
+        labels = self._metrics_labels
+        self._record_metrics(
+            "spec_decode_draft_tokens_total_counter",
+            "add",
+            {"labels": labels, "value": num_draft_tokens},
+        )
+        self._record_metrics(
+            "spec_decode_accepted_tokens_total_counter",
+            "add",
+            {"labels": labels, "value": num_accepted_tokens},
+        )
+        self._record_metrics(
+            "spec_decode_acceptance_rate",
+            "set",
+            {"labels": labels, "value": num_accepted_tokens / num_draft_tokens},
+        )
+
+    async def flush_metrics(self):
+        self._record_spec_decode_metrics()
+        records = self._metrics_aggregator.collect()
+        if records:
+            worker_ref = await self._get_worker_ref()
+            await worker_ref.record_metrics_batch(records)
+
+    async def _periodical_flush_metrics(self):
+        while True:
+            try:
+                await asyncio.sleep(XINFERENCE_METRICS_FLUSH_INTERVAL)
+            except asyncio.CancelledError:
+                break
+            try:
+                await self.flush_metrics()
+            except Exception as e:
+                logger.warning(
+                    "Failed to flush metrics of the model %s: %s", self.model_uid(), e
+                )
@@ -12,13 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from dataclasses import dataclass
-from typing import Dict, Union
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Union
 
 import psutil
 
 from .utils import get_nvidia_gpu_info
 
+logger = logging.getLogger(__name__)
+
 
 @dataclass
 class ResourceStatus:
@@ -34,10 +39,136 @@ class GPUStatus:
     mem_total: float
     mem_free: float
     mem_used: float
+    util: Optional[float] = None
+    # In watts.
+    power: Optional[float] = None
+    # In degrees Celsius.
+    temperature: Optional[float] = None
+    # The GPU memory used by each process, pid: bytes.
+    process_mem_used: Dict[int, float] = field(default_factory=dict)
+    # The GPU memory used by each model on the worker, model uid: bytes.
+    model_mem_used: Dict[str, float] = field(default_factory=dict)
+
+
+class GPUSampler:
+    """
+    Sample the NVIDIA GPUs in a background thread with one NVML session,
+    instead of initializing NVML for every status report.
+    """
+
+    def __init__(self, interval: float):
+        self._interval = interval
+        self._handles: list = []
+        self._status: Dict[str, GPUStatus] = {}
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        from pynvml import nvmlDeviceGetCount, nvmlDeviceGetHandleByIndex, nvmlInit
+
+        nvmlInit()
+        self._handles = [
+            nvmlDeviceGetHandleByIndex(i) for i in range(nvmlDeviceGetCount())
+        ]
+        self._status = self.sample()
+        self._thread = threading.Thread(
+            name="GPU Sampler", target=self._run, daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        from pynvml import nvmlShutdown
+
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            nvmlShutdown()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self._status = self.sample()
+            except Exception:
+                logger.exception("Failed to sample the GPUs")
+
+    def sample(self) -> Dict[str, GPUStatus]:
+        from pynvml import (
+            NVML_TEMPERATURE_GPU,
+            NVMLError,
+            nvmlDeviceGetComputeRunningProcesses,
+            nvmlDeviceGetMemoryInfo,
+            nvmlDeviceGetPowerUsage,
+            nvmlDeviceGetTemperature,
+            nvmlDeviceGetUtilizationRates,
+        )
+
+        def _get(func, *args):
+            # Not all the metrics are supported by every GPU.
+            try:
+                return func(*args)
+            except NVMLError:
+                return None
+
+        status = {}
+        for i, handle in enumerate(self._handles):
+            mem_info = nvmlDeviceGetMemoryInfo(handle)
+            util = _get(nvmlDeviceGetUtilizationRates, handle)
+            power = _get(nvmlDeviceGetPowerUsage, handle)
+            processes = _get(nvmlDeviceGetComputeRunningProcesses, handle) or []
+            status[f"gpu-{i}"] = GPUStatus(
+                mem_total=mem_info.total,
+                mem_free=mem_info.free,
+                mem_used=mem_info.used,
+                util=util.gpu / 100.0 if util is not None else None,
+                power=power / 1000.0 if power is not None else None,
+                temperature=_get(
+                    nvmlDeviceGetTemperature, handle, NVML_TEMPERATURE_GPU
+                ),
+                process_mem_used={p.pid: p.usedGpuMemory or 0 for p in processes},
+            )
+        return status
+
+    def get_status(self) -> Dict[str, GPUStatus]:
+        """
+        The latest sampled status of each GPU.
+        """
+        return dict(self._status)
 
 
-def gather_node_info() -> Dict[str, Union[ResourceStatus, GPUStatus]]:
-    node_resource = dict()
+class NoGPUSampler:
+    """
+    The sampler on the hosts without NVIDIA GPUs, reports the given status for
+    testing.
+    """
+
+    def __init__(self, status: Optional[Dict[str, GPUStatus]] = None):
+        self._status = status or {}
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def get_status(self) -> Dict[str, GPUStatus]:
+        return dict(self._status)
+
+
+def create_gpu_sampler(interval: float) -> Union[GPUSampler, NoGPUSampler]:
+    sampler = GPUSampler(interval)
+    try:
+        sampler.start()
+    except Exception:
+        logger.debug("Cannot sample the GPUs with NVML, no GPU status is reported.")
+        return NoGPUSampler()
+    return sampler
+
+
+def gather_node_info(
+    gpu_status: Optional[Dict[str, GPUStatus]] = None
+) -> Dict[str, Union[ResourceStatus, GPUStatus]]:
+    node_resource: Dict[str, Union[ResourceStatus, GPUStatus]] = dict()
     mem_info = psutil.virtual_memory()
     node_resource["cpu"] = ResourceStatus(
         usage=psutil.cpu_percent() / 100.0,
@@ -46,11 +177,59 @@ def gather_node_info() -> Dict[str, Union[ResourceStatus, GPUStatus]]:
         memory_available=mem_info.available,
         memory_total=mem_info.total,
     )
+    if gpu_status is not None:
+        node_resource.update(gpu_status)
+        return node_resource
     for gpu_idx, gpu_info in get_nvidia_gpu_info().items():
-        node_resource[gpu_idx] = GPUStatus(  # type: ignore
+        node_resource[gpu_idx] = GPUStatus(
             mem_total=gpu_info["total"],
             mem_used=gpu_info["used"],
             mem_free=gpu_info["free"],
         )
 
-    return node_resource  # type: ignore
+    return node_resource
+
+
+# Activations, KV cache and the runtime buffers on top of the weights.
+MODEL_MEMORY_OVERHEAD_RATIO = 1.2
+
+
+def _get_bytes_per_param(model_format: Optional[str], quantization: Optional[str]):
+    quantization = (quantization or "none").lower()
+    if model_format in ("ggmlv3", "ggufv2"):
+        # e.g. q4_0, q4_k_m, Q8_0, fp16
+        match = re.search(r"q(\d)", quantization)
+        if match:
+            # The block scales take about 0.5 bit per param.
+            return (int(match.group(1)) + 0.5) / 8
+        return 4 if "32" in quantization else 2
+    if model_format in ("gptq", "awq"):
+        return 1 if "8" in quantization else 0.5
+    if quantization == "8-bit":
+        return 1
+    if quantization == "4-bit":
+        return 0.5
+    return 2
+
+
+def estimate_model_memory(
+    model_size_in_billions: Optional[Union[int, str]],
+    model_format: Optional[str] = None,
+    quantization: Optional[str] = None,
+) -> Optional[float]:
+    """
+    Estimate the memory in bytes to serve an LLM, None if the size is unknown.
+    """
+    if model_size_in_billions is None:
+        return None
+    try:
+        # The size could be a string like "1_8".
+        size = float(str(model_size_in_billions).replace("_", "."))
+    except ValueError:
+        return None
+    return (
+        size
+        * 1e9
+        * _get_bytes_per_param(model_format, quantization)
+        * MODEL_MEMORY_OVERHEAD_RATIO
+    )
@@ -0,0 +1,295 @@
+# Copyright 2022-2024 XProbe Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+import uuid
+from collections import deque
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
+
+logger = logging.getLogger(__name__)
+
+XINFERENCE_STREAMING_DONE_FLAG = "<XINFERENCE_STREAMING_DONE>"
+
+
+class InferenceRequest:
+    """
+    A single generate or chat request scheduled by the `BatchScheduler`.
+    The model fills in the token and cache states while the request is running,
+    and appends the produced chunks (or the final completion) to `outputs`.
+    """
+
+    def __init__(
+        self,
+        prompt: str,
+        generate_config: Mapping[str, Any],
+        call_ability: str = "generate",
+        tools: Optional[List[Dict]] = None,
+    ):
+        self.request_id = str(uuid.uuid1())
+        self.prompt = prompt
+        self.generate_config = generate_config
+        self.call_ability = call_ability
+        self.tools = tools
+        self.stream = bool(generate_config.get("stream", False))
+
+        # Token and cache states, owned by the model.
+        self.prompt_tokens: List[int] = []
+        self.new_tokens: List[int] = []
+        self.kv_cache: Any = None
+        self.is_prefill = True
+        # The number of prompt tokens in the kv cache while prefilling.
+        self.num_prefilled_tokens = 0
+        # Sampling states, initialized by the model at prefill.
+        self.sampling_params: Dict[str, Any] = {}
+
+        self.stopped = False
+        self.finish_reason: Optional[str] = None
+        self.aborted = False
+        self.error: Optional[BaseException] = None
+
+        # Output states.
+        self.last_output_length = 0
+        self.outputs: List[Any] = []
+        self._result_queue: Optional[asyncio.Queue] = None
+
+    @property
+    def result_queue(self) -> asyncio.Queue:
+        assert self._result_queue is not None
+        return self._result_queue
+
+
+class BatchScheduler:
+    """
+    Continuous batching scheduler running in the model actor's event loop.
+
+    Requests are admitted from a FIFO waiting queue into the running batch
+    between steps, so a new request does not wait for the whole batch to finish.
+    Each step calls `model.batch_inference` in a thread, which advances every
+    running request by one token.
+    """
+
+    def __init__(self, model, max_num_seqs: int = 16):
+        self._model = model
+        self._max_num_seqs = max(1, max_num_seqs)
+        self._waiting_queue: Deque[InferenceRequest] = deque()
+        self._running_queue: Deque[InferenceRequest] = deque()
+        self._has_request = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for req in list(self._running_queue) + list(self._waiting_queue):
+            req.kv_cache = None
+            if req._result_queue is not None:
+                req.result_queue.put_nowait(
+                    RuntimeError("The model is stopped, request aborted.")
+                )
+        self._running_queue.clear()
+        self._waiting_queue.clear()
+
+    @property
+    def num_running(self) -> int:
+        return len(self._running_queue)
+
+    @property
+    def num_waiting(self) -> int:
+        return len(self._waiting_queue)
+
+    def add_request(self, req: InferenceRequest):
+        req._result_queue = asyncio.Queue()
+        self._waiting_queue.append(req)
+        self._has_request.set()
+
+    def abort_request(self, req: InferenceRequest):
+        """The request is dropped before the next step."""
+        if not req.stopped:
+            logger.info("Abort request %s", req.request_id)
+            req.aborted = True
+
+    def _schedule(self) -> List[InferenceRequest]:
+        for queue in (self._waiting_queue, self._running_queue):
+            for req in [r for r in queue if r.aborted]:
+                queue.remove(req)
+                req.kv_cache = None
+        while self._waiting_queue and len(self._running_queue) < self._max_num_seqs:
+            self._running_queue.append(self._waiting_queue.popleft())
+        return list(self._running_queue)
+
+    def _finish_request(self, req: InferenceRequest):
+        self._running_queue.remove(req)
+        req.kv_cache = None
+        if req.error is not None:
+            req.result_queue.put_nowait(req.error)
+        else:
+            req.result_queue.put_nowait(XINFERENCE_STREAMING_DONE_FLAG)
+
+    async def step(self):
+        req_list = self._schedule()
+        if not req_list:
+            return
+        try:
+            await asyncio.to_thread(self._model.batch_inference, req_list)
+        except Exception as e:
+            # The model stops the single requests that fail by themselves, this
+            # is a failure of the whole step, e.g. the batched decode forward.
+            logger.exception("Batch inference failed, model: %s", self._model.model_uid)
+            for req in req_list:
+                req.error = e
+                req.stopped = True
+        for req in req_list:
+            for output in req.outputs:
+                req.result_queue.put_nowait(output)
+            req.outputs = []
+            if req.stopped:
+                self._finish_request(req)
+
+    async def _run(self):
+        while True:
+            if not self._running_queue and not self._waiting_queue:
+                self._has_request.clear()
+                await self._has_request.wait()
+            await self.step()
+
+    async def stream_results(self, req: InferenceRequest) -> AsyncGenerator[Any, None]:
+        done = False
+        try:
+            while True:
+                output = await req.result_queue.get()
+                if isinstance(output, str) and output == XINFERENCE_STREAMING_DONE_FLAG:
+                    done = True
+                    break
+                if isinstance(output, BaseException):
+                    done = True
+                    raise output
+                yield output
+        finally:
+            # The consumer is gone, e.g. cancelled or the generator is closed.
+            if not done:
+                self.abort_request(req)
+
+    async def wait_result(self, req: InferenceRequest) -> Any:
+        result = None
+        async for output in self.stream_results(req):
+            result = output
+        return result
+
+
+class MicroBatcher:
+    """
+    Collect the concurrent calls of a model within a short window and run them
+    with one `batch_fn` call in a thread. `batch_fn` receives the list of items
+    and returns one result per item, an exception result is raised to its caller.
+
+    A batch is flushed when the oldest pending item has waited `max_wait` seconds,
+    or the total size of the pending items reaches `max_batch_size`.
+    Items arriving while a batch is running are flushed together right after it.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], List[Any]],
+        max_wait: float = 0.0,
+        max_batch_size: int = 256,
+    ):
+        self._batch_fn = batch_fn
+        self._max_wait = max(0.0, max_wait)
+        self._max_batch_size = max(1, max_batch_size)
+        # (item, size, future, enqueue time)
+        self._pending: Deque[Tuple[Any, int, asyncio.Future, float]] = deque()
+        self._pending_size = 0
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def num_pending(self) -> int:
+        return len(self._pending)
+
+    async def submit(self, item: Any, size: int = 1) -> Any:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((item, size, fut, loop.time()))
+        self._pending_size += size
+        if self._pending_size >= self._max_batch_size:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return await fut
+
+    def _take_batch(self) -> List[Tuple[Any, asyncio.Future]]:
+        batch: List[Tuple[Any, asyncio.Future]] = []
+        batch_size = 0
+        while self._pending:
+            item, size, fut, _ = self._pending[0]
+            if batch and batch_size + size > self._max_batch_size:
+                break
+            self._pending.popleft()
+            self._pending_size -= size
+            if fut.done():
+                # The caller is gone.
+                continue
+            batch.append((item, fut))
+            batch_size += size
+        if self._pending_size < self._max_batch_size:
+            self._full.clear()
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            timeout = self._max_wait - (loop.time() - self._pending[0][3])
+            if timeout > 0 and not self._full.is_set():
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self._take_batch()
+            if not batch:
+                continue
+            try:
+                results = await asyncio.to_thread(
+                    self._batch_fn, [item for item, _ in batch]
+                )
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+            else:
+                for (_, fut), result in zip(batch, results):
+                    if fut.done():
+                        continue
+                    if isinstance(result, Exception):
+                        fut.set_exception(result)
+                    else:
+                        fut.set_result(result)
@@ -13,26 +13,50 @@
 # limitations under the License.
 
 import asyncio
+import hashlib
 import itertools
+import math
 import time
 import typing
-from dataclasses import dataclass
+from collections import defaultdict
+from dataclasses import dataclass, field
 from logging import getLogger
-from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import xoscar as xo
 
 from ..constants import (
+    XINFERENCE_AUTOSCALE_DRAIN_TIMEOUT,
+    XINFERENCE_AUTOSCALE_INTERVAL,
+    XINFERENCE_AUTOSCALE_QUEUE_WAIT_THRESHOLD,
+    XINFERENCE_AUTOSCALE_SCALE_DOWN_DELAY,
+    XINFERENCE_AUTOSCALE_TARGET_PENDING_REQUESTS,
     XINFERENCE_DISABLE_HEALTH_CHECK,
     XINFERENCE_HEALTH_CHECK_FAILURE_THRESHOLD,
     XINFERENCE_HEALTH_CHECK_INTERVAL,
     XINFERENCE_HEALTH_CHECK_TIMEOUT,
+    XINFERENCE_MAX_CONCURRENT_LAUNCHES_PER_WORKER,
+    XINFERENCE_PREFIX_AFFINITY_MAX_IMBALANCE,
+    XINFERENCE_ROUTING_PENDING_REQUESTS_TTL,
+    XINFERENCE_WORKER_PLACEMENT_STRATEGY,
 )
 from ..core import ModelActor
 from ..core.status_guard import InstanceInfo, LaunchStatus
 from ..types import PeftModelConfig
 from .metrics import record_metrics
-from .resource import GPUStatus, ResourceStatus
+from .resource import GPUStatus, ResourceStatus, estimate_model_memory
 from .utils import (
     build_replica_model_uid,
     gen_random_string,
@@ -71,10 +95,171 @@ class WorkerStatus:
     status: Dict[str, Union[ResourceStatus, GPUStatus]]
 
 
+# Pick the replicas in turn.
+ROUTING_POLICY_ROUND_ROBIN = "round_robin"
+# Pick the replica with the least queued and running requests.
+ROUTING_POLICY_LEAST_REQUESTS = "least_requests"
+# Keep the requests with the same prompt prefix on the same replica
+# to reuse its prefix cache, unless the replica is much busier.
+ROUTING_POLICY_PREFIX_AFFINITY = "prefix_affinity"
+ROUTING_POLICIES = (
+    ROUTING_POLICY_ROUND_ROBIN,
+    ROUTING_POLICY_LEAST_REQUESTS,
+    ROUTING_POLICY_PREFIX_AFFINITY,
+)
+
+
+@dataclass
+class AutoscaleInfo:
+    min_replica: int
+    max_replica: int
+    # Launch a replica of the model by the replica model uid.
+    launch_replica: Callable[[str], Awaitable[None]]
+    next_rep_id: int
+    # Since when the model has more replicas than its load needs.
+    scale_down_since: Optional[float] = None
+    # The description of the model scaled to zero.
+    description: Optional[Dict[str, Any]] = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
 @dataclass
 class ReplicaInfo:
-    replica: int
+    replica_model_uids: List[str]
     scheduler: Iterator
+    routing_policy: str = ROUTING_POLICY_ROUND_ROBIN
+    # Model refs of the replicas by the replica model uid, cached for routing.
+    model_refs: Dict[str, xo.ActorRefType["ModelActor"]] = field(default_factory=dict)
+    # Set if the replicas are scaled by the load.
+    autoscale: Optional[AutoscaleInfo] = None
+    # The replicas are loaded by the workers on demand, so their model refs
+    # are not cached.
+    lazy: bool = False
+
+    @property
+    def replica(self) -> int:
+        return len(self.replica_model_uids)
+
+
+def _get_affinity_score(routing_key: str, model_ref: xo.ActorRefType["ModelActor"]):
+    uid = model_ref.uid
+    if isinstance(uid, str):
+        uid = uid.encode()
+    return hashlib.md5(routing_key.encode() + b"\0" + uid).digest()
+
+
+# The pending request counts of the replicas by the address and uid,
+# with the time they expire.
+_pending_requests_counts: Dict[Tuple[str, Any], Tuple[int, float]] = {}
+
+
+async def _get_pending_requests_counts(
+    model_refs: List[xo.ActorRefType["ModelActor"]],
+) -> List[Union[int, BaseException]]:
+    now = time.time()
+    counts: List[Union[int, BaseException]] = [0] * len(model_refs)
+    stale = []
+    for rep_id, model_ref in enumerate(model_refs):
+        cached = _pending_requests_counts.get((model_ref.address, model_ref.uid))
+        if cached is not None and cached[1] > now:
+            counts[rep_id] = cached[0]
+        else:
+            stale.append(rep_id)
+    if not stale:
+        return counts
+
+    results = await asyncio.gather(
+        *[model_refs[rep_id].get_pending_requests_count() for rep_id in stale],
+        return_exceptions=True,
+    )
+    # Drop the expired counts, including the ones of the removed replicas.
+    for key, (_, expire) in list(_pending_requests_counts.items()):
+        if expire <= now:
+            del _pending_requests_counts[key]
+    expire = time.time() + XINFERENCE_ROUTING_PENDING_REQUESTS_TTL
+    for rep_id, result in zip(stale, results):
+        counts[rep_id] = result
+        # The errors are not cached, the replica is asked again next time.
+        if not isinstance(result, BaseException):
+            model_ref = model_refs[rep_id]
+            _pending_requests_counts[(model_ref.address, model_ref.uid)] = (
+                result,
+                expire,
+            )
+    return counts
+
+
+def _add_pending_request(model_ref: xo.ActorRefType["ModelActor"]):
+    # Count the routed request until the cached count expires, so the requests
+    # in the meantime are not all routed to the same replica.
+    key = (model_ref.address, model_ref.uid)
+    cached = _pending_requests_counts.get(key)
+    if cached is not None:
+        _pending_requests_counts[key] = (cached[0] + 1, cached[1])
+
+
+async def choose_replica(
+    model_refs: List[xo.ActorRefType["ModelActor"]],
+    scheduler: Iterator,
+    routing_policy: str,
+    routing_key: Optional[str] = None,
+) -> xo.ActorRefType["ModelActor"]:
+    """
+    Choose the replica to serve a request by the routing policy, the routing
+    key is the prompt prefix of the request for the prefix affinity policy,
+    which falls back to the least requests policy without it. The pending
+    request counts of the replicas are cached for a short while.
+    """
+    if routing_policy == ROUTING_POLICY_ROUND_ROBIN or len(model_refs) == 1:
+        return model_refs[next(scheduler) % len(model_refs)]
+
+    counts = await _get_pending_requests_counts(model_refs)
+    available = {
+        rep_id: count
+        for rep_id, count in enumerate(counts)
+        if not isinstance(count, BaseException)
+    }
+    if not available:
+        # All replicas are unavailable, raise the error of the first one.
+        error = counts[0]
+        assert isinstance(error, BaseException)
+        raise error
+    if routing_policy == ROUTING_POLICY_PREFIX_AFFINITY and routing_key is not None:
+        # Rendezvous hashing, the prefix stays on its replica
+        # when the other replicas are added or removed.
+        rep_id = max(
+            available,
+            key=lambda i: _get_affinity_score(routing_key, model_refs[i]),  # type: ignore
+        )
+        least_count = min(available.values())
+        if available[rep_id] - least_count <= XINFERENCE_PREFIX_AFFINITY_MAX_IMBALANCE:
+            _add_pending_request(model_refs[rep_id])
+            return model_refs[rep_id]
+    # Break the ties in round robin, so the concurrent requests
+    # that see the same counts are spread among the replicas.
+    start = next(scheduler)
+    rep_id = min(
+        available,
+        key=lambda i: (available[i], (i - start) % len(model_refs)),
+    )
+    _add_pending_request(model_refs[rep_id])
+    return model_refs[rep_id]
+
+
+def get_desired_replica(
+    replica: int,
+    min_replica: int,
+    max_replica: int,
+    pending_requests: int,
+    queue_wait_time: float,
+) -> int:
+    """
+    Get the number of replicas an autoscaled model needs for its load.
+    """
+    desired = math.ceil(pending_requests / XINFERENCE_AUTOSCALE_TARGET_PENDING_REQUESTS)
+    if queue_wait_time > XINFERENCE_AUTOSCALE_QUEUE_WAIT_THRESHOLD:
+        desired = max(desired, replica + 1)
+    return min(max(desired, min_replica), max_replica)
 
 
 class SupervisorActor(xo.StatelessActor):
@@ -86,6 +271,24 @@ class SupervisorActor(xo.StatelessActor):
             str, xo.ActorRefType["WorkerActor"]
         ] = {}
         self._model_uid_to_replica_info: Dict[str, ReplicaInfo] = {}  # type: ignore
+        # Replica model uid -> (worker address, estimated memory, launched time),
+        # the memory of the models being launched is not reported by the workers yet.
+        self._placement_reservations: Dict[  # type: ignore
+            str, Tuple[str, float, Optional[float]]
+        ] = {}
+        # Choosing a worker and reserving its memory must not interleave
+        # between the replicas launched concurrently.
+        self._placement_lock = asyncio.Lock()
+        self._worker_launch_semaphores: Dict[str, asyncio.Semaphore] = {}
+        # Worker address -> the number of models being launched on it,
+        # which are not counted by the worker yet.
+        self._worker_launching_counts: Dict[str, int] = defaultdict(int)
+        # Bumped when the running models change, watched by the RESTful API
+        # to invalidate its cache of models.
+        self._model_changes_version = 0
+        self._model_changes_event = asyncio.Event()
+        self._autoscale_task: Optional[asyncio.Task] = None
+        self._autoscale_tasks: Set[asyncio.Task] = set()
         self._uptime = None
         self._lock = asyncio.Lock()
 
@@ -104,6 +307,7 @@ class SupervisorActor(xo.StatelessActor):
 
     async def __post_create__(self):
         self._uptime = time.time()
+        self._autoscale_task = asyncio.create_task(self._periodical_autoscale())
         if not XINFERENCE_DISABLE_HEALTH_CHECK:
             # Run _check_dead_nodes() in a dedicated thread.
             from ..isolation import Isolation
@@ -216,6 +420,10 @@ class SupervisorActor(xo.StatelessActor):
             model_version_infos, self.address
         )
 
+    async def __pre_destroy__(self):
+        if self._autoscale_task is not None:
+            self._autoscale_task.cancel()
+
     @typing.no_type_check
     async def get_cluster_device_info(self, detailed: bool = False) -> List:
         import psutil
@@ -297,25 +505,85 @@ class SupervisorActor(xo.StatelessActor):
         worker_ref = await self._choose_worker()
         return await worker_ref.get_devices_count()
 
-    async def _choose_worker(self) -> xo.ActorRefType["WorkerActor"]:
-        # TODO: better allocation strategy.
-        min_running_model_count = None
-        target_worker = None
-
-        workers = list(self._worker_address_to_worker.values())
-        for worker in workers:
-            running_model_count = await worker.get_model_count()
-            if (
-                min_running_model_count is None
-                or running_model_count < min_running_model_count
+    def _get_worker_free_memory(
+        self, worker_address: str, n_gpu: Optional[Union[int, str]]
+    ) -> Optional[float]:
+        """
+        The free memory of the devices that a model with `n_gpu` would use,
+        minus the memory reserved for the models being launched on the worker.
+        None if the worker has not reported its status yet.
+        """
+        worker_status = self._worker_status.get(worker_address)
+        if worker_status is None:
+            return None
+        gpu_free = sorted(
+            (
+                status.mem_free
+                for status in worker_status.status.values()
+                if isinstance(status, GPUStatus)
+            ),
+            reverse=True,
+        )
+        if n_gpu is not None and gpu_free:
+            # The worker gives one GPU to a model with n_gpu="auto".
+            free = sum(gpu_free[: n_gpu if isinstance(n_gpu, int) else 1])
+        else:
+            free = worker_status.status["cpu"].memory_available  # type: ignore
+        for address, memory, launched_time in self._placement_reservations.values():
+            # The launched models are counted by the status reported after that.
+            if address == worker_address and (
+                launched_time is None or launched_time >= worker_status.update_time
             ):
-                min_running_model_count = running_model_count
-                target_worker = worker
-
-        if target_worker:
-            return target_worker
+                free -= memory
+        return free
 
-        raise RuntimeError("No available worker found")
+    async def _choose_worker(
+        self,
+        memory_footprint: Optional[float] = None,
+        n_gpu: Optional[Union[int, str]] = "auto",
+    ) -> xo.ActorRefType["WorkerActor"]:
+        workers = list(self._worker_address_to_worker.items())
+        if not workers:
+            raise RuntimeError("No available worker found")
+
+        model_counts = [
+            count + self._worker_launching_counts.get(address, 0)
+            for (address, _), count in zip(
+                workers,
+                await asyncio.gather(
+                    *[worker.get_model_count() for _, worker in workers]
+                ),
+            )
+        ]
+        free_memory = [
+            self._get_worker_free_memory(address, n_gpu) for address, _ in workers
+        ]
+        if any(free is None for free in free_memory):
+            # Not all the workers have reported the resources,
+            # choose the worker with the least running models.
+            return workers[model_counts.index(min(model_counts))][1]
+
+        candidates: List[Tuple[xo.ActorRefType["WorkerActor"], int, float]] = [
+            (worker, count, free)  # type: ignore
+            for (_, worker), count, free in zip(workers, model_counts, free_memory)
+        ]
+        footprint = memory_footprint or 0
+        feasible = [c for c in candidates if c[2] >= footprint]
+        strategy = XINFERENCE_WORKER_PLACEMENT_STRATEGY
+        if not feasible:
+            logger.warning(
+                "No worker has enough free memory for the model, "
+                "estimated memory: %.2f GB, choose the worker with the most.",
+                footprint / 1e9,
+            )
+            feasible, strategy = candidates, "spread"
+        if strategy == "binpack":
+            # Fill the worker with the least free memory that fits the model,
+            # leaves the large free memory for the large models.
+            target = min(feasible, key=lambda c: (c[2], c[1]))
+        else:
+            target = min(feasible, key=lambda c: (-c[2], c[1]))
+        return target[0]
 
     @log_sync(logger=logger)
     def get_status(self) -> Dict:
@@ -733,11 +1001,17 @@ class SupervisorActor(xo.StatelessActor):
         replica: int = 1,
         n_gpu: Optional[Union[int, str]] = "auto",
         request_limits: Optional[int] = None,
+        routing_policy: str = ROUTING_POLICY_ROUND_ROBIN,
+        min_replica: Optional[int] = None,
+        max_replica: Optional[int] = None,
+        lazy: bool = False,
+        pinned: bool = False,
         wait_ready: bool = True,
         model_version: Optional[str] = None,
         peft_model_config: Optional[PeftModelConfig] = None,
         worker_ip: Optional[str] = None,
         gpu_idx: Optional[Union[int, List[int]]] = None,
+        gpu_memory: Optional[Union[float, str]] = None,
         **kwargs,
     ) -> str:
         target_ip_worker_ref = (
@@ -758,6 +1032,36 @@ class SupervisorActor(xo.StatelessActor):
         if model_uid is None:
             model_uid = self._gen_model_uid(model_name)
 
+        n_gpu_count = n_gpu if isinstance(n_gpu, int) else 1
+        if gpu_memory == "auto":
+            estimated_memory = (
+                self._estimate_llm_memory(
+                    model_name, model_size_in_billions, model_format, quantization
+                )
+                if (model_type or "LLM") == "LLM"
+                else None
+            )
+            if estimated_memory is None:
+                raise ValueError(
+                    "Cannot estimate the GPU memory of the model, "
+                    "please specify `gpu_memory` in GiB."
+                )
+            # The model is split evenly across its GPUs.
+            gpu_memory = estimated_memory / n_gpu_count / 1024**3
+        elif gpu_memory is not None:
+            gpu_memory = float(gpu_memory)
+
+        if lazy:
+            memory_footprint = None
+        elif gpu_memory is not None:
+            memory_footprint = gpu_memory * 1024**3 * n_gpu_count
+        elif (model_type or "LLM") == "LLM":
+            memory_footprint = self._estimate_llm_memory(
+                model_name, model_size_in_billions, model_format, quantization
+            )
+        else:
+            memory_footprint = None
+
         model_size = str(model_size_in_billions) if model_size_in_billions else ""
         logger.debug(
             f"Enter launch_builtin_model, model_uid: {model_uid}, model_name: {model_name}, model_size: {model_size}, "
@@ -771,33 +1075,79 @@ class SupervisorActor(xo.StatelessActor):
                 )
 
             nonlocal model_type
-            worker_ref = (
-                target_ip_worker_ref
-                if target_ip_worker_ref is not None
-                else await self._choose_worker()
-            )
+            async with self._placement_lock:
+                worker_ref = (
+                    target_ip_worker_ref
+                    if target_ip_worker_ref is not None
+                    else await self._choose_worker(memory_footprint, n_gpu)
+                )
+                if memory_footprint is not None:
+                    self._placement_reservations[_replica_model_uid] = (
+                        worker_ref.address,
+                        memory_footprint,
+                        None,
+                    )
+                self._worker_launching_counts[worker_ref.address] += 1
             # LLM as default for compatibility
             model_type = model_type or "LLM"
-            await worker_ref.launch_builtin_model(
-                model_uid=_replica_model_uid,
-                model_name=model_name,
-                model_size_in_billions=model_size_in_billions,
-                model_format=model_format,
-                quantization=quantization,
-                model_engine=model_engine,
-                model_type=model_type,
-                n_gpu=n_gpu,
-                request_limits=request_limits,
-                peft_model_config=peft_model_config,
-                gpu_idx=gpu_idx,
-                **kwargs,
-            )
+            try:
+                async with self._get_worker_launch_semaphore(worker_ref.address):
+                    await worker_ref.launch_builtin_model(
+                        model_uid=_replica_model_uid,
+                        model_name=model_name,
+                        model_size_in_billions=model_size_in_billions,
+                        model_format=model_format,
+                        quantization=quantization,
+                        model_engine=model_engine,
+                        model_type=model_type,
+                        n_gpu=n_gpu,
+                        request_limits=request_limits,
+                        peft_model_config=peft_model_config,
+                        gpu_idx=gpu_idx,
+                        gpu_memory=gpu_memory,
+                        lazy=lazy,
+                        pinned=pinned,
+                        **kwargs,
+                    )
+            except BaseException:
+                self._placement_reservations.pop(_replica_model_uid, None)
+                raise
+            finally:
+                self._worker_launching_counts[worker_ref.address] -= 1
+            if memory_footprint is not None:
+                # Keep it until the worker reports the status with the model loaded.
+                self._placement_reservations[_replica_model_uid] = (
+                    worker_ref.address,
+                    memory_footprint,
+                    time.time(),
+                )
             self._replica_model_uid_to_worker[_replica_model_uid] = worker_ref
 
         async def _launch_model():
             try:
-                for rep_model_uid in iter_replica_model_uid(model_uid, replica):
-                    await _launch_one_model(rep_model_uid)
+                tasks = [
+                    asyncio.create_task(_launch_one_model(rep_model_uid))
+                    for rep_model_uid in iter_replica_model_uid(model_uid, replica)
+                ]
+                try:
+                    await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+                finally:
+                    # Stop the other replicas once one fails, and wait for all of
+                    # them to settle before the cleanup.
+                    for task in tasks:
+                        task.cancel()
+                    results = await asyncio.gather(*tasks, return_exceptions=True)
+                errors = [r for r in results if isinstance(r, BaseException)]
+                if errors:
+                    raise next(
+                        (
+                            e
+                            for e in errors
+                            if not isinstance(e, asyncio.CancelledError)
+                        ),
+                        errors[0],
+                    )
+                self._notify_model_changes()
             except Exception:
                 # terminate_model will remove the replica info.
                 await self.terminate_model(model_uid, suppress_exception=True)
@@ -816,11 +1166,40 @@ class SupervisorActor(xo.StatelessActor):
                 "The `request_limits` parameter must be greater or equal than 0."
             )
 
+        if routing_policy not in ROUTING_POLICIES:
+            raise ValueError(
+                f"Invalid routing policy: {routing_policy}, "
+                f"available policies: {ROUTING_POLICIES}"
+            )
+
+        autoscale = None
+        if max_replica is not None and lazy:
+            raise ValueError("The lazy model cannot be autoscaled.")
+        if max_replica is not None:
+            min_replica = 1 if min_replica is None else min_replica
+            if not 0 <= min_replica <= replica <= max_replica:
+                raise ValueError(
+                    "The replica count must satisfy "
+                    "0 <= `min_replica` <= `replica` <= `max_replica`."
+                )
+            autoscale = AutoscaleInfo(
+                min_replica=min_replica,
+                max_replica=max_replica,
+                launch_replica=_launch_one_model,
+                next_rep_id=replica,
+            )
+        elif min_replica is not None:
+            raise ValueError("The `min_replica` parameter requires `max_replica`.")
+
         if model_uid in self._model_uid_to_replica_info:
             raise ValueError(f"Model is already in the model list, uid: {model_uid}")
         # Set replica info first for exception handler to terminate model.
         self._model_uid_to_replica_info[model_uid] = ReplicaInfo(
-            replica=replica, scheduler=itertools.cycle(range(replica))
+            replica_model_uids=list(iter_replica_model_uid(model_uid, replica)),
+            scheduler=itertools.count(),
+            routing_policy=routing_policy,
+            autoscale=autoscale,
+            lazy=lazy,
         )
         instance_info = InstanceInfo(
             model_name=model_name,
@@ -840,6 +1219,36 @@ class SupervisorActor(xo.StatelessActor):
             task.add_done_callback(lambda _: callback_for_async_launch(model_uid))
         return model_uid
 
+    def _get_worker_launch_semaphore(self, address: str) -> asyncio.Semaphore:
+        if address not in self._worker_launch_semaphores:
+            self._worker_launch_semaphores[address] = asyncio.Semaphore(
+                XINFERENCE_MAX_CONCURRENT_LAUNCHES_PER_WORKER
+            )
+        return self._worker_launch_semaphores[address]
+
+    @staticmethod
+    def _estimate_llm_memory(
+        model_name: str,
+        model_size_in_billions: Optional[Union[int, str]],
+        model_format: Optional[str],
+        quantization: Optional[str],
+    ) -> Optional[float]:
+        from ..model.llm import match_llm
+
+        if model_size_in_billions is None or model_format is None:
+            # Fill in the missing spec like the worker does when launching.
+            try:
+                match_result = match_llm(
+                    model_name, model_format, model_size_in_billions, quantization
+                )
+            except Exception:
+                match_result = None
+            if match_result is not None:
+                _, llm_spec, quantization = match_result
+                model_size_in_billions = llm_spec.model_size_in_billions
+                model_format = llm_spec.model_format
+        return estimate_model_memory(model_size_in_billions, model_format, quantization)
+
     async def get_instance_info(
         self, model_name: Optional[str], model_uid: Optional[str]
     ) -> List[Dict]:
@@ -885,6 +1294,8 @@ class SupervisorActor(xo.StatelessActor):
                             self._replica_model_uid_to_worker.pop(
                                 replica_model_uid, None
                             )
+                        if dead_models:
+                            self._notify_model_changes()
                         dead_nodes.append(address)
                     elif (
                         status.failure_remaining_count
@@ -918,13 +1329,14 @@ class SupervisorActor(xo.StatelessActor):
         if replica_info is None:
             raise ValueError(f"Model not found in the model list, uid: {model_uid}")
 
-        for rep_model_uid in iter_replica_model_uid(model_uid, replica_info.replica):
+        for rep_model_uid in list(replica_info.replica_model_uids):
             try:
                 await _terminate_one_model(rep_model_uid)
             except Exception:
                 if not suppress_exception:
                     raise
         self._model_uid_to_replica_info.pop(model_uid, None)
+        self._notify_model_changes()
 
     @log_async(logger=logger)
     async def get_model(self, model_uid: str) -> xo.ActorRefType["ModelActor"]:
@@ -932,25 +1344,284 @@ class SupervisorActor(xo.StatelessActor):
         if replica_info is None:
             raise ValueError(f"Model not found in the model list, uid: {model_uid}")
 
-        replica_model_uid = build_replica_model_uid(
-            model_uid, replica_info.replica, next(replica_info.scheduler)
+        if replica_info.lazy:
+            # Get the ref from the worker every time,
+            # which loads the model if it is not loaded yet.
+            replica_model_uid = replica_info.replica_model_uids[
+                next(replica_info.scheduler) % replica_info.replica
+            ]
+            worker_ref = self._replica_model_uid_to_worker.get(replica_model_uid, None)
+            if worker_ref is None:
+                raise ValueError(
+                    f"Model not found in the model list, uid: {replica_model_uid}"
+                )
+            return await worker_ref.get_model(model_uid=replica_model_uid)
+        if replica_info.replica == 0 and replica_info.autoscale is not None:
+            await self._scale_from_zero(model_uid, replica_info)
+        model_refs = await self._get_replica_model_refs(model_uid, replica_info)
+        return await choose_replica(
+            model_refs, replica_info.scheduler, replica_info.routing_policy
         )
 
-        worker_ref = self._replica_model_uid_to_worker.get(replica_model_uid, None)
-        if worker_ref is None:
-            raise ValueError(
-                f"Model not found in the model list, uid: {replica_model_uid}"
+    async def _get_replica_model_refs(
+        self, model_uid: str, replica_info: ReplicaInfo
+    ) -> List[xo.ActorRefType["ModelActor"]]:
+        for replica_model_uid in list(replica_info.replica_model_uids):
+            if replica_model_uid in replica_info.model_refs:
+                continue
+            worker_ref = self._replica_model_uid_to_worker.get(replica_model_uid, None)
+            if worker_ref is None:
+                raise ValueError(
+                    f"Model not found in the model list, uid: {replica_model_uid}"
+                )
+            replica_info.model_refs[replica_model_uid] = await worker_ref.get_model(
+                model_uid=replica_model_uid
             )
-        return await worker_ref.get_model(model_uid=replica_model_uid)
+        return [
+            replica_info.model_refs[replica_model_uid]
+            for replica_model_uid in replica_info.replica_model_uids
+        ]
+
+    @log_async(logger=logger)
+    async def get_model_replicas(self, model_uid: str) -> Dict[str, Any]:
+        """
+        Get the model refs of all the replicas, the routing policy and the model
+        description, for the RESTful API to cache them and route requests itself.
+        """
+        replica_info = self._model_uid_to_replica_info.get(model_uid, None)
+        if replica_info is None:
+            raise ValueError(f"Model not found in the model list, uid: {model_uid}")
+        return {
+            "model_refs": (
+                []
+                if replica_info.lazy
+                else await self._get_replica_model_refs(model_uid, replica_info)
+            ),
+            "routing_policy": replica_info.routing_policy,
+            "description": await self.describe_model(model_uid),
+            "lazy": replica_info.lazy,
+        }
+
+    def _notify_model_changes(self):
+        self._model_changes_version += 1
+        self._model_changes_event.set()
+        self._model_changes_event = asyncio.Event()
+
+    async def wait_model_changes(self, version: int, timeout: float) -> int:
+        """
+        Wait until the running models change after `version`, i.e. a model is
+        launched or terminated, or the timeout. Return the current version.
+        """
+        if version == self._model_changes_version:
+            try:
+                await asyncio.wait_for(self._model_changes_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._model_changes_version
+
+    async def _periodical_autoscale(self):
+        while True:
+            await asyncio.sleep(XINFERENCE_AUTOSCALE_INTERVAL)
+            for model_uid, replica_info in list(
+                self._model_uid_to_replica_info.items()
+            ):
+                # The model being scaled is checked in the next round.
+                if (
+                    replica_info.autoscale is None
+                    or replica_info.autoscale.lock.locked()
+                ):
+                    continue
+                task = asyncio.create_task(
+                    self._autoscale_model(model_uid, replica_info)
+                )
+                self._autoscale_tasks.add(task)
+                task.add_done_callback(self._autoscale_tasks.discard)
+
+    async def _autoscale_model(self, model_uid: str, replica_info: ReplicaInfo):
+        autoscale = replica_info.autoscale
+        assert autoscale is not None
+        async with autoscale.lock:
+            if self._model_uid_to_replica_info.get(model_uid) is not replica_info:
+                # The model is terminated.
+                return
+            try:
+                model_refs = await self._get_replica_model_refs(model_uid, replica_info)
+            except ValueError:
+                # The model is still launching.
+                return
+            replica_model_uids = list(replica_info.replica_model_uids)
+            stats = await asyncio.gather(
+                *[
+                    model_ref.get_load_stats(XINFERENCE_AUTOSCALE_INTERVAL)
+                    for model_ref in model_refs
+                ],
+                return_exceptions=True,
+            )
+            pending_requests: Dict[str, int] = {}
+            queue_wait_time = 0.0
+            for replica_model_uid, stat in zip(replica_model_uids, stats):
+                if isinstance(stat, BaseException):
+                    logger.warning(
+                        "Failed to get the load of the model %s: %s",
+                        replica_model_uid,
+                        stat,
+                    )
+                    # Remove the unavailable replica first.
+                    pending_requests[replica_model_uid] = -1
+                    continue
+                pending_requests[replica_model_uid] = stat["pending_requests"]
+                queue_wait_time = max(queue_wait_time, stat["queue_wait_time"])
+
+            replica = replica_info.replica
+            desired = get_desired_replica(
+                replica,
+                autoscale.min_replica,
+                autoscale.max_replica,
+                sum(max(count, 0) for count in pending_requests.values()),
+                queue_wait_time,
+            )
+            if desired > replica:
+                autoscale.scale_down_since = None
+                logger.info(
+                    "Scale up the model %s from %d to %d replicas",
+                    model_uid,
+                    replica,
+                    desired,
+                )
+                await self._scale_up(model_uid, replica_info, desired - replica)
+            elif desired < replica:
+                now = time.time()
+                if autoscale.scale_down_since is None:
+                    autoscale.scale_down_since = now
+                if (
+                    now - autoscale.scale_down_since
+                    >= XINFERENCE_AUTOSCALE_SCALE_DOWN_DELAY
+                ):
+                    # Remove the least loaded replica, one per delay.
+                    autoscale.scale_down_since = now
+                    replica_model_uid = min(
+                        pending_requests, key=lambda uid: pending_requests[uid]
+                    )
+                    logger.info(
+                        "Scale down the model %s from %d to %d replicas",
+                        model_uid,
+                        replica,
+                        replica - 1,
+                    )
+                    await self._scale_down(model_uid, replica_info, replica_model_uid)
+            else:
+                autoscale.scale_down_since = None
+
+    async def _scale_from_zero(self, model_uid: str, replica_info: ReplicaInfo):
+        autoscale = replica_info.autoscale
+        assert autoscale is not None
+        async with autoscale.lock:
+            # Concurrent requests wait for the same launch.
+            if replica_info.replica == 0:
+                logger.info("Launch the model %s scaled to zero", model_uid)
+                await self._scale_up(model_uid, replica_info, 1)
+
+    async def _scale_up(self, model_uid: str, replica_info: ReplicaInfo, count: int):
+        autoscale = replica_info.autoscale
+        assert autoscale is not None
+        replica = replica_info.replica + count
+        replica_model_uids = []
+        for _ in range(count):
+            replica_model_uids.append(
+                build_replica_model_uid(model_uid, replica, autoscale.next_rep_id)
+            )
+            autoscale.next_rep_id += 1
+        results = await asyncio.gather(
+            *[autoscale.launch_replica(uid) for uid in replica_model_uids],
+            return_exceptions=True,
+        )
+        launched = []
+        errors = []
+        for replica_model_uid, result in zip(replica_model_uids, results):
+            if isinstance(result, BaseException):
+                logger.error(
+                    "Failed to launch the model %s: %s", replica_model_uid, result
+                )
+                errors.append(result)
+            else:
+                launched.append(replica_model_uid)
+
+        if self._model_uid_to_replica_info.get(model_uid) is not replica_info:
+            # The model is terminated while launching.
+            for replica_model_uid in launched:
+                await self._terminate_replica(replica_model_uid)
+            raise ValueError(f"Model not found in the model list, uid: {model_uid}")
+        if launched:
+            replica_info.replica_model_uids.extend(launched)
+            autoscale.description = None
+            await self._update_replica_count(model_uid, replica_info)
+        elif errors:
+            raise errors[0]
+
+    async def _scale_down(
+        self, model_uid: str, replica_info: ReplicaInfo, replica_model_uid: str
+    ):
+        autoscale = replica_info.autoscale
+        assert autoscale is not None
+        if replica_info.replica == 1:
+            # Keep listing the model scaled to zero.
+            autoscale.description = await self.describe_model(model_uid)
+        # Stop routing requests to the replica first.
+        model_ref = replica_info.model_refs.pop(replica_model_uid, None)
+        replica_info.replica_model_uids.remove(replica_model_uid)
+        await self._update_replica_count(model_uid, replica_info)
+
+        if model_ref is not None:
+            deadline = time.time() + XINFERENCE_AUTOSCALE_DRAIN_TIMEOUT
+            while True:
+                try:
+                    pending = await model_ref.get_pending_requests_count()
+                except Exception:
+                    break
+                if pending == 0:
+                    break
+                if time.time() >= deadline:
+                    logger.warning(
+                        "Replica %s is terminated with %d pending requests cut off, "
+                        "they did not finish in %s seconds.",
+                        replica_model_uid,
+                        pending,
+                        XINFERENCE_AUTOSCALE_DRAIN_TIMEOUT,
+                    )
+                    break
+                await asyncio.sleep(1)
+        await self._terminate_replica(replica_model_uid)
+
+    async def _terminate_replica(self, replica_model_uid: str):
+        worker_ref = self._replica_model_uid_to_worker.pop(replica_model_uid, None)
+        if worker_ref is None:
+            return
+        try:
+            await worker_ref.terminate_model(model_uid=replica_model_uid)
+        except Exception:
+            logger.exception("Failed to terminate the model %s", replica_model_uid)
+
+    async def _update_replica_count(self, model_uid: str, replica_info: ReplicaInfo):
+        await self._status_guard_ref.update_instance_info(
+            model_uid, {"replica": replica_info.replica}
+        )
+        self._notify_model_changes()
 
     @log_async(logger=logger)
     async def describe_model(self, model_uid: str) -> Dict[str, Any]:
         replica_info = self._model_uid_to_replica_info.get(model_uid, None)
         if replica_info is None:
             raise ValueError(f"Model not found in the model list, uid: {model_uid}")
-        # Use rep id 0 to instead of next(replica_info.scheduler) to avoid
+        if replica_info.replica == 0:
+            if (
+                replica_info.autoscale is None
+                or replica_info.autoscale.description is None
+            ):
+                raise ValueError(f"Model not found in the model list, uid: {model_uid}")
+            return {**replica_info.autoscale.description, "replica": 0}
+        # Use the first replica instead of next(replica_info.scheduler) to avoid
         # consuming the generator.
-        replica_model_uid = build_replica_model_uid(model_uid, replica_info.replica, 0)
+        replica_model_uid = replica_info.replica_model_uids[0]
         worker_ref = self._replica_model_uid_to_worker.get(replica_model_uid, None)
         if worker_ref is None:
             raise ValueError(
@@ -968,6 +1639,14 @@ class SupervisorActor(xo.StatelessActor):
         for worker in workers:
             ret.update(await worker.list_models())
         running_model_info = {parse_replica_model_uid(k)[0]: v for k, v in ret.items()}
+        # the models scaled to zero are still listed
+        for k, replica_info in self._model_uid_to_replica_info.items():
+            if (
+                k not in running_model_info
+                and replica_info.autoscale is not None
+                and replica_info.autoscale.description is not None
+            ):
+                running_model_info[k] = dict(replica_info.autoscale.description)
         # add replica count
         for k, v in running_model_info.items():
             v["replica"] = self._model_uid_to_replica_info[k].replica
@@ -1003,7 +1682,10 @@ class SupervisorActor(xo.StatelessActor):
             model_uid, _, _ = parse_replica_model_uid(replica_model_uid)
             self._model_uid_to_replica_info.pop(model_uid, None)
             self._replica_model_uid_to_worker.pop(replica_model_uid, None)
+        if uids_to_remove:
+            self._notify_model_changes()
 
+        self._worker_launch_semaphores.pop(worker_address, None)
         if worker_address in self._worker_address_to_worker:
             del self._worker_address_to_worker[worker_address]
             logger.debug("Worker %s has been removed successfully", worker_address)
@@ -1026,6 +1708,16 @@ class SupervisorActor(xo.StatelessActor):
             worker_status = self._worker_status[worker_address]
             worker_status.update_time = time.time()
             worker_status.status = status
+        # The launched models are counted by this status.
+        for replica_model_uid, (address, _, launched_time) in list(
+            self._placement_reservations.items()
+        ):
+            if (
+                address == worker_address
+                and launched_time is not None
+                and launched_time < self._worker_status[worker_address].update_time
+            ):
+                self._placement_reservations.pop(replica_model_uid, None)
 
     @staticmethod
     def record_metrics(name, op, kwargs):
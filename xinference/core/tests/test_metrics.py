@@ -108,3 +108,33 @@ async def test_metrics_exporter_data(setup_cluster):
     response = requests.get(metrics_exporter_address)
     assert response.ok
     assert 'format="ggmlv3",model="orca"' in response.text
+
+
+def test_metrics_aggregator():
+    from .. import metrics
+    from ..metrics import MetricsAggregator, record_metrics_batch
+
+    labels = {"model": "test_metrics_aggregator"}
+    aggregator = MetricsAggregator()
+    for v in (5, 50, 500):
+        aggregator.record(
+            "e2e_request_latency", "observe", {"labels": labels, "value": v}
+        )
+        aggregator.record(
+            "input_tokens_total_counter", "add", {"labels": labels, "value": v}
+        )
+        aggregator.record("generate_throughput", "set", {"labels": labels, "value": v})
+    records = aggregator.collect()
+    # One record per metric no matter how many requests.
+    assert len(records) == 3
+    assert aggregator.collect() == []
+
+    record_metrics_batch(records)
+    record_metrics_batch(records)
+    assert metrics.input_tokens_total_counter.get(labels) == 1110
+    assert metrics.generate_throughput.get(labels) == 500
+    h = metrics.e2e_request_latency.get(labels)
+    assert h["count"] == 6
+    assert h["sum"] == 1110
+    assert h[10.0] == 2
+    assert h[100.0] == 4
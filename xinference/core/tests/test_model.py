@@ -0,0 +1,257 @@
+# Copyright 2022-2024 XProbe Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import time
+from typing import List
+
+import pytest
+import pytest_asyncio
+import xoscar as xo
+from xoscar import create_actor_pool
+
+from .. import model as model_module
+from ..model import ModelActor
+
+
+class MockWorkerActor(xo.StatelessActor):
+    def __init__(self):
+        super().__init__()
+        self._metrics = []
+
+    @classmethod
+    def uid(cls) -> str:
+        return "worker"
+
+    def record_metrics_batch(self, records):
+        for name, op, _, value in records:
+            if op == "observe":
+                # The mean of the aggregated observations.
+                value = value["sum"] / value["count"]
+            self._metrics.append((name, value))
+
+    def get_metrics(self):
+        return self._metrics
+
+
+class MockModel:
+    model_uid = "mock_model"
+
+    async def generate(self, prompt, generate_config=None):
+        await asyncio.sleep(0.2)
+        return {"text": prompt}
+
+
+class MockUsageModel:
+    model_uid = "mock_usage_model"
+
+    def generate(self, prompt, generate_config=None):
+        usage = {"prompt_tokens": 3, "completion_tokens": 5, "total_tokens": 8}
+        if not (generate_config or {}).get("stream"):
+            return {"text": prompt, "usage": usage}
+
+        def _gen():
+            for _ in range(4):
+                time.sleep(0.01)
+                yield {"text": prompt}
+            yield {"text": prompt, "usage": usage}
+
+        return _gen()
+
+
+CLOSED_GENERATORS: List[str] = []
+
+
+class MockStreamModel:
+    model_uid = "mock_stream_model"
+
+    def generate(self, prompt, generate_config=None):
+        def _gen():
+            try:
+                while True:
+                    yield {"text": prompt}
+            finally:
+                CLOSED_GENERATORS.append(prompt)
+
+        return _gen()
+
+
+class MockParallelModelActor(ModelActor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Serve the streams in parallel like the transformers models.
+        self._lock = None
+
+
+@pytest_asyncio.fixture
+async def setup_pool():
+    pool = await create_actor_pool(
+        f"test://127.0.0.1:{xo.utils.get_next_port()}", n_process=0
+    )
+    async with pool:
+        yield pool
+
+
+@pytest.mark.asyncio
+async def test_request_queue(setup_pool, monkeypatch):
+    pool = setup_pool
+    addr = pool.external_address
+    worker = await xo.create_actor(
+        MockWorkerActor, address=addr, uid=MockWorkerActor.uid()
+    )
+    model = await xo.create_actor(
+        ModelActor, addr, MockModel(), request_limits=1, address=addr, uid="model"
+    )
+
+    # No queue, reject directly.
+    monkeypatch.setattr(model_module, "XINFERENCE_REQUEST_QUEUE_SIZE", 0)
+    results = await asyncio.gather(
+        model.generate("a"), model.generate("b"), return_exceptions=True
+    )
+    assert sum(isinstance(r, RuntimeError) for r in results) == 1
+    assert "Rate limit reached" in str(
+        next(r for r in results if isinstance(r, Exception))
+    )
+
+    # The queued requests are served in order.
+    monkeypatch.setattr(model_module, "XINFERENCE_REQUEST_QUEUE_SIZE", 2)
+    task = asyncio.gather(
+        model.generate("a"),
+        model.generate("b"),
+        model.generate("c"),
+        model.generate("d"),
+        return_exceptions=True,
+    )
+    await asyncio.sleep(0.1)
+    await model.flush_metrics()
+    assert ("request_queue_size", 2) in await worker.get_metrics()
+    results = await task
+    assert [r for r in results if not isinstance(r, Exception)] == [
+        b'{"text":"a"}',
+        b'{"text":"b"}',
+        b'{"text":"c"}',
+    ]
+    assert isinstance(results[3], RuntimeError)
+    await model.flush_metrics()
+    metrics = await worker.get_metrics()
+    assert ("request_queue_size", 0) in metrics
+    assert any(name == "request_queue_wait_time" for name, _ in metrics)
+
+    # Timeout in queue.
+    monkeypatch.setattr(model_module, "XINFERENCE_REQUEST_QUEUE_TIMEOUT", 0.1)
+    results = await asyncio.gather(
+        model.generate("a"), model.generate("b"), return_exceptions=True
+    )
+    assert isinstance(results[1], RuntimeError)
+    assert "waited in queue" in str(results[1])
+
+    # All slots are released.
+    assert await model.generate("e") == b'{"text":"e"}'
+
+
+@pytest.mark.asyncio
+async def test_abort_generation(setup_pool):
+    pool = setup_pool
+    addr = pool.external_address
+    await xo.create_actor(MockWorkerActor, address=addr, uid=MockWorkerActor.uid())
+    model = await xo.create_actor(
+        ModelActor, addr, MockStreamModel(), address=addr, uid="stream_model"
+    )
+
+    iterator = await model.generate("a")
+    assert b"text" in await iterator.__anext__()
+    assert b"text" in await iterator.__anext__()
+    assert CLOSED_GENERATORS == []
+    # The unfinished stream is a pending request.
+    assert await model.get_pending_requests_count() == 1
+    await iterator.destroy()
+    assert CLOSED_GENERATORS == ["a"]
+    assert await model.get_pending_requests_count() == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_request_limit(setup_pool, monkeypatch):
+    pool = setup_pool
+    addr = pool.external_address
+    await xo.create_actor(MockWorkerActor, address=addr, uid=MockWorkerActor.uid())
+    model = await xo.create_actor(
+        MockParallelModelActor,
+        addr,
+        MockStreamModel(),
+        request_limits=2,
+        address=addr,
+        uid="stream_model",
+    )
+    monkeypatch.setattr(model_module, "XINFERENCE_REQUEST_QUEUE_SIZE", 0)
+
+    # The concurrent streams hold the slots before they are iterated.
+    iterators = await asyncio.gather(model.generate("a"), model.generate("b"))
+    assert await model.get_pending_requests_count() == 2
+    with pytest.raises(RuntimeError, match="Rate limit reached"):
+        await model.generate("c")
+    assert b"text" in await iterators[0].__anext__()
+    with pytest.raises(RuntimeError, match="Rate limit reached"):
+        await model.generate("c")
+
+    # The slot is released once the stream is destroyed.
+    await iterators[0].destroy()
+    assert await model.get_pending_requests_count() == 1
+    iterator = await model.generate("c")
+    assert b"text" in await iterator.__anext__()
+    await asyncio.gather(iterator.destroy(), iterators[1].destroy())
+    assert await model.get_pending_requests_count() == 0
+
+    # The slot is released once the stream is exhausted.
+    model = await xo.create_actor(
+        ModelActor,
+        addr,
+        MockUsageModel(),
+        request_limits=1,
+        address=addr,
+        uid="usage_model",
+    )
+    for _ in range(2):
+        iterator = await model.generate("a", {"stream": True})
+        assert len([chunk async for chunk in iterator]) == 5
+    assert await model.get_pending_requests_count() == 0
+
+
+@pytest.mark.asyncio
+async def test_record_metrics(setup_pool):
+    pool = setup_pool
+    addr = pool.external_address
+    worker = await xo.create_actor(
+        MockWorkerActor, address=addr, uid=MockWorkerActor.uid()
+    )
+    model = await xo.create_actor(
+        ModelActor, addr, MockUsageModel(), address=addr, uid="usage_model"
+    )
+
+    await model.generate("a")
+    await model.flush_metrics()
+    metrics = dict(await worker.get_metrics())
+    assert metrics["request_prompt_tokens"] == 3
+    assert metrics["request_completion_tokens"] == 5
+    assert metrics["e2e_request_latency"] > 0
+    assert "time_per_output_token" not in metrics
+
+    iterator = await model.generate("a", {"stream": True})
+    assert len([chunk async for chunk in iterator]) == 5
+    await asyncio.sleep(0.1)
+    await model.flush_metrics()
+    metrics = dict(await worker.get_metrics())
+    ttft = metrics["time_to_first_token_histogram"]
+    assert ttft == metrics["time_to_first_token"]
+    assert metrics["e2e_request_latency"] >= ttft
+    assert metrics["time_per_output_token"] > 0
@@ -12,18 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import json
+import multiprocessing
 import os
 import os.path
 import sys
 import time
+from typing import Dict, List, Optional
 
 import openai
 import pytest
 import requests
+import xoscar as xo
 from packaging import version
 
 from ...model.embedding import BUILTIN_EMBEDDING_MODELS
+from ..supervisor import ROUTING_POLICY_ROUND_ROBIN, SupervisorActor
 
 
 @pytest.mark.asyncio
@@ -1266,3 +1271,145 @@ def test_cluster_info(setup):
     assert result[1]["node_type"] == "Worker"
     assert result[1]["gpu_count"] == 0
     assert result[1]["gpu_vram_total"] == 0
+
+
+class MockSupervisorActor(xo.StatelessActor):
+    def __init__(self):
+        super().__init__()
+        self._model_refs: Dict[str, List[str]] = {}
+        self._version = 0
+        self._event = asyncio.Event()
+        self._get_model_replicas_count = 0
+
+    def set_model(self, model_uid: str, model_refs: Optional[List[str]]):
+        # Launch, relaunch or terminate a model if `model_refs` is None.
+        if model_refs is None:
+            self._model_refs.pop(model_uid)
+        else:
+            self._model_refs[model_uid] = model_refs
+        self._version += 1
+        self._event.set()
+        self._event = asyncio.Event()
+
+    def get_model_replicas_count(self) -> int:
+        return self._get_model_replicas_count
+
+    def get_model_replicas(self, model_uid: str):
+        self._get_model_replicas_count += 1
+        if model_uid not in self._model_refs:
+            raise ValueError(f"Model not found in the model list, uid: {model_uid}")
+        return {
+            "model_refs": self._model_refs[model_uid],
+            "routing_policy": ROUTING_POLICY_ROUND_ROBIN,
+            "description": {},
+            "lazy": False,
+        }
+
+    async def wait_model_changes(self, version: int, timeout: float) -> int:
+        if version == self._version:
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._version
+
+
+async def _wait_for(predicate, timeout: float = 10):
+    start = time.time()
+    while not predicate():
+        assert time.time() - start < timeout
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_model_cache_invalidation():
+    from ...api.restful_api import RESTfulAPI
+
+    pool = await xo.create_actor_pool(
+        f"test://127.0.0.1:{xo.utils.get_next_port()}", n_process=0
+    )
+    async with pool:
+        supervisor = await xo.create_actor(
+            MockSupervisorActor,
+            address=pool.external_address,
+            uid=SupervisorActor.uid(),
+        )
+        await supervisor.set_model("model_1", ["replica_1"])
+        api = RESTfulAPI(pool.external_address, "127.0.0.1", 0)
+        try:
+            # The cache is enabled once the version is known.
+            await api._get_model_info("model_1")
+            await _wait_for(lambda: api._model_cache_version == 1)
+            info = await api._get_model_info("model_1")
+            assert info["model_refs"] == ["replica_1"]
+            assert await api._get_model_info("model_1") is info
+            assert await api._get_model_ref("model_1") == "replica_1"
+            assert await supervisor.get_model_replicas_count() == 2
+
+            # The relaunched model gets its new replicas.
+            await supervisor.set_model("model_1", ["replica_2"])
+            await _wait_for(lambda: api._model_cache_version == 2)
+            assert await api._get_model_ref("model_1") == "replica_2"
+            assert await supervisor.get_model_replicas_count() == 3
+
+            # The terminated model is not served from the cache.
+            await supervisor.set_model("model_1", None)
+            await _wait_for(lambda: api._model_cache_version == 3)
+            with pytest.raises(ValueError, match="Model not found"):
+                await api._get_model_ref("model_1")
+        finally:
+            assert api._model_cache_watcher is not None
+            api._model_cache_watcher.cancel()
+
+
+def test_restful_api_workers():
+    import psutil
+
+    from ...api.restful_api import run
+
+    port = xo.utils.get_next_port()
+    url = f"http://127.0.0.1:{port}/v1/cluster/auth"
+    # The auth endpoint does not need the supervisor.
+    proc = multiprocessing.Process(
+        target=run,
+        args=(f"127.0.0.1:{xo.utils.get_next_port()}", "127.0.0.1", port),
+        kwargs={"api_workers": 2},
+    )
+    proc.start()
+    try:
+        start = time.time()
+        while True:
+            assert time.time() - start < 60
+            api_workers = []
+            for p in psutil.Process(proc.pid).children():
+                try:
+                    if "spawn_main" in " ".join(p.cmdline()):
+                        api_workers.append(p)
+                except psutil.Error:
+                    # The exited API workers are restarted.
+                    pass
+            if len(api_workers) == 2:
+                try:
+                    requests.get(url)
+                    break
+                except requests.ConnectionError:
+                    # Not listening until an API worker starts its server.
+                    pass
+            time.sleep(0.5)
+
+        # Each API worker serves the requests on the shared socket while the
+        # other one is suspended.
+        for api_worker, other in (api_workers, api_workers[::-1]):
+            other.suspend()
+            try:
+                response = requests.get(url, timeout=60)
+                assert response.status_code == 200
+                assert response.json() == {"auth": False}
+                assert api_worker.is_running()
+            finally:
+                other.resume()
+    finally:
+        for p in psutil.Process(proc.pid).children(recursive=True):
+            p.kill()
+        proc.kill()
+        proc.join()
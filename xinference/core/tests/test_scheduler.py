@@ -0,0 +1,125 @@
+# Copyright 2022-2024 XProbe Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import pytest
+
+from ..scheduler import BatchScheduler, InferenceRequest, MicroBatcher
+
+
+class MockModel:
+    model_uid = "mock"
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def batch_inference(self, req_list):
+        self.batch_sizes.append(len(req_list))
+        for req in req_list:
+            req.is_prefill = False
+            req.new_tokens.append(len(req.new_tokens))
+            if req.stream:
+                req.outputs.append(req.new_tokens[-1])
+            if len(req.new_tokens) == req.generate_config["max_tokens"]:
+                if not req.stream:
+                    req.outputs.append(list(req.new_tokens))
+                req.stopped = True
+
+
+async def test_batch_scheduler():
+    model = MockModel()
+    scheduler = BatchScheduler(model, max_num_seqs=2)
+    scheduler.start()
+
+    reqs = [InferenceRequest("abc", {"max_tokens": n}) for n in (3, 5, 2)]
+    for req in reqs:
+        scheduler.add_request(req)
+    results = await asyncio.gather(*[scheduler.wait_result(req) for req in reqs])
+    assert results == [[0, 1, 2], [0, 1, 2, 3, 4], [0, 1]]
+    # The third request joins the batch once the first one finishes.
+    assert max(model.batch_sizes) == 2
+    assert sum(model.batch_sizes) == 10
+
+    req = InferenceRequest("abc", {"max_tokens": 3, "stream": True})
+    scheduler.add_request(req)
+    assert [o async for o in scheduler.stream_results(req)] == [0, 1, 2]
+    assert scheduler.num_running == 0
+    assert scheduler.num_waiting == 0
+
+    await scheduler.stop()
+
+
+async def test_batch_scheduler_abort():
+    model = MockModel()
+    scheduler = BatchScheduler(model)
+    scheduler.start()
+
+    req = InferenceRequest("abc", {"max_tokens": 100, "stream": True})
+    scheduler.add_request(req)
+    gen = scheduler.stream_results(req)
+    assert await gen.__anext__() == 0
+    await gen.aclose()
+    assert req.aborted
+    await asyncio.sleep(0.1)
+    assert scheduler.num_running == 0
+    assert len(req.new_tokens) < 100
+
+    await scheduler.stop()
+
+
+async def test_batch_scheduler_error():
+    class ErrorModel(MockModel):
+        def batch_inference(self, req_list):
+            raise ValueError("mock error")
+
+    scheduler = BatchScheduler(ErrorModel())
+    scheduler.start()
+    req = InferenceRequest("abc", {"max_tokens": 3})
+    scheduler.add_request(req)
+    with pytest.raises(ValueError, match="mock error"):
+        await scheduler.wait_result(req)
+    await scheduler.stop()
+
+
+async def test_micro_batcher():
+    batches = []
+
+    def batch_fn(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(batch_fn, max_wait=0.05, max_batch_size=4)
+    results = await asyncio.gather(*[batcher.submit(i, 1) for i in range(6)])
+    assert results == [0, 2, 4, 6, 8, 10]
+    # Flushed once the batch size is reached, the rest after the window.
+    assert batches == [[0, 1, 2, 3], [4, 5]]
+
+    def partial_error_fn(items):
+        return [ValueError("mock error") if item < 0 else item for item in items]
+
+    batcher = MicroBatcher(partial_error_fn)
+    results = await asyncio.gather(
+        batcher.submit(1), batcher.submit(-1), return_exceptions=True
+    )
+    assert results[0] == 1
+    assert isinstance(results[1], ValueError)
+
+    def error_fn(items):
+        raise ValueError("mock error")
+
+    batcher = MicroBatcher(error_fn)
+    with pytest.raises(ValueError, match="mock error"):
+        await batcher.submit(1)
+    assert batcher.num_pending == 0
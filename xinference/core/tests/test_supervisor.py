@@ -0,0 +1,450 @@
+# Copyright 2022-2023 XProbe Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import itertools
+import time
+
+import pytest
+import pytest_asyncio
+import xoscar as xo
+from xoscar import create_actor_pool
+
+from .. import supervisor as supervisor_module
+from ..model import ModelActor
+from ..resource import GPUStatus, ResourceStatus
+from ..status_guard import LaunchStatus, StatusGuardActor
+from ..supervisor import (
+    ReplicaInfo,
+    SupervisorActor,
+    choose_replica,
+    get_desired_replica,
+)
+
+
+class MockSupervisorActor(SupervisorActor):
+    async def __post_create__(self):
+        self._status_guard_ref = await xo.create_actor(
+            StatusGuardActor, address=self.address, uid=StatusGuardActor.uid()
+        )
+
+    async def __pre_destroy__(self):
+        pass
+
+    async def add_replicas(
+        self, model_uid: str, replica_uids: list, routing_policy: str
+    ):
+        replica_info = ReplicaInfo(
+            replica_model_uids=replica_uids,
+            scheduler=itertools.count(),
+            routing_policy=routing_policy,
+        )
+        for replica_uid in replica_uids:
+            replica_info.model_refs[replica_uid] = await xo.actor_ref(
+                address=self.address, uid=replica_uid
+            )
+        self._model_uid_to_replica_info[model_uid] = replica_info
+
+    async def add_mock_worker(self, worker_address: str, uid: str):
+        self._worker_address_to_worker[worker_address] = await xo.actor_ref(
+            address=self.address, uid=uid
+        )
+
+    def reserve(self, replica_model_uid: str, worker_address: str, memory: float):
+        self._placement_reservations[replica_model_uid] = (
+            worker_address,
+            memory,
+            None,
+        )
+
+    def notify_model_changes(self):
+        self._notify_model_changes()
+
+    async def choose_worker(self, memory_footprint, n_gpu):
+        worker_ref = await self._choose_worker(memory_footprint, n_gpu)
+        return worker_ref.uid
+
+    async def autoscale_model(self, model_uid: str):
+        await self._autoscale_model(
+            model_uid, self._model_uid_to_replica_info[model_uid]
+        )
+
+
+class MockWorkerActor(xo.StatelessActor):
+    def __init__(self):
+        super().__init__()
+        self._launching = 0
+        self._max_launching = 0
+        self._models = set()
+
+    def get_model_count(self) -> int:
+        return len(self._models)
+
+    async def launch_builtin_model(self, model_uid: str, **kwargs):
+        self._launching += 1
+        self._max_launching = max(self._max_launching, self._launching)
+        try:
+            if model_uid == "error-2-1":
+                await asyncio.sleep(0.8)
+                raise RuntimeError("mock launch error")
+            await asyncio.sleep(0.5)
+            await xo.create_actor(
+                ModelActor,
+                self.address,
+                MockModel(),
+                address=self.address,
+                uid=model_uid,
+            )
+            self._models.add(model_uid)
+        finally:
+            self._launching -= 1
+
+    async def get_model(self, model_uid: str):
+        return await xo.actor_ref(address=self.address, uid=model_uid)
+
+    def describe_model(self, model_uid: str):
+        return {"model_name": "mock"}
+
+    async def terminate_model(self, model_uid: str):
+        self._models.remove(model_uid)
+        await xo.destroy_actor(await self.get_model(model_uid))
+
+    def get_launch_stats(self):
+        return self._max_launching, sorted(self._models)
+
+
+class MockModel:
+    model_uid = "mock_model"
+
+    async def generate(self, prompt, generate_config=None):
+        await asyncio.sleep(float(prompt))
+        return {"text": prompt}
+
+
+@pytest_asyncio.fixture
+async def setup_pool():
+    pool = await create_actor_pool(
+        f"test://127.0.0.1:{xo.utils.get_next_port()}", n_process=0
+    )
+    async with pool:
+        yield pool
+
+
+@pytest.mark.asyncio
+async def test_least_requests_routing(setup_pool, monkeypatch):
+    pool = setup_pool
+    addr = pool.external_address
+    # Ask the replicas for the counts on every request.
+    monkeypatch.setattr(supervisor_module, "XINFERENCE_ROUTING_PENDING_REQUESTS_TTL", 0)
+    replica_uids = ["model-0", "model-1"]
+    models = [
+        await xo.create_actor(ModelActor, addr, MockModel(), address=addr, uid=uid)
+        for uid in replica_uids
+    ]
+    supervisor = await xo.create_actor(
+        MockSupervisorActor, address=addr, uid=SupervisorActor.uid()
+    )
+    await supervisor.add_replicas("model", replica_uids, "least_requests")
+
+    # The replica 0 is busy, all the requests go to the replica 1.
+    task = asyncio.create_task(models[0].generate("1"))
+    await asyncio.sleep(0.1)
+    assert await models[0].get_pending_requests_count() == 1
+    for _ in range(3):
+        model_ref = await supervisor.get_model("model")
+        assert model_ref.uid == b"model-1"
+    await task
+    assert await models[0].get_pending_requests_count() == 0
+
+    # The idle replicas are picked in turn.
+    uids = {(await supervisor.get_model("model")).uid for _ in range(2)}
+    assert uids == {b"model-0", b"model-1"}
+
+
+@pytest.mark.asyncio
+async def test_prefix_affinity_routing(setup_pool, monkeypatch):
+    pool = setup_pool
+    addr = pool.external_address
+    monkeypatch.setattr(supervisor_module, "XINFERENCE_ROUTING_PENDING_REQUESTS_TTL", 0)
+    replica_uids = ["model-0", "model-1", "model-2"]
+    models = [
+        await xo.create_actor(ModelActor, addr, MockModel(), address=addr, uid=uid)
+        for uid in replica_uids
+    ]
+    scheduler = itertools.count()
+
+    async def _choose(routing_key):
+        model_ref = await choose_replica(
+            models, scheduler, "prefix_affinity", routing_key=routing_key
+        )
+        return model_ref.uid
+
+    # The same prefix goes to the same replica.
+    uids = {await _choose("system prompt") for _ in range(3)}
+    assert len(uids) == 1
+    uids = {await _choose(f"conversation {i}") for i in range(20)}
+    assert len(uids) == 3
+    # The prefix keeps its replica when the other replicas are removed.
+    uid = await _choose("system prompt")
+    others = [m for m in models if m.uid != uid]
+    model_ref = await choose_replica(
+        [models[replica_uids.index(uid.decode())], others[0]],
+        scheduler,
+        "prefix_affinity",
+        routing_key="system prompt",
+    )
+    assert model_ref.uid == uid
+
+    # Fall back to the least loaded replica if the replica is much busier.
+    monkeypatch.setattr(
+        supervisor_module, "XINFERENCE_PREFIX_AFFINITY_MAX_IMBALANCE", 1
+    )
+    busy = models[replica_uids.index(uid.decode())]
+    tasks = [asyncio.create_task(busy.generate("0.5")) for _ in range(2)]
+    await asyncio.sleep(0.1)
+    assert await _choose("system prompt") != uid
+    await asyncio.gather(*tasks)
+    assert await _choose("system prompt") == uid
+
+
+@pytest.mark.asyncio
+async def test_pending_requests_count_cache(setup_pool, monkeypatch):
+    pool = setup_pool
+    addr = pool.external_address
+    replica_uids = ["model-0", "model-1"]
+    models = [
+        await xo.create_actor(ModelActor, addr, MockModel(), address=addr, uid=uid)
+        for uid in replica_uids
+    ]
+    scheduler = itertools.count()
+    monkeypatch.setattr(
+        supervisor_module, "XINFERENCE_ROUTING_PENDING_REQUESTS_TTL", 0.5
+    )
+    calls = []
+    get_count = ModelActor.get_pending_requests_count
+
+    def _get_count(self):
+        calls.append(self.uid)
+        return get_count(self)
+
+    monkeypatch.setattr(ModelActor, "get_pending_requests_count", _get_count)
+
+    task = asyncio.create_task(models[0].generate("1"))
+    await asyncio.sleep(0.1)
+    # The replicas are asked once, the routed requests are counted
+    # in the cache, so they are spread among the replicas.
+    uids = [
+        (await choose_replica(models, scheduler, "least_requests")).uid
+        for _ in range(3)
+    ]
+    assert uids == [b"model-1", b"model-1", b"model-0"]
+    assert len(calls) == 2
+
+    # The counts are asked again once expired.
+    await asyncio.sleep(0.6)
+    model_ref = await choose_replica(models, scheduler, "least_requests")
+    assert model_ref.uid == b"model-1"
+    assert len(calls) == 4
+    await task
+
+
+def _node_status(gpu_free_gb):
+    status = {
+        "cpu": ResourceStatus(
+            usage=0, total=8, memory_used=0, memory_available=64e9, memory_total=64e9
+        )
+    }
+    for i, free in enumerate(gpu_free_gb):
+        status[i] = GPUStatus(mem_total=40e9, mem_free=free * 1e9, mem_used=0)
+    return status
+
+
+@pytest.mark.asyncio
+async def test_choose_worker(setup_pool, monkeypatch):
+    pool = setup_pool
+    addr = pool.external_address
+    supervisor = await xo.create_actor(
+        MockSupervisorActor, address=addr, uid=SupervisorActor.uid()
+    )
+    for name in ("worker-a", "worker-b"):
+        await xo.create_actor(MockWorkerActor, address=addr, uid=name)
+        await supervisor.add_mock_worker(name, name)
+
+    # Fall back to the model count before the workers report the resources.
+    assert await supervisor.choose_worker(8e9, "auto") in (b"worker-a", b"worker-b")
+
+    await supervisor.report_worker_status("worker-a", _node_status([10]))
+    await supervisor.report_worker_status("worker-b", _node_status([20, 10]))
+
+    # Spread to the worker with the most free memory.
+    assert await supervisor.choose_worker(8e9, "auto") == b"worker-b"
+    assert await supervisor.choose_worker(8e9, 1) == b"worker-b"
+    # Only the worker b has 2 GPUs.
+    assert await supervisor.choose_worker(25e9, 2) == b"worker-b"
+    # CPU only models use the host memory.
+    assert await supervisor.choose_worker(8e9, None) in (b"worker-a", b"worker-b")
+
+    # Bin packing into the worker with the least free memory that fits.
+    monkeypatch.setattr(
+        supervisor_module, "XINFERENCE_WORKER_PLACEMENT_STRATEGY", "binpack"
+    )
+    assert await supervisor.choose_worker(8e9, "auto") == b"worker-a"
+    assert await supervisor.choose_worker(15e9, "auto") == b"worker-b"
+    assert await supervisor.choose_worker(25e9, "auto") == b"worker-b"
+
+    # The memory of the launching models is reserved.
+    await supervisor.reserve("model-0", "worker-b", 25e9)
+    assert await supervisor.choose_worker(8e9, "auto") == b"worker-a"
+    monkeypatch.setattr(
+        supervisor_module, "XINFERENCE_WORKER_PLACEMENT_STRATEGY", "spread"
+    )
+    assert await supervisor.choose_worker(8e9, "auto") == b"worker-a"
+
+
+@pytest.mark.asyncio
+async def test_wait_model_changes(setup_pool):
+    pool = setup_pool
+    addr = pool.external_address
+    supervisor = await xo.create_actor(
+        MockSupervisorActor, address=addr, uid=SupervisorActor.uid()
+    )
+
+    # Return the current version directly if the caller is outdated.
+    assert await supervisor.wait_model_changes(None, 10) == 0
+    # Return the same version on timeout.
+    assert await supervisor.wait_model_changes(0, 0.1) == 0
+
+    task = asyncio.create_task(supervisor.wait_model_changes(0, 10))
+    await asyncio.sleep(0.1)
+    assert not task.done()
+    await supervisor.notify_model_changes()
+    assert await asyncio.wait_for(task, 1) == 1
+
+
+@pytest.mark.asyncio
+async def test_launch_replicas_concurrently(setup_pool, monkeypatch):
+    pool = setup_pool
+    addr = pool.external_address
+    supervisor = await xo.create_actor(
+        MockSupervisorActor, address=addr, uid=SupervisorActor.uid()
+    )
+    worker = await xo.create_actor(MockWorkerActor, address=addr, uid="worker")
+    await supervisor.add_mock_worker(addr, "worker")
+
+    monkeypatch.setattr(
+        supervisor_module, "XINFERENCE_MAX_CONCURRENT_LAUNCHES_PER_WORKER", 2
+    )
+    start = time.time()
+    await supervisor.launch_builtin_model(
+        model_uid="model",
+        model_name="mock",
+        model_size_in_billions=None,
+        model_format=None,
+        quantization=None,
+        model_engine=None,
+        model_type="embedding",
+        replica=4,
+    )
+    # Two replicas are launched at a time.
+    assert time.time() - start < 1.5
+    max_launching, models = await worker.get_launch_stats()
+    assert max_launching == 2
+    assert models == ["model-4-0", "model-4-1", "model-4-2", "model-4-3"]
+
+    # The launched replicas are terminated if one of them fails.
+    with pytest.raises(RuntimeError, match="mock launch error"):
+        await supervisor.launch_builtin_model(
+            model_uid="error",
+            model_name="mock",
+            model_size_in_billions=None,
+            model_format=None,
+            quantization=None,
+            model_engine=None,
+            model_type="embedding",
+            replica=2,
+        )
+    _, models = await worker.get_launch_stats()
+    assert not any(uid.startswith("error") for uid in models)
+    infos = await supervisor.get_instance_info(None, "error")
+    assert infos[0]["status"] == LaunchStatus.ERROR.name
+    with pytest.raises(ValueError, match="Model not found"):
+        await supervisor.get_model("error")
+
+
+def test_get_desired_replica(monkeypatch):
+    monkeypatch.setattr(
+        supervisor_module, "XINFERENCE_AUTOSCALE_TARGET_PENDING_REQUESTS", 4
+    )
+    assert get_desired_replica(2, 1, 4, 9, 0) == 3
+    assert get_desired_replica(2, 1, 4, 100, 0) == 4
+    assert get_desired_replica(2, 1, 4, 0, 0) == 1
+    assert get_desired_replica(2, 0, 4, 0, 0) == 0
+    # Add a replica if the requests wait in the queue for long.
+    assert get_desired_replica(2, 1, 4, 4, 10) == 3
+
+
+@pytest.mark.asyncio
+async def test_autoscale(setup_pool, monkeypatch):
+    pool = setup_pool
+    addr = pool.external_address
+    supervisor = await xo.create_actor(
+        MockSupervisorActor, address=addr, uid=SupervisorActor.uid()
+    )
+    worker = await xo.create_actor(MockWorkerActor, address=addr, uid="worker")
+    await supervisor.add_mock_worker(addr, "worker")
+    monkeypatch.setattr(
+        supervisor_module, "XINFERENCE_AUTOSCALE_TARGET_PENDING_REQUESTS", 1
+    )
+    monkeypatch.setattr(supervisor_module, "XINFERENCE_AUTOSCALE_SCALE_DOWN_DELAY", 0)
+
+    await supervisor.launch_builtin_model(
+        model_uid="model",
+        model_name="mock",
+        model_size_in_billions=None,
+        model_format=None,
+        quantization=None,
+        model_engine=None,
+        model_type="embedding",
+        replica=1,
+        min_replica=0,
+        max_replica=2,
+    )
+    model_ref = await supervisor.get_model("model")
+    tasks = [asyncio.create_task(model_ref.generate("1")) for _ in range(3)]
+    await asyncio.sleep(0.1)
+    # Scale up to the max replica.
+    await supervisor.autoscale_model("model")
+    assert (await supervisor.describe_model("model"))["replica"] == 2
+    _, models = await worker.get_launch_stats()
+    assert models == ["model-1-0", "model-2-1"]
+    await asyncio.gather(*tasks)
+
+    # Scale down one replica at a time when idle, to zero.
+    await supervisor.autoscale_model("model")
+    assert (await supervisor.describe_model("model"))["replica"] == 1
+    await supervisor.autoscale_model("model")
+    assert await supervisor.describe_model("model") == {
+        "model_name": "mock",
+        "replica": 0,
+    }
+    _, models = await worker.get_launch_stats()
+    assert models == []
+    infos = await supervisor.get_instance_info(None, "model")
+    assert infos[0]["replica"] == 0
+
+    # Launch again on the next request.
+    model_ref = await supervisor.get_model("model")
+    assert await model_ref.generate("0") == b'{"text":"0"}'
+    _, models = await worker.get_launch_stats()
+    assert models == ["model-1-2"]
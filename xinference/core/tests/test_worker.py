@@ -11,6 +11,8 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import os
+import time
 from typing import List, Optional, Union
 
 import pytest
@@ -18,9 +20,21 @@ import pytest_asyncio
 import xoscar as xo
 from xoscar import MainActorPoolType, create_actor_pool, get_pool_config
 
+from .. import metrics
+from .. import worker as worker_module
+from ..resource import GPUStatus, NoGPUSampler
 from ..worker import WorkerActor
 
 
+class MockModelActor(xo.StatelessActor):
+    def __init__(self, pending_requests_count: int):
+        super().__init__()
+        self._pending_requests_count = pending_requests_count
+
+    def get_pending_requests_count(self) -> int:
+        return self._pending_requests_count
+
+
 class MockWorkerActor(WorkerActor):
     def __init__(
         self,
@@ -34,7 +48,7 @@ class MockWorkerActor(WorkerActor):
         pass
 
     async def __pre_destroy__(self):
-        pass
+        await self._stop_warm_subpools()
 
     def get_gpu_to_model_uid(self):
         return self._gpu_to_model_uid
@@ -72,6 +86,52 @@ class MockWorkerActor(WorkerActor):
         )
         self._model_uid_to_addr[model_uid] = subpool_address
 
+    async def add_lazy_model(
+        self, model_uid: str, pending_requests_count: int = 0, pinned: bool = False
+    ):
+        # A loaded lazy model on 1 GPU.
+        self._lazy_model_uid_to_launch_args[model_uid] = {}
+        self.allocate_devices(model_uid=model_uid, n_gpu=1)
+        self._model_uid_to_model[model_uid] = await xo.create_actor(
+            MockModelActor,
+            pending_requests_count,
+            address=self.address,
+            uid=model_uid,
+        )
+        self._model_uid_to_last_used[model_uid] = time.time()
+        if pinned:
+            self._pinned_model_uids.add(model_uid)
+
+    async def allocate_devices_or_evict(self, model_uid: str, n_gpu: int):
+        return await self._allocate_devices_or_evict(model_uid, n_gpu)
+
+    def get_loaded_models(self):
+        return sorted(self._model_uid_to_model)
+
+    async def start_warm_subpools(self):
+        self._refill_warm_subpools()
+        await self._warm_subpools_task
+
+    async def get_warm_subpools(self):
+        if self._warm_subpools_task is not None:
+            await self._warm_subpools_task
+        return list(self._warm_subpools)
+
+    def get_model_address(self, model_uid: str):
+        return self._model_uid_to_addr[model_uid]
+
+    def set_gpu_memory_total(self, total: float):
+        self._gpu_memory_total = {dev: total for dev in self._total_gpu_devices}
+
+    def set_gpu_status(self, gpu_status):
+        self._gpu_sampler = NoGPUSampler(gpu_status)
+
+    def _get_pid_to_model_uid(self):
+        return {100: "model_1", 101: "model_1", 200: "model_2"}
+
+    def record_gpu_metrics(self):
+        self._record_gpu_metrics(self.get_gpu_status())
+
     async def terminate_model(self, model_uid: str):
         self.release_devices(model_uid)
 
@@ -435,3 +495,172 @@ async def test_launch_model_with_gpu_idx(setup_pool):
     for info in [embedding_info, user_specified_info]:
         for dev, details in info.items():
             assert len(details) == 0
+
+
+@pytest.mark.asyncio
+async def test_evict_lazy_model(setup_pool):
+    pool = setup_pool
+    addr = pool.external_address
+
+    worker: xo.ActorRefType["MockWorkerActor"] = await xo.create_actor(  # type: ignore
+        MockWorkerActor,
+        address=addr,
+        uid=WorkerActor.uid(),
+        supervisor_address="test",
+        main_pool=pool,
+        cuda_devices=[0, 1, 2, 3],
+    )
+    await worker.add_lazy_model("lazy_1")
+    await worker.add_lazy_model("lazy_2", pinned=True)
+    await worker.add_lazy_model("lazy_3")
+    await worker.add_lazy_model("lazy_4", pending_requests_count=1)
+
+    # The least recently used idle lazy model is unloaded.
+    assert await worker.allocate_devices_or_evict("model_1", 1) == [0]
+    assert await worker.get_loaded_models() == ["lazy_2", "lazy_3", "lazy_4"]
+
+    # The pinned and busy models are kept.
+    assert await worker.allocate_devices_or_evict("model_2", 1) == [2]
+    with pytest.raises(RuntimeError, match="No available slot"):
+        await worker.allocate_devices_or_evict("model_3", 1)
+    assert await worker.get_loaded_models() == ["lazy_2", "lazy_4"]
+
+
+@pytest.mark.asyncio
+async def test_warm_subpool(setup_pool, monkeypatch):
+    pool = setup_pool
+    addr = pool.external_address
+    monkeypatch.setattr(worker_module, "XINFERENCE_WARM_SUBPOOL_SIZE", 1)
+    monkeypatch.setattr(worker_module, "XINFERENCE_WARM_SUBPOOL_MODULES", "")
+    monkeypatch.setattr(
+        worker_module, "get_available_device_env_name", lambda: "CUDA_VISIBLE_DEVICES"
+    )
+    # The test sub pools share the process, restore the env after the test.
+    monkeypatch.setenv("CUDA_VISIBLE_DEVICES", "")
+
+    worker: xo.ActorRefType["MockWorkerActor"] = await xo.create_actor(  # type: ignore
+        MockWorkerActor,
+        address=addr,
+        uid=WorkerActor.uid(),
+        supervisor_address="test",
+        main_pool=pool,
+        cuda_devices=[i for i in range(8)],
+    )
+    await worker.start_warm_subpools()
+    warm_subpools = await worker.get_warm_subpools()
+    assert len(warm_subpools) == 1
+
+    await worker.launch_builtin_model(
+        "model_model_1", "mock_model_name", None, None, None, n_gpu=2
+    )
+    # The warm sub pool is handed out with the devices set, and refilled.
+    assert await worker.get_model_address("model_model_1") == warm_subpools[0]
+    assert os.environ["CUDA_VISIBLE_DEVICES"] == "0,1"
+    new_warm_subpools = await worker.get_warm_subpools()
+    assert len(new_warm_subpools) == 1
+    assert new_warm_subpools != warm_subpools
+
+    pool_config = (await get_pool_config(addr)).as_dict()
+    assert len(pool_config["pools"]) == 3  # A main pool, a model and a warm pool.
+
+    # The warm sub pool with CUDA initialized is not handed out.
+    torch = pytest.importorskip("torch")
+    monkeypatch.setattr(torch.cuda, "is_initialized", lambda: True)
+    await worker.launch_builtin_model(
+        "model_model_2", "mock_model_name", None, None, None, n_gpu=2
+    )
+    assert await worker.get_model_address("model_model_2") not in new_warm_subpools
+    monkeypatch.undo()
+
+    # The warm sub pools are removed with the worker.
+    await xo.destroy_actor(worker)
+    pool_config = (await get_pool_config(addr)).as_dict()
+    assert len(pool_config["pools"]) == 3  # A main pool and two models.
+
+
+@pytest.mark.asyncio
+async def test_allocate_devices_with_memory(setup_pool):
+    pool = setup_pool
+    addr = pool.external_address
+
+    worker: xo.ActorRefType["MockWorkerActor"] = await xo.create_actor(  # type: ignore
+        MockWorkerActor,
+        address=addr,
+        uid=WorkerActor.uid(),
+        supervisor_address="test",
+        main_pool=pool,
+        cuda_devices=[0, 1],
+    )
+    await worker.set_gpu_memory_total(80)
+
+    devices = await worker.allocate_devices(model_uid="model_1", n_gpu=1)
+    assert devices == [0]
+    # The exclusive device cannot be shared.
+    assert await worker.allocate_devices_with_memory("model_2", 1, 30) == [1]
+    # Packed on the device with the least memory left.
+    assert await worker.allocate_devices_with_memory("model_3", 1, 40) == [1]
+    with pytest.raises(RuntimeError, match="No available slot"):
+        await worker.allocate_devices_with_memory("model_4", 1, 20)
+    # The shared device cannot be given exclusively.
+    with pytest.raises(RuntimeError, match="No available slot"):
+        await worker.allocate_devices(model_uid="model_4", n_gpu=1)
+
+    # The user specified GPUs are checked with the memory budget.
+    with pytest.raises(RuntimeError, match="does not have"):
+        await worker.allocate_devices_with_gpu_idx("model_4", "LLM", [1], 20)
+    assert await worker.allocate_devices_with_gpu_idx("model_4", "image", [1], 10) == [
+        1
+    ]
+
+    await worker.release_devices("model_3")
+    assert await worker.allocate_devices_with_memory("model_5", 1, 40) == [1]
+    await worker.release_devices("model_1")
+    assert await worker.allocate_devices_with_memory("model_6", 1, 50) == [0]
+
+
+@pytest.mark.asyncio
+async def test_gpu_status(setup_pool):
+    pool = setup_pool
+    addr = pool.external_address
+
+    worker: xo.ActorRefType["MockWorkerActor"] = await xo.create_actor(  # type: ignore
+        MockWorkerActor,
+        address=addr,
+        uid=WorkerActor.uid(),
+        supervisor_address="test",
+        main_pool=pool,
+        cuda_devices=[0],
+    )
+    assert await worker.get_gpu_status() == {}
+
+    await worker.set_gpu_status(
+        {
+            "gpu-0": GPUStatus(
+                mem_total=80e9,
+                mem_free=50e9,
+                mem_used=30e9,
+                util=0.5,
+                power=300.0,
+                temperature=60.0,
+                process_mem_used={100: 10e9, 101: 5e9, 200: 10e9, 300: 5e9},
+            )
+        }
+    )
+    gpu_status = await worker.get_gpu_status()
+    # The memory of the processes out of the worker is not counted.
+    assert gpu_status["gpu-0"].model_mem_used == {"model_1": 15e9, "model_2": 10e9}
+    assert (await worker.get_gpu_status())["gpu-0"].util == 0.5
+
+    await worker.record_gpu_metrics()
+    labels = {"node": addr, "gpu": "gpu-0"}
+    assert metrics.gpu_utilization.get(labels) == 0.5
+    assert metrics.gpu_temperature_celsius.get(labels) == 60.0
+    assert (
+        metrics.model_gpu_memory_used_bytes.get({**labels, "model": "model_2"}) == 10e9
+    )
+
+    await worker.set_gpu_status(
+        {"gpu-0": GPUStatus(mem_total=80e9, mem_free=80e9, mem_used=0)}
+    )
+    await worker.record_gpu_metrics()
+    assert metrics.model_gpu_memory_used_bytes.get({**labels, "model": "model_2"}) == 0
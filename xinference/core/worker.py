@@ -13,16 +13,20 @@
 # limitations under the License.
 
 import asyncio
+import dataclasses
+import importlib.util
 import os
 import platform
 import queue
 import signal
+import sys
 import threading
 import time
 from collections import defaultdict
 from logging import getLogger
 from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
+import psutil
 import xoscar as xo
 from async_timeout import timeout
 from xoscar import MainActorPoolType
@@ -30,7 +34,10 @@ from xoscar import MainActorPoolType
 from ..constants import (
     XINFERENCE_CACHE_DIR,
     XINFERENCE_DISABLE_HEALTH_CHECK,
+    XINFERENCE_GPU_SAMPLE_INTERVAL,
     XINFERENCE_HEALTH_CHECK_INTERVAL,
+    XINFERENCE_WARM_SUBPOOL_MODULES,
+    XINFERENCE_WARM_SUBPOOL_SIZE,
 )
 from ..core import ModelActor
 from ..core.status_guard import LaunchStatus
@@ -38,9 +45,21 @@ from ..device_utils import get_available_device_env_name, gpu_count
 from ..model.core import ModelDescription, create_model_instance
 from ..types import PeftModelConfig
 from .event import Event, EventCollectorActor, EventType
-from .metrics import launch_metrics_export_server, record_metrics
-from .resource import gather_node_info
-from .utils import log_async, log_sync, parse_replica_model_uid, purge_dir
+from .metrics import launch_metrics_export_server, record_metrics, record_metrics_batch
+from .resource import (
+    GPUSampler,
+    GPUStatus,
+    NoGPUSampler,
+    create_gpu_sampler,
+    gather_node_info,
+)
+from .utils import (
+    get_nvidia_gpu_info,
+    log_async,
+    log_sync,
+    parse_replica_model_uid,
+    purge_dir,
+)
 
 logger = getLogger(__name__)
 
@@ -53,6 +72,21 @@ else:
     MODEL_ACTOR_AUTO_RECOVER_LIMIT = None
 
 
+class SubPoolEnvActor(xo.StatelessActor):
+    """
+    Set the environment variables of a warm sub pool when it is handed out.
+    """
+
+    @staticmethod
+    def set_env(env: Dict[str, str]):
+        # The visible devices are read when CUDA is initialized, they would be
+        # ignored if a warm-up module has initialized it already.
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_initialized():
+            raise RuntimeError("CUDA is already initialized in the warm sub pool")
+        os.environ.update(env)
+
+
 class WorkerActor(xo.StatelessActor):
     def __init__(
         self,
@@ -79,9 +113,33 @@ class WorkerActor(xo.StatelessActor):
         self._user_specified_gpu_to_model_uids: Dict[
             int, Set[Tuple[str, str]]
         ] = defaultdict(set)
+        # The models launched with a GPU memory budget share the devices.
+        # Dict structure: gpu_index: {replica_model_uid: memory in bytes}
+        self._gpu_to_shared_model_uids: Dict[int, Dict[str, float]] = defaultdict(dict)
+        self._gpu_memory_total: Optional[Dict[int, float]] = None
         self._model_uid_to_addr: Dict[str, str] = {}
         self._model_uid_to_recover_count: Dict[str, Optional[int]] = {}
         self._model_uid_to_launch_args: Dict[str, Dict] = {}
+        # The replicas of a model may be launched concurrently,
+        # only one of them downloads and caches the model files.
+        self._model_name_to_cache_lock: Dict[str, asyncio.Lock] = defaultdict(
+            asyncio.Lock
+        )
+        # The lazy models are loaded on the first request, and unloaded in the
+        # LRU order when the devices are used up, unless they are pinned.
+        self._lazy_model_uid_to_launch_args: Dict[str, Dict] = {}
+        self._lazy_model_uid_to_lock: Dict[str, asyncio.Lock] = defaultdict(
+            asyncio.Lock
+        )
+        self._model_uid_to_last_used: Dict[str, float] = {}
+        self._pinned_model_uids: Set[str] = set()
+        # The sub pools started in advance with the heavy modules imported.
+        self._warm_subpools: List[str] = []
+        self._warm_subpools_task: Optional[asyncio.Task] = None
+        self._warm_subpools_stopped = False
+        self._gpu_sampler: Union[GPUSampler, NoGPUSampler] = NoGPUSampler()
+        # The (gpu, model uid) of the model GPU memory metrics.
+        self._model_gpu_metrics_keys: Set[Tuple[str, str]] = set()
 
         # metrics export server.
         if metrics_exporter_host is not None or metrics_exporter_port is not None:
@@ -116,6 +174,10 @@ class WorkerActor(xo.StatelessActor):
             await self._main_pool.remove_sub_pool(address)
         except Exception:
             pass
+        if address in self._warm_subpools:
+            self._warm_subpools.remove(address)
+            self._refill_warm_subpools()
+            return
         for model_uid, addr in self._model_uid_to_addr.items():
             if addr == address:
                 launch_args = self._model_uid_to_launch_args.get(model_uid)
@@ -190,6 +252,9 @@ class WorkerActor(xo.StatelessActor):
             address=self._supervisor_address, uid=SupervisorActor.uid()
         )
         await self._supervisor_ref.add_worker(self.address)
+        self._gpu_sampler = await asyncio.to_thread(
+            create_gpu_sampler, XINFERENCE_GPU_SAMPLE_INTERVAL
+        )
         if not XINFERENCE_DISABLE_HEALTH_CHECK:
             # Run _periodical_report_status() in a dedicated thread.
             self._isolation = Isolation(asyncio.new_event_loop(), threaded=True)
@@ -198,6 +263,8 @@ class WorkerActor(xo.StatelessActor):
                 self._periodical_report_status(), loop=self._isolation.loop
             )
         logger.info(f"Xinference worker {self.address} started")
+        if XINFERENCE_WARM_SUBPOOL_SIZE > 0:
+            self._refill_warm_subpools()
         logger.info("Purge cache directory: %s", XINFERENCE_CACHE_DIR)
         purge_dir(XINFERENCE_CACHE_DIR)
 
@@ -277,6 +344,25 @@ class WorkerActor(xo.StatelessActor):
 
     async def __pre_destroy__(self):
         self._isolation.stop()
+        self._gpu_sampler.stop()
+        await self._stop_warm_subpools()
+
+    async def _stop_warm_subpools(self):
+        self._warm_subpools_stopped = True
+        if self._warm_subpools_task is not None:
+            # Not cancelled, or the sub pool being started would be left over.
+            await self._warm_subpools_task
+            self._warm_subpools_task = None
+        warm_subpools, self._warm_subpools = self._warm_subpools, []
+        for subpool_address in warm_subpools:
+            try:
+                await self._main_pool.remove_sub_pool(subpool_address)
+            except Exception:
+                logger.warning(
+                    "Failed to remove the warm sub pool %s",
+                    subpool_address,
+                    exc_info=True,
+                )
 
     @staticmethod
     def get_devices_count():
@@ -339,13 +425,18 @@ class WorkerActor(xo.StatelessActor):
                 existing_cnt += 1
             if _dev in self._user_specified_gpu_to_model_uids:
                 existing_cnt += len(self._user_specified_gpu_to_model_uids[_dev])
+            if _dev in self._gpu_to_shared_model_uids:
+                existing_cnt += len(self._gpu_to_shared_model_uids[_dev])
             if min_cnt == -1 or existing_cnt < min_cnt:
                 device, min_cnt = _dev, existing_cnt
 
         self._gpu_to_embedding_model_uids[device].add(model_uid)
         return device
 
-    def allocate_devices(self, model_uid: str, n_gpu: int) -> List[int]:
+    def _get_exclusive_devices(self) -> Set[int]:
+        """
+        The devices held by the models without a GPU memory budget.
+        """
         user_specified_allocated_devices: Set[int] = set()
         for dev, model_infos in self._user_specified_gpu_to_model_uids.items():
             allocated_non_embedding_rerank_models = False
@@ -358,25 +449,89 @@ class WorkerActor(xo.StatelessActor):
                     break
             if allocated_non_embedding_rerank_models:
                 user_specified_allocated_devices.add(dev)
-        allocated_devices = set(self._gpu_to_model_uid.keys()).union(
+        return set(self._gpu_to_model_uid.keys()).union(
             user_specified_allocated_devices
         )
+
+    def allocate_devices(self, model_uid: str, n_gpu: int) -> List[int]:
+        shared_devices = {
+            dev
+            for dev, model_uids in self._gpu_to_shared_model_uids.items()
+            if model_uids
+        }
+        allocated_devices = self._get_exclusive_devices().union(shared_devices)
         if n_gpu > len(self._total_gpu_devices) - len(allocated_devices):
             raise RuntimeError("No available slot found for the model")
 
         devices: List[int] = [
-            dev
-            for dev in self._total_gpu_devices
-            if dev not in self._gpu_to_model_uid
-            and dev not in user_specified_allocated_devices
+            dev for dev in self._total_gpu_devices if dev not in allocated_devices
         ][:n_gpu]
         for dev in devices:
             self._gpu_to_model_uid[int(dev)] = model_uid
 
         return sorted(devices)
 
+    def _get_gpu_memory_total(self) -> Dict[int, float]:
+        if self._gpu_memory_total is None:
+            gpu_status = self._gpu_sampler.get_status()
+            if gpu_status:
+                gpu_info = {
+                    name: {"total": status.mem_total}
+                    for name, status in gpu_status.items()
+                }
+            else:
+                gpu_info = get_nvidia_gpu_info()
+            self._gpu_memory_total = {
+                dev: gpu_info[f"gpu-{dev}"]["total"]
+                for dev in self._total_gpu_devices
+                if f"gpu-{dev}" in gpu_info
+            }
+        return self._gpu_memory_total
+
+    def _get_gpu_memory_free(self, dev: int) -> float:
+        """
+        The GPU memory not promised to the models sharing the device.
+        """
+        total = self._get_gpu_memory_total().get(dev)
+        if total is None:
+            raise RuntimeError(
+                f"Cannot get the memory of GPU {dev}, "
+                f"so models cannot share it with a memory budget."
+            )
+        return total - sum(self._gpu_to_shared_model_uids[dev].values())
+
+    def allocate_devices_with_memory(
+        self, model_uid: str, n_gpu: int, memory: float
+    ) -> List[int]:
+        """
+        Allocate the devices that have `memory` bytes not promised to other
+        models, the model shares them with the other models having a budget.
+        """
+        exclusive_devices = self._get_exclusive_devices()
+        candidates = [
+            (self._get_gpu_memory_free(dev), dev)
+            for dev in self._total_gpu_devices
+            if dev not in exclusive_devices
+        ]
+        candidates = [c for c in candidates if c[0] >= memory]
+        if n_gpu > len(candidates):
+            raise RuntimeError(
+                f"No available slot found for the model, "
+                f"which needs {memory / 1024**3:.2f} GiB on {n_gpu} GPU(s)"
+            )
+        # Fill the devices with the least memory left first, leaves the
+        # large free memory for the large models.
+        devices = [dev for _, dev in sorted(candidates)[:n_gpu]]
+        for dev in devices:
+            self._gpu_to_shared_model_uids[dev][model_uid] = memory
+        return sorted(devices)
+
     async def allocate_devices_with_gpu_idx(
-        self, model_uid: str, model_type: str, gpu_idx: List[int]
+        self,
+        model_uid: str,
+        model_type: str,
+        gpu_idx: List[int],
+        memory: Optional[float] = None,
     ) -> List[int]:
         """
         When user specifies the gpu_idx, allocate models on user-specified GPUs whenever possible
@@ -412,6 +567,14 @@ class WorkerActor(xo.StatelessActor):
                             f"therefore cannot allocate GPU memory for a new model."
                         )
 
+            if memory is not None and self._get_gpu_memory_free(idx) < memory:
+                raise RuntimeError(
+                    f"GPU index {idx} does not have {memory / 1024**3:.2f} GiB "
+                    f"not promised to the models on it: "
+                    f"{list(self._gpu_to_shared_model_uids[idx])}"
+                )
+            existing_model_uids.extend(self._gpu_to_shared_model_uids.get(idx, {}))
+
             if existing_model_uids:
                 logger.warning(
                     f"WARNING!!! GPU index {idx} has been occupied "
@@ -419,7 +582,10 @@ class WorkerActor(xo.StatelessActor):
                 )
 
         for idx in gpu_idx:
-            self._user_specified_gpu_to_model_uids[idx].add((model_uid, model_type))
+            if memory is not None:
+                self._gpu_to_shared_model_uids[idx][model_uid] = memory
+            else:
+                self._user_specified_gpu_to_model_uids[idx].add((model_uid, model_type))
         return sorted(gpu_idx)
 
     def release_devices(self, model_uid: str):
@@ -447,12 +613,62 @@ class WorkerActor(xo.StatelessActor):
             for model_info in model_infos:
                 self._user_specified_gpu_to_model_uids[dev].remove(model_info)
 
+        for dev in self._gpu_to_shared_model_uids:
+            self._gpu_to_shared_model_uids[dev].pop(model_uid, None)
+
+    async def _allocate_devices_or_evict(
+        self, model_uid: str, n_gpu: int, memory: Optional[float] = None
+    ) -> List[int]:
+        while True:
+            try:
+                if memory is not None:
+                    return self.allocate_devices_with_memory(model_uid, n_gpu, memory)
+                return self.allocate_devices(model_uid=model_uid, n_gpu=n_gpu)
+            except RuntimeError:
+                if not await self._evict_lazy_model():
+                    raise
+
+    async def _evict_lazy_model(self) -> bool:
+        """
+        Unload the least recently used idle lazy model that occupies GPUs,
+        return False if there is no such model.
+        """
+        occupied = set(self._gpu_to_model_uid.values())
+        for model_uids in self._gpu_to_shared_model_uids.values():
+            occupied.update(model_uids)
+        candidates = [
+            model_uid
+            for model_uid in self._lazy_model_uid_to_launch_args
+            if model_uid in self._model_uid_to_model
+            and model_uid in occupied
+            and model_uid not in self._pinned_model_uids
+        ]
+        pending_counts = await asyncio.gather(
+            *[
+                self._model_uid_to_model[model_uid].get_pending_requests_count()
+                for model_uid in candidates
+            ],
+            return_exceptions=True,
+        )
+        idle = [
+            model_uid
+            for model_uid, count in zip(candidates, pending_counts)
+            if count == 0 or isinstance(count, BaseException)
+        ]
+        if not idle:
+            return False
+        model_uid = min(idle, key=lambda uid: self._model_uid_to_last_used.get(uid, 0))
+        logger.info("Unload the least recently used model %s", model_uid)
+        await self._unload_model(model_uid)
+        return True
+
     async def _create_subpool(
         self,
         model_uid: str,
         model_type: Optional[str] = None,
         n_gpu: Optional[Union[int, str]] = "auto",
         gpu_idx: Optional[List[int]] = None,
+        gpu_memory: Optional[float] = None,
     ) -> Tuple[str, List[str]]:
         env = {}
         devices = []
@@ -463,8 +679,10 @@ class WorkerActor(xo.StatelessActor):
                 gpu_cnt = n_gpu if isinstance(n_gpu, int) else 1
                 devices = (
                     [await self.allocate_devices_for_embedding(model_uid)]
-                    if model_type in ["embedding", "rerank"]
-                    else self.allocate_devices(model_uid=model_uid, n_gpu=gpu_cnt)
+                    if model_type in ["embedding", "rerank"] and gpu_memory is None
+                    else await self._allocate_devices_or_evict(
+                        model_uid, gpu_cnt, gpu_memory
+                    )
                 )
                 env[env_name] = ",".join([str(dev) for dev in devices])
                 logger.debug(f"GPU selected: {devices} for model {model_uid}")
@@ -474,20 +692,74 @@ class WorkerActor(xo.StatelessActor):
         else:
             assert isinstance(gpu_idx, list)
             devices = await self.allocate_devices_with_gpu_idx(
-                model_uid, model_type, gpu_idx  # type: ignore
+                model_uid, model_type, gpu_idx, gpu_memory  # type: ignore
             )
             env[env_name] = ",".join([str(dev) for dev in devices])
 
+        subpool_address = await self._get_warm_subpool(env)
+        if subpool_address is None:
+            subpool_address = await self._main_pool.append_sub_pool(
+                env=env, start_method=self._get_subpool_start_method()
+            )
+        if self._warm_subpools_task is not None:
+            # Replace the warm sub pool just handed out.
+            self._refill_warm_subpools()
+        return subpool_address, [str(dev) for dev in devices]
+
+    @staticmethod
+    def _get_subpool_start_method() -> str:
         if os.name != "nt" and platform.system() != "Darwin":
             # Linux
-            start_method = "forkserver"
+            return "forkserver"
         else:
             # Windows and macOS
-            start_method = "spawn"
-        subpool_address = await self._main_pool.append_sub_pool(
-            env=env, start_method=start_method
-        )
-        return subpool_address, [str(dev) for dev in devices]
+            return "spawn"
+
+    async def _get_warm_subpool(self, env: Dict[str, str]) -> Optional[str]:
+        while self._warm_subpools:
+            subpool_address = self._warm_subpools.pop(0)
+            try:
+                env_ref = await xo.create_actor(
+                    SubPoolEnvActor, address=subpool_address, uid="sub_pool_env"
+                )
+                await env_ref.set_env(env)
+                await xo.destroy_actor(env_ref)
+            except Exception:
+                logger.warning(
+                    "Failed to use the warm sub pool %s", subpool_address, exc_info=True
+                )
+                try:
+                    await self._main_pool.remove_sub_pool(subpool_address)
+                except Exception:
+                    pass
+                continue
+            return subpool_address
+        return None
+
+    def _refill_warm_subpools(self):
+        if self._warm_subpools_stopped:
+            return
+        if self._warm_subpools_task is None or self._warm_subpools_task.done():
+            self._warm_subpools_task = asyncio.create_task(self._fill_warm_subpools())
+
+    async def _fill_warm_subpools(self):
+        modules = [
+            module.strip()
+            for module in XINFERENCE_WARM_SUBPOOL_MODULES.split(",")
+            if module.strip() and importlib.util.find_spec(module.strip()) is not None
+        ]
+        while (
+            not self._warm_subpools_stopped
+            and len(self._warm_subpools) < XINFERENCE_WARM_SUBPOOL_SIZE
+        ):
+            try:
+                subpool_address = await self._main_pool.append_sub_pool(
+                    modules=modules, start_method=self._get_subpool_start_method()
+                )
+            except Exception:
+                logger.warning("Failed to start a warm sub pool", exc_info=True)
+                return
+            self._warm_subpools.append(subpool_address)
 
     def _check_model_is_valid(self, model_name: str, model_format: Optional[str]):
         # baichuan-base and baichuan-chat depend on `cpm_kernels` module,
@@ -570,6 +842,9 @@ class WorkerActor(xo.StatelessActor):
         peft_model_config: Optional[PeftModelConfig] = None,
         request_limits: Optional[int] = None,
         gpu_idx: Optional[Union[int, List[int]]] = None,
+        gpu_memory: Optional[float] = None,
+        lazy: bool = False,
+        pinned: bool = False,
         **kwargs,
     ):
         # !!! Note that The following code must be placed at the very beginning of this function,
@@ -613,6 +888,19 @@ class WorkerActor(xo.StatelessActor):
             if isinstance(n_gpu, str) and n_gpu != "auto":
                 raise ValueError("Currently `n_gpu` only supports `auto`.")
 
+        if gpu_memory is not None:
+            if gpu_memory <= 0:
+                raise ValueError("The parameter `gpu_memory` must be greater than 0.")
+            if n_gpu is None and gpu_idx is None:
+                raise ValueError(
+                    "The parameter `gpu_memory` cannot be used when `n_gpu` is None."
+                )
+            if model_type != "LLM" or model_engine not in ("vLLM", "Transformers"):
+                raise ValueError(
+                    "The parameter `gpu_memory` is only supported by "
+                    "the vLLM and Transformers engines of LLMs."
+                )
+
         if peft_model_config is not None:
             if model_type in ("embedding", "rerank"):
                 raise ValueError(
@@ -626,26 +914,52 @@ class WorkerActor(xo.StatelessActor):
         assert model_uid not in self._model_uid_to_model
         self._check_model_is_valid(model_name, model_format)
 
+        origin_uid, _, _ = parse_replica_model_uid(model_uid)
+        if pinned:
+            self._pinned_model_uids.add(model_uid)
+        if lazy:
+            # Loaded by `get_model` on the first request.
+            launch_args["lazy"] = False
+            self._lazy_model_uid_to_launch_args[model_uid] = launch_args
+            await self._status_guard_ref.update_instance_info(
+                origin_uid, {"status": LaunchStatus.READY.name}
+            )
+            return
+
+        gpu_memory_bytes = gpu_memory * 1024**3 if gpu_memory is not None else None
         subpool_address, devices = await self._create_subpool(
-            model_uid, model_type, n_gpu=n_gpu, gpu_idx=gpu_idx
+            model_uid,
+            model_type,
+            n_gpu=n_gpu,
+            gpu_idx=gpu_idx,
+            gpu_memory=gpu_memory_bytes,
         )
+        if gpu_memory_bytes is not None:
+            if model_engine == "vLLM" and "gpu_memory_utilization" not in kwargs:
+                # vLLM preallocates a fraction of the GPU memory, keep it in budget.
+                gpu_memory_total = self._get_gpu_memory_total()
+                kwargs["gpu_memory_utilization"] = min(
+                    gpu_memory_bytes / gpu_memory_total[int(dev)] for dev in devices
+                )
+            elif model_engine == "Transformers":
+                kwargs.setdefault("max_gpu_memory", f"{gpu_memory}GiB")
 
         try:
-            origin_uid, _, _ = parse_replica_model_uid(model_uid)
-            model, model_description = await asyncio.to_thread(
-                create_model_instance,
-                subpool_address,
-                devices,
-                model_uid,
-                model_type,
-                model_name,
-                model_engine,
-                model_format,
-                model_size_in_billions,
-                quantization,
-                peft_model_config,
-                **kwargs,
-            )
+            async with self._model_name_to_cache_lock[model_name]:
+                model, model_description = await asyncio.to_thread(
+                    create_model_instance,
+                    subpool_address,
+                    devices,
+                    model_uid,
+                    model_type,
+                    model_name,
+                    model_engine,
+                    model_format,
+                    model_size_in_billions,
+                    quantization,
+                    peft_model_config,
+                    **kwargs,
+                )
             await self.update_cache_status(model_name, model_description)
             model_ref = await xo.create_actor(
                 ModelActor,
@@ -698,6 +1012,19 @@ class WorkerActor(xo.StatelessActor):
         await self._status_guard_ref.update_instance_info(
             origin_uid, {"status": LaunchStatus.TERMINATING.name}
         )
+        try:
+            await self._unload_model(model_uid)
+        finally:
+            self._lazy_model_uid_to_launch_args.pop(model_uid, None)
+            self._lazy_model_uid_to_lock.pop(model_uid, None)
+            self._model_uid_to_last_used.pop(model_uid, None)
+            self._model_uid_to_model_spec.pop(model_uid, None)
+            self._pinned_model_uids.discard(model_uid)
+            await self._status_guard_ref.update_instance_info(
+                origin_uid, {"status": LaunchStatus.TERMINATED.name}
+            )
+
+    async def _unload_model(self, model_uid: str):
         model_ref = self._model_uid_to_model.get(model_uid, None)
         if model_ref is None:
             logger.debug("Model not found, uid: %s", model_uid)
@@ -717,14 +1044,13 @@ class WorkerActor(xo.StatelessActor):
             )
         finally:
             self._model_uid_to_model.pop(model_uid, None)
-            self._model_uid_to_model_spec.pop(model_uid, None)
+            if model_uid not in self._lazy_model_uid_to_launch_args:
+                # Still listed and described after a lazy model is unloaded.
+                self._model_uid_to_model_spec.pop(model_uid, None)
             self.release_devices(model_uid)
             self._model_uid_to_addr.pop(model_uid, None)
             self._model_uid_to_recover_count.pop(model_uid, None)
             self._model_uid_to_launch_args.pop(model_uid, None)
-            await self._status_guard_ref.update_instance_info(
-                origin_uid, {"status": LaunchStatus.TERMINATED.name}
-            )
 
     @log_async(logger=logger)
     async def list_models(self) -> Dict[str, Dict[str, Any]]:
@@ -733,28 +1059,124 @@ class WorkerActor(xo.StatelessActor):
         items = list(self._model_uid_to_model_spec.items())
         for k, v in items:
             ret[k] = v.to_dict()
+        for k in self._lazy_model_uid_to_launch_args:
+            if k not in ret:
+                ret[k] = self._describe_lazy_model(k)
         return ret
 
-    @log_sync(logger=logger)
-    def get_model(self, model_uid: str) -> xo.ActorRefType["ModelActor"]:
+    @log_async(logger=logger)
+    async def get_model(self, model_uid: str) -> xo.ActorRefType["ModelActor"]:
+        launch_args = self._lazy_model_uid_to_launch_args.get(model_uid)
+        if launch_args is not None:
+            self._model_uid_to_last_used[model_uid] = time.time()
+            async with self._lazy_model_uid_to_lock[model_uid]:
+                if model_uid not in self._model_uid_to_model:
+                    logger.info("Load the lazy model %s", model_uid)
+                    await self.launch_builtin_model(**launch_args)
         model_ref = self._model_uid_to_model.get(model_uid, None)
         if model_ref is None:
             raise ValueError(f"Model not found, uid: {model_uid}")
         return model_ref
 
+    def _describe_lazy_model(self, model_uid: str) -> Dict[str, Any]:
+        # The description of the lazy model that is not loaded yet.
+        launch_args = self._lazy_model_uid_to_launch_args[model_uid]
+        return {
+            "model_type": launch_args["model_type"],
+            "address": None,
+            "accelerators": [],
+            "model_name": launch_args["model_name"],
+            "model_format": launch_args["model_format"],
+            "model_size_in_billions": launch_args["model_size_in_billions"],
+            "quantization": launch_args["quantization"],
+            "model_ability": [],
+        }
+
     @log_sync(logger=logger)
     def describe_model(self, model_uid: str) -> Dict[str, Any]:
         model_desc = self._model_uid_to_model_spec.get(model_uid, None)
         if model_desc is None:
+            if model_uid in self._lazy_model_uid_to_launch_args:
+                return self._describe_lazy_model(model_uid)
             raise ValueError(f"Model not found in the model list, uid: {model_uid}")
         return model_desc.to_dict()
 
+    def _get_pid_to_model_uid(self) -> Dict[int, str]:
+        """
+        The processes of the models, including the processes they started.
+        """
+        sub_processes = getattr(self._main_pool, "sub_processes", {})
+        pid_to_model_uid = {}
+        for model_uid, address in list(self._model_uid_to_addr.items()):
+            pid = getattr(sub_processes.get(address), "pid", None)
+            if pid is None:
+                continue
+            pid_to_model_uid[pid] = model_uid
+            try:
+                children = psutil.Process(pid).children(recursive=True)
+            except psutil.Error:
+                continue
+            for child in children:
+                pid_to_model_uid[child.pid] = model_uid
+        return pid_to_model_uid
+
+    def get_gpu_status(self) -> Dict[str, GPUStatus]:
+        gpu_status = self._gpu_sampler.get_status()
+        if not gpu_status:
+            return gpu_status
+        pid_to_model_uid = self._get_pid_to_model_uid()
+        for name, status in gpu_status.items():
+            model_mem_used: Dict[str, float] = defaultdict(float)
+            for pid, mem_used in status.process_mem_used.items():
+                if pid in pid_to_model_uid:
+                    model_mem_used[pid_to_model_uid[pid]] += mem_used
+            gpu_status[name] = dataclasses.replace(
+                status, model_mem_used=dict(model_mem_used)
+            )
+        return gpu_status
+
+    def _record_gpu_metrics(self, gpu_status: Dict[str, GPUStatus]):
+        model_gpu_metrics_keys = set()
+        for name, status in gpu_status.items():
+            labels = {"node": self.address, "gpu": name}
+            for metric_name, value in (
+                ("gpu_utilization", status.util),
+                ("gpu_memory_used_bytes", status.mem_used),
+                ("gpu_memory_total_bytes", status.mem_total),
+                ("gpu_power_watts", status.power),
+                ("gpu_temperature_celsius", status.temperature),
+            ):
+                if value is not None:
+                    record_metrics(
+                        metric_name, "set", {"labels": labels, "value": value}
+                    )
+            for model_uid, mem_used in status.model_mem_used.items():
+                model_gpu_metrics_keys.add((name, model_uid))
+                record_metrics(
+                    "model_gpu_memory_used_bytes",
+                    "set",
+                    {"labels": {**labels, "model": model_uid}, "value": mem_used},
+                )
+        # The models are gone from the GPUs.
+        for name, model_uid in self._model_gpu_metrics_keys - model_gpu_metrics_keys:
+            record_metrics(
+                "model_gpu_memory_used_bytes",
+                "set",
+                {
+                    "labels": {"node": self.address, "gpu": name, "model": model_uid},
+                    "value": 0,
+                },
+            )
+        self._model_gpu_metrics_keys = model_gpu_metrics_keys
+
     async def report_status(self):
         status = dict()
         try:
             # asyncio.timeout is only available in Python >= 3.11
             async with timeout(2):
-                status = await asyncio.to_thread(gather_node_info)
+                gpu_status = await asyncio.to_thread(self.get_gpu_status)
+                self._record_gpu_metrics(gpu_status)
+                status = await asyncio.to_thread(gather_node_info, gpu_status)
         except asyncio.CancelledError:
             raise
         except Exception:
@@ -784,3 +1206,7 @@ class WorkerActor(xo.StatelessActor):
     @staticmethod
     def record_metrics(name, op, kwargs):
         record_metrics(name, op, kwargs)
+
+    @staticmethod
+    def record_metrics_batch(records):
+        record_metrics_batch(records)
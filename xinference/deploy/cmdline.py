@@ -98,6 +98,7 @@ def start_local_cluster(
     metrics_exporter_host: Optional[str] = None,
     metrics_exporter_port: Optional[int] = None,
     auth_config_file: Optional[str] = None,
+    api_workers: int = 1,
 ):
     from .local import main
 
@@ -116,6 +117,7 @@ def start_local_cluster(
         metrics_exporter_port=metrics_exporter_port,
         logging_conf=dict_config,
         auth_config_file=auth_config_file,
+        api_workers=api_workers,
     )
 
 
@@ -212,6 +214,12 @@ def cli(
     type=str,
     help="Specify the auth config json file.",
 )
+@click.option(
+    "--api-workers",
+    default=1,
+    type=int,
+    help="Specify the number of processes serving the RESTful API, default is 1.",
+)
 def local(
     log_level: str,
     host: str,
@@ -219,6 +227,7 @@ def local(
     metrics_exporter_host: Optional[str],
     metrics_exporter_port: Optional[int],
     auth_config: Optional[str],
+    api_workers: int,
 ):
     if metrics_exporter_host is None:
         metrics_exporter_host = host
@@ -229,6 +238,7 @@ def local(
         metrics_exporter_host=metrics_exporter_host,
         metrics_exporter_port=metrics_exporter_port,
         auth_config_file=auth_config,
+        api_workers=api_workers,
     )
 
 
@@ -266,12 +276,19 @@ def local(
     type=str,
     help="Specify the auth config json file.",
 )
+@click.option(
+    "--api-workers",
+    default=1,
+    type=int,
+    help="Specify the number of processes serving the RESTful API, default is 1.",
+)
 def supervisor(
     log_level: str,
     host: str,
     port: int,
     supervisor_port: Optional[int],
     auth_config: Optional[str],
+    api_workers: int,
 ):
     from ..deploy.supervisor import main
 
@@ -289,6 +306,7 @@ def supervisor(
         supervisor_port=supervisor_port,
         logging_conf=dict_config,
         auth_config_file=auth_config,
+        api_workers=api_workers,
     )
 
 
@@ -646,6 +664,40 @@ def list_model_registrations(
     type=str,
     help='The number of GPUs used by the model, default is "auto".',
 )
+@click.option(
+    "--routing-policy",
+    default="round_robin",
+    type=click.Choice(["round_robin", "least_requests", "prefix_affinity"]),
+    help="How requests are routed among the replicas of the model, "
+    'default is "round_robin".',
+)
+@click.option(
+    "--min-replica",
+    default=None,
+    type=int,
+    help="The minimum replica count when autoscaling, default is 1. "
+    "0 means the model is scaled to zero when it is idle.",
+)
+@click.option(
+    "--max-replica",
+    default=None,
+    type=int,
+    help="The maximum replica count. The replicas are scaled by the load "
+    "if it is specified.",
+)
+@click.option(
+    "--lazy",
+    is_flag=True,
+    default=False,
+    help="Load the model on its first request. It is unloaded when its GPUs "
+    "are needed by another model and it is the least recently used idle one.",
+)
+@click.option(
+    "--pinned",
+    is_flag=True,
+    default=False,
+    help="Never unload the lazy model once it is loaded.",
+)
 @click.option(
     "--lora-modules",
     "-lm",
@@ -679,6 +731,14 @@ def list_model_registrations(
     type=str,
     help="Specify which GPUs of a worker this model can run on, separated with commas.",
 )
+@click.option(
+    "--gpu-memory",
+    default=None,
+    type=str,
+    help="The GPU memory in GiB the model uses on each of its GPUs. The models "
+    "with this budget share the GPUs as long as the budgets fit. "
+    "Use `auto` to estimate it from the size of the LLM.",
+)
 @click.option(
     "--trust-remote-code",
     default=True,
@@ -705,11 +765,17 @@ def model_launch(
     quantization: str,
     replica: int,
     n_gpu: str,
+    routing_policy: str,
+    min_replica: Optional[int],
+    max_replica: Optional[int],
+    lazy: bool,
+    pinned: bool,
     lora_modules: Optional[Tuple],
     image_lora_load_kwargs: Optional[Tuple],
     image_lora_fuse_kwargs: Optional[Tuple],
     worker_ip: Optional[str],
     gpu_idx: Optional[str],
+    gpu_memory: Optional[str],
     trust_remote_code: bool,
     api_key: Optional[str],
 ):
@@ -760,6 +826,9 @@ def model_launch(
     _gpu_idx: Optional[List[int]] = (
         None if gpu_idx is None else [int(idx) for idx in gpu_idx.split(",")]
     )
+    _gpu_memory: Optional[Union[float, str]] = (
+        gpu_memory if gpu_memory is None or gpu_memory == "auto" else float(gpu_memory)
+    )
 
     endpoint = get_endpoint(endpoint)
     model_size: Optional[Union[str, int]] = (
@@ -786,6 +855,12 @@ def model_launch(
         peft_model_config=peft_model_config,
         worker_ip=worker_ip,
         gpu_idx=_gpu_idx,
+        gpu_memory=_gpu_memory,
+        routing_policy=routing_policy,
+        min_replica=min_replica,
+        max_replica=max_replica,
+        lazy=lazy,
+        pinned=pinned,
         trust_remote_code=trust_remote_code,
         **kwargs,
     )
@@ -108,6 +108,7 @@ def main(
     metrics_exporter_port: Optional[int] = None,
     logging_conf: Optional[Dict] = None,
     auth_config_file: Optional[str] = None,
+    api_workers: int = 1,
 ):
     supervisor_address = f"{host}:{get_next_port()}"
     local_cluster = run_in_subprocess(
@@ -130,6 +131,7 @@ def main(
             port=port,
             logging_conf=logging_conf,
             auth_config_file=auth_config_file,
+            api_workers=api_workers,
         )
     finally:
         local_cluster.kill()
@@ -76,6 +76,7 @@ def main(
     supervisor_port: Optional[int],
     logging_conf: Optional[Dict] = None,
     auth_config_file: Optional[str] = None,
+    api_workers: int = 1,
 ):
     supervisor_address = f"{host}:{supervisor_port or get_next_port()}"
     local_cluster = run_in_subprocess(supervisor_address, logging_conf)
@@ -96,6 +97,7 @@ def main(
             port=port,
             logging_conf=logging_conf,
             auth_config_file=auth_config_file,
+            api_workers=api_workers,
         )
     finally:
         local_cluster.kill()
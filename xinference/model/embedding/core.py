@@ -13,10 +13,20 @@
 # limitations under the License.
 
 import gc
+import json
 import logging
 import os
 from collections import defaultdict
-from typing import Dict, List, Optional, Tuple, Union, no_type_check
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Union,
+    cast,
+    no_type_check,
+)
 
 import numpy as np
 
@@ -25,6 +35,9 @@ from ...types import Embedding, EmbeddingData, EmbeddingUsage
 from ..core import CacheableModelSpec, ModelDescription
 from ..utils import get_cache_dir, is_model_cached
 
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
 logger = logging.getLogger(__name__)
 
 # Used for check whether the model is cached.
@@ -141,168 +154,221 @@ class EmbeddingModel:
         patch_trust_remote_code()
         self._model = SentenceTransformer(self._model_path, device=self._device)
 
-    def create_embedding(self, sentences: Union[str, List[str]], **kwargs):
-        self._counter += 1
-        if self._counter % EMBEDDING_EMPTY_CACHE_COUNT == 0:
-            logger.debug("Empty embedding cache.")
-            gc.collect()
-            empty_cache()
-        from sentence_transformers import SentenceTransformer
+    # copied from sentence-transformers, and modify it to return tokens num
+    @staticmethod
+    @no_type_check
+    def _encode(
+        model: "SentenceTransformer",
+        sentences: Union[str, List[str]],
+        batch_size: int = 32,
+        show_progress_bar: bool = None,
+        output_value: str = "sentence_embedding",
+        convert_to_numpy: bool = True,
+        convert_to_tensor: bool = False,
+        device: str = None,
+        normalize_embeddings: bool = False,
+    ):
+        """
+        Computes sentence embeddings
+
+        :param sentences: the sentences to embed
+        :param batch_size: the batch size used for the computation
+        :param show_progress_bar: Output a progress bar when encode sentences
+        :param output_value:  Default sentence_embedding, to get sentence embeddings. Can be set to token_embeddings to get wordpiece token embeddings. Set to None, to get all output values
+        :param convert_to_numpy: If true, the output is a list of numpy vectors. Else, it is a list of pytorch tensors.
+        :param convert_to_tensor: If true, you get one large tensor as return. Overwrites any setting from convert_to_numpy
+        :param device: Which torch.device to use for the computation
+        :param normalize_embeddings: If set to true, returned vectors will have length 1. In that case, the faster dot-product (util.dot_score) instead of cosine similarity can be used.
+
+        :return:
+           By default, a list of tensors is returned. If convert_to_tensor, a stacked tensor is returned. If convert_to_numpy, a numpy matrix is returned.
+        """
+        import torch
+        from sentence_transformers.util import batch_to_device
+        from tqdm.autonotebook import trange
+
+        model.eval()
+        if show_progress_bar is None:
+            show_progress_bar = (
+                logger.getEffectiveLevel() == logging.INFO
+                or logger.getEffectiveLevel() == logging.DEBUG
+            )
 
-        kwargs.setdefault("normalize_embeddings", True)
+        if convert_to_tensor:
+            convert_to_numpy = False
 
-        # copied from sentence-transformers, and modify it to return tokens num
-        @no_type_check
-        def encode(
-            model: SentenceTransformer,
-            sentences: Union[str, List[str]],
-            batch_size: int = 32,
-            show_progress_bar: bool = None,
-            output_value: str = "sentence_embedding",
-            convert_to_numpy: bool = True,
-            convert_to_tensor: bool = False,
-            device: str = None,
-            normalize_embeddings: bool = False,
-        ):
-            """
-            Computes sentence embeddings
-
-            :param sentences: the sentences to embed
-            :param batch_size: the batch size used for the computation
-            :param show_progress_bar: Output a progress bar when encode sentences
-            :param output_value:  Default sentence_embedding, to get sentence embeddings. Can be set to token_embeddings to get wordpiece token embeddings. Set to None, to get all output values
-            :param convert_to_numpy: If true, the output is a list of numpy vectors. Else, it is a list of pytorch tensors.
-            :param convert_to_tensor: If true, you get one large tensor as return. Overwrites any setting from convert_to_numpy
-            :param device: Which torch.device to use for the computation
-            :param normalize_embeddings: If set to true, returned vectors will have length 1. In that case, the faster dot-product (util.dot_score) instead of cosine similarity can be used.
-
-            :return:
-               By default, a list of tensors is returned. If convert_to_tensor, a stacked tensor is returned. If convert_to_numpy, a numpy matrix is returned.
-            """
-            import torch
-            from sentence_transformers.util import batch_to_device
-            from tqdm.autonotebook import trange
-
-            model.eval()
-            if show_progress_bar is None:
-                show_progress_bar = (
-                    logger.getEffectiveLevel() == logging.INFO
-                    or logger.getEffectiveLevel() == logging.DEBUG
-                )
+        if output_value != "sentence_embedding":
+            convert_to_tensor = False
+            convert_to_numpy = False
 
-            if convert_to_tensor:
-                convert_to_numpy = False
+        input_was_string = False
+        if isinstance(sentences, str) or not hasattr(
+            sentences, "__len__"
+        ):  # Cast an individual sentence to a list with length 1
+            sentences = [sentences]
+            input_was_string = True
 
-            if output_value != "sentence_embedding":
-                convert_to_tensor = False
-                convert_to_numpy = False
+        if device is None:
+            device = model._target_device
 
-            input_was_string = False
-            if isinstance(sentences, str) or not hasattr(
-                sentences, "__len__"
-            ):  # Cast an individual sentence to a list with length 1
-                sentences = [sentences]
-                input_was_string = True
+        model.to(device)
 
-            if device is None:
-                device = model._target_device
+        all_embeddings = []
+        all_token_nums = []
+        length_sorted_idx = np.argsort([-model._text_length(sen) for sen in sentences])
+        sentences_sorted = [sentences[idx] for idx in length_sorted_idx]
 
-            model.to(device)
+        for start_index in trange(
+            0,
+            len(sentences),
+            batch_size,
+            desc="Batches",
+            disable=not show_progress_bar,
+        ):
+            sentences_batch = sentences_sorted[start_index : start_index + batch_size]
+            features = model.tokenize(sentences_batch)
+            features = batch_to_device(features, device)
+            if "attention_mask" in features:
+                all_token_nums.extend(features["attention_mask"].sum(dim=1).tolist())
+            else:
+                all_token_nums.extend(len(ids) for ids in features["input_ids"])
+
+            with torch.no_grad():
+                out_features = model.forward(features)
+
+                if output_value == "token_embeddings":
+                    embeddings = []
+                    for token_emb, attention in zip(
+                        out_features[output_value], out_features["attention_mask"]
+                    ):
+                        last_mask_id = len(attention) - 1
+                        while last_mask_id > 0 and attention[last_mask_id].item() == 0:
+                            last_mask_id -= 1
+
+                        embeddings.append(token_emb[0 : last_mask_id + 1])
+                elif output_value is None:  # Return all outputs
+                    embeddings = []
+                    for sent_idx in range(len(out_features["sentence_embedding"])):
+                        row = {
+                            name: out_features[name][sent_idx] for name in out_features
+                        }
+                        embeddings.append(row)
+                else:  # Sentence embeddings
+                    embeddings = out_features[output_value]
+                    embeddings = embeddings.detach()
+                    if normalize_embeddings:
+                        embeddings = torch.nn.functional.normalize(
+                            embeddings, p=2, dim=1
+                        )
+
+                    # fixes for #522 and #487 to avoid oom problems on gpu with large datasets
+                    if convert_to_numpy:
+                        embeddings = embeddings.cpu()
+
+                all_embeddings.extend(embeddings)
+
+        all_embeddings = [all_embeddings[idx] for idx in np.argsort(length_sorted_idx)]
+        all_token_nums = [all_token_nums[idx] for idx in np.argsort(length_sorted_idx)]
+
+        if convert_to_tensor:
+            all_embeddings = torch.stack(all_embeddings)
+        elif convert_to_numpy:
+            all_embeddings = np.asarray([emb.numpy() for emb in all_embeddings])
+
+        if input_was_string:
+            all_embeddings = all_embeddings[0]
+
+        return all_embeddings, all_token_nums
 
-            all_embeddings = []
-            all_token_nums = 0
-            length_sorted_idx = np.argsort(
-                [-model._text_length(sen) for sen in sentences]
+    def create_embedding(self, sentences: Union[str, List[str]], **kwargs):
+        result = self.batch_create_embedding([(sentences, kwargs)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _encode_requests(
+        self, requests: List[Tuple[Union[str, List[str]], Dict]], indices: List[int]
+    ) -> List[Embedding]:
+        """Encode the sentences of the requests with the same options together."""
+        kwargs = dict(requests[indices[0]][1])
+        kwargs.setdefault("normalize_embeddings", True)
+        all_sentences: List[str] = []
+        for i in indices:
+            sentences = requests[i][0]
+            all_sentences.extend(
+                [sentences] if isinstance(sentences, str) else sentences
             )
-            sentences_sorted = [sentences[idx] for idx in length_sorted_idx]
-
-            for start_index in trange(
-                0,
-                len(sentences),
-                batch_size,
-                desc="Batches",
-                disable=not show_progress_bar,
-            ):
-                sentences_batch = sentences_sorted[
-                    start_index : start_index + batch_size
-                ]
-                features = model.tokenize(sentences_batch)
-                features = batch_to_device(features, device)
-                all_token_nums += sum([len(f) for f in features])
-
-                with torch.no_grad():
-                    out_features = model.forward(features)
-
-                    if output_value == "token_embeddings":
-                        embeddings = []
-                        for token_emb, attention in zip(
-                            out_features[output_value], out_features["attention_mask"]
-                        ):
-                            last_mask_id = len(attention) - 1
-                            while (
-                                last_mask_id > 0 and attention[last_mask_id].item() == 0
-                            ):
-                                last_mask_id -= 1
-
-                            embeddings.append(token_emb[0 : last_mask_id + 1])
-                    elif output_value is None:  # Return all outputs
-                        embeddings = []
-                        for sent_idx in range(len(out_features["sentence_embedding"])):
-                            row = {
-                                name: out_features[name][sent_idx]
-                                for name in out_features
-                            }
-                            embeddings.append(row)
-                    else:  # Sentence embeddings
-                        embeddings = out_features[output_value]
-                        embeddings = embeddings.detach()
-                        if normalize_embeddings:
-                            embeddings = torch.nn.functional.normalize(
-                                embeddings, p=2, dim=1
-                            )
-
-                        # fixes for #522 and #487 to avoid oom problems on gpu with large datasets
-                        if convert_to_numpy:
-                            embeddings = embeddings.cpu()
-
-                    all_embeddings.extend(embeddings)
-
-            all_embeddings = [
-                all_embeddings[idx] for idx in np.argsort(length_sorted_idx)
-            ]
-
-            if convert_to_tensor:
-                all_embeddings = torch.stack(all_embeddings)
-            elif convert_to_numpy:
-                all_embeddings = np.asarray([emb.numpy() for emb in all_embeddings])
-
-            if input_was_string:
-                all_embeddings = all_embeddings[0]
-
-            return all_embeddings, all_token_nums
 
-        all_embeddings, all_token_nums = encode(
+        all_embeddings, all_token_nums = self._encode(
             self._model,
-            sentences,
+            all_sentences,
             convert_to_numpy=False,
             **kwargs,
         )
-        if isinstance(sentences, str):
-            all_embeddings = [all_embeddings]
-        embedding_list = []
-        for index, data in enumerate(all_embeddings):
-            embedding_list.append(
-                EmbeddingData(index=index, object="embedding", embedding=data.tolist())
+
+        results = []
+        offset = 0
+        for i in indices:
+            sentences = requests[i][0]
+            num = 1 if isinstance(sentences, str) else len(sentences)
+            embedding_list = []
+            for index, data in enumerate(all_embeddings[offset : offset + num]):
+                embedding_list.append(
+                    EmbeddingData(
+                        index=index, object="embedding", embedding=data.tolist()
+                    )
+                )
+            token_num = int(sum(all_token_nums[offset : offset + num]))
+            usage = EmbeddingUsage(prompt_tokens=token_num, total_tokens=token_num)
+            results.append(
+                Embedding(
+                    object="list",
+                    model=self._model_uid,
+                    data=embedding_list,
+                    usage=usage,
+                )
             )
-        usage = EmbeddingUsage(
-            prompt_tokens=all_token_nums, total_tokens=all_token_nums
-        )
-        return Embedding(
-            object="list",
-            model=self._model_uid,
-            data=embedding_list,
-            usage=usage,
-        )
+            offset += num
+        return results
+
+    def batch_create_embedding(
+        self, requests: List[Tuple[Union[str, List[str]], Dict]]
+    ) -> List[Union[Embedding, Exception]]:
+        """
+        Create embeddings for several requests at once. The sentences of the requests
+        with the same options are encoded together in one length-sorted pass,
+        then split back to one `Embedding` per request.
+        An invalid request gets its exception as the result.
+        """
+        self._counter += 1
+        if self._counter % EMBEDDING_EMPTY_CACHE_COUNT == 0:
+            logger.debug("Empty embedding cache.")
+            gc.collect()
+            empty_cache()
+
+        groups: Dict[str, List[int]] = defaultdict(list)
+        for i, (_, kwargs) in enumerate(requests):
+            groups[json.dumps(kwargs, sort_keys=True, default=str)].append(i)
+
+        results: List[Optional[Union[Embedding, Exception]]] = [None] * len(requests)
+        for indices in groups.values():
+            try:
+                embeddings = self._encode_requests(requests, indices)
+            except Exception as e:
+                if len(indices) == 1:
+                    results[indices[0]] = e
+                    continue
+                # Encode the requests one by one to find the invalid ones, so
+                # the other requests with the same options are not failed.
+                for i in indices:
+                    try:
+                        results[i] = self._encode_requests(requests, [i])[0]
+                    except Exception as e:
+                        results[i] = e
+                continue
+            for i, embedding in zip(indices, embeddings):
+                results[i] = embedding
+        return cast(List[Union[Embedding, Exception]], results)
 
 
 def match_embedding(model_name: str) -> EmbeddingModelSpec:
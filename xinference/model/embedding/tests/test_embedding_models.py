@@ -212,3 +212,38 @@ def test_register_custom_embedding():
         unregister_embedding("custom_test_d")
 
     shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def test_batch_create_embedding_errors():
+    import torch
+
+    def _encode(model, sentences, convert_to_numpy=True, **kwargs):
+        if kwargs.get("batch_size") == -1:
+            raise ValueError("Invalid batch size")
+        if any(len(s) > 10 for s in sentences):
+            raise ValueError("Input is too long")
+        return [torch.full((2,), float(len(s))) for s in sentences], [
+            len(s) for s in sentences
+        ]
+
+    model = EmbeddingModel("mock", "mock_path")
+    model._encode = _encode  # type: ignore
+    results = model.batch_create_embedding(
+        [
+            ("hello", {}),
+            (["hi", "a very long input"], {}),
+            (["world", "hey"], {}),
+            ("bad options", {"batch_size": -1}),
+        ]
+    )
+    # Only the invalid requests fail, the others are encoded.
+    assert results[0]["data"][0]["embedding"] == [5.0, 5.0]  # type: ignore
+    assert isinstance(results[1], ValueError)
+    assert [d["embedding"] for d in results[2]["data"]] == [  # type: ignore
+        [5.0, 5.0],
+        [3.0, 3.0],
+    ]
+    assert results[2]["usage"]["total_tokens"] == 8  # type: ignore
+    assert isinstance(results[3], ValueError)
+    with pytest.raises(ValueError, match="too long"):
+        model.create_embedding(["a very long input"])
@@ -11,10 +11,12 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import contextlib
 import datetime
 import logging
 import os
-from typing import Iterable, Iterator, List, Optional, Union
+import queue
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Union
 
 from ....types import (
     ChatCompletion,
@@ -31,6 +33,9 @@ from ..core import LLM
 from ..llm_family import LLMFamilyV1, LLMSpecV1
 from ..utils import ChatModelMixin
 
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+
 logger = logging.getLogger(__name__)
 
 
@@ -46,10 +51,19 @@ class LlamaCppModel(LLM):
     ):
         super().__init__(model_uid, model_family, model_spec, quantization, model_path)
 
+        # The number of llama.cpp contexts, each serves one generation at a time.
+        self._n_parallel = 1
+        if llamacpp_model_config is not None:
+            self._n_parallel = max(1, int(llamacpp_model_config.pop("n_parallel", 1)))
         self._llamacpp_model_config: LlamaCppModelConfig = self._sanitize_model_config(
             llamacpp_model_config
         )
         self._llm = None
+        self._llm_pool: "queue.Queue[Llama]" = queue.Queue()
+
+    @property
+    def n_parallel(self) -> int:
+        return self._n_parallel
 
     def _can_apply_cublas(self):
         # TODO: figure out the quantizations supported.
@@ -64,8 +78,13 @@ class LlamaCppModel(LLM):
         if self.model_family.context_length:
             llamacpp_model_config.setdefault("n_ctx", self.model_family.context_length)
         llamacpp_model_config.setdefault("embedding", True)
-        llamacpp_model_config.setdefault("use_mmap", False)
-        llamacpp_model_config.setdefault("use_mlock", True)
+        if self._n_parallel > 1:
+            # The contexts share the weights through the mmap'd model file.
+            llamacpp_model_config.setdefault("use_mmap", True)
+            llamacpp_model_config.setdefault("use_mlock", False)
+        else:
+            llamacpp_model_config.setdefault("use_mmap", False)
+            llamacpp_model_config.setdefault("use_mlock", True)
 
         if (
             "llama-2" in self.model_family.model_name
@@ -172,8 +191,32 @@ class LlamaCppModel(LLM):
                 verbose=True,
                 **self._llamacpp_model_config,
             )
+            self._llm_pool.put(self._llm)
+            for _ in range(self._n_parallel - 1):
+                self._llm_pool.put(
+                    Llama(
+                        model_path=model_path,
+                        verbose=False,
+                        **self._llamacpp_model_config,
+                    )
+                )
         except AssertionError:
             raise RuntimeError(f"Load model {self.model_family.model_name} failed")
+        if self._n_parallel > 1:
+            logger.info(
+                "Model %s is loaded with %d parallel contexts.",
+                self.model_uid,
+                self._n_parallel,
+            )
+
+    @contextlib.contextmanager
+    def _acquire_llm(self) -> Iterator["Llama"]:
+        """Take an idle llama.cpp context, wait if all of them are busy."""
+        llm = self._llm_pool.get()
+        try:
+            yield llm
+        finally:
+            self._llm_pool.put(llm)
 
     @classmethod
     def match(
@@ -195,8 +238,14 @@ class LlamaCppModel(LLM):
             _generate_config: LlamaCppGenerateConfig,
         ) -> Iterator[CompletionChunk]:
             assert self._llm is not None
-            for _completion_chunk in self._llm(prompt=_prompt, **_generate_config):
-                yield _completion_chunk
+            with self._acquire_llm() as llm:
+                it = llm(prompt=_prompt, **_generate_config)
+                try:
+                    for _completion_chunk in it:
+                        yield _completion_chunk
+                finally:
+                    # Stop the llama.cpp iterator if the request is aborted.
+                    it.close()
 
         logger.debug(
             "Enter generate, prompt: %s, generate config: %s", prompt, generate_config
@@ -208,7 +257,8 @@ class LlamaCppModel(LLM):
 
         if not stream:
             assert self._llm is not None
-            completion = self._llm(prompt=prompt, **generate_config)
+            with self._acquire_llm() as llm:
+                completion = llm(prompt=prompt, **generate_config)
 
             return completion
         else:
@@ -216,7 +266,8 @@ class LlamaCppModel(LLM):
 
     def create_embedding(self, input: Union[str, List[str]]) -> Embedding:
         assert self._llm is not None
-        embedding = self._llm.create_embedding(input)
+        with self._acquire_llm() as llm:
+            embedding = llm.create_embedding(input)
         return embedding
 
 
@@ -29,6 +29,7 @@ from ....types import (
 )
 from ..llm_family import LLMFamilyV1, LLMSpecV1
 from .core import PytorchChatModel, PytorchModelConfig
+from .utils import StopStringMatcher
 
 
 class ChatglmPytorchChatModel(PytorchChatModel):
@@ -147,16 +148,21 @@ class ChatglmPytorchChatModel(PytorchChatModel):
             )
         else:
             stream = generate_config.get("stream", False)
+            stop_matcher = StopStringMatcher(generate_config.get("stop"))
             if stream:
 
-                def _stream_generator():
+                def _chunk_texts():
                     last_chunk_text_length = 0
-                    chunk_id = "chat-" + str(uuid.uuid1())
                     for chunk_text, _ in self._model.stream_chat(
                         self._tokenizer, prompt, chat_history, **kwargs
                     ):
                         chunk_text = chunk_text[last_chunk_text_length:]
                         last_chunk_text_length += len(chunk_text)
+                        yield chunk_text
+
+                def _stream_generator():
+                    chunk_id = "chat-" + str(uuid.uuid1())
+                    for chunk_text in stop_matcher.filter(_chunk_texts()):
                         completion_choice = CompletionChoice(
                             text=chunk_text, index=0, logprobs=None, finish_reason=None
                         )
@@ -173,6 +179,9 @@ class ChatglmPytorchChatModel(PytorchChatModel):
                 response, _ = self._model.chat(
                     self._tokenizer, prompt, chat_history, **kwargs
                 )
+                stop_pos = stop_matcher.feed(response)
+                if stop_pos is not None:
+                    response = response[:stop_pos]
                 return ChatCompletion(
                     id="chat" + str(uuid.uuid1()),
                     object="chat.completion",
@@ -15,8 +15,23 @@
 import json
 import logging
 import os
-from typing import Iterable, Iterator, List, Optional, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncGenerator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
+from ....constants import (
+    XINFERENCE_PREFIX_CACHE_SIZE,
+    XINFERENCE_WEIGHT_CACHE_DIR,
+    XINFERENCE_WEIGHT_CACHE_SIZE,
+)
 from ....device_utils import (
     get_device_preferred_dtype,
     gpu_count,
@@ -40,6 +55,18 @@ from ...utils import select_device
 from ..core import LLM
 from ..llm_family import LLMFamilyV1, LLMSpecV1
 from ..utils import ChatModelMixin
+from .prefix_cache import PrefixCache
+from .speculative import (
+    NGRAM_SPECULATIVE_MODEL,
+    DraftModelDrafter,
+    NgramDrafter,
+    SpecDecodeStats,
+    generate_stream_speculative,
+)
+from .weight_cache import WeightCache, get_weight_cache_key
+
+if TYPE_CHECKING:
+    from ....core.scheduler import InferenceRequest
 
 logger = logging.getLogger(__name__)
 
@@ -62,6 +89,10 @@ NON_DEFAULT_MODEL_LIST: List[str] = [
     "deepseek-vl-chat",
 ]
 
+WEIGHT_CACHE = WeightCache(
+    XINFERENCE_WEIGHT_CACHE_DIR, int(XINFERENCE_WEIGHT_CACHE_SIZE * 1024**3)
+)
+
 
 class PytorchModel(LLM):
     def __init__(
@@ -80,6 +111,10 @@ class PytorchModel(LLM):
             pytorch_model_config
         )
         self._peft_model = peft_model
+        self._prefix_cache: Optional[PrefixCache] = None
+        # The draft model, or `NGRAM_SPECULATIVE_MODEL` for the prompt lookup.
+        self._speculative_model: Any = None
+        self._spec_decode_stats = SpecDecodeStats()
 
     def _sanitize_model_config(
         self, pytorch_model_config: Optional[PytorchModelConfig]
@@ -93,6 +128,15 @@ class PytorchModel(LLM):
         pytorch_model_config.setdefault("gptq_act_order", False)
         pytorch_model_config.setdefault("device", "auto")
         pytorch_model_config.setdefault("trust_remote_code", True)
+        pytorch_model_config.setdefault("max_num_seqs", 16)
+        pytorch_model_config.setdefault(
+            "prefix_cache_size", XINFERENCE_PREFIX_CACHE_SIZE
+        )
+        pytorch_model_config.setdefault("prefill_chunk_size", 2048)
+        pytorch_model_config.setdefault("speculative_model", None)
+        pytorch_model_config.setdefault("num_speculative_tokens", 5)
+        pytorch_model_config.setdefault("ngram_prompt_lookup_max", 4)
+        pytorch_model_config.setdefault("ngram_prompt_lookup_min", 1)
         return pytorch_model_config
 
     def _sanitize_generate_config(
@@ -134,6 +178,97 @@ class PytorchModel(LLM):
         )
         return model, tokenizer
 
+    def _load_model_with_weight_cache(self, **kwargs):
+        # The device placement does not change the weights.
+        key = get_weight_cache_key(
+            self.model_path,
+            model_class=type(self).__name__,
+            **{
+                k: v for k, v in kwargs.items() if k not in ("device_map", "max_memory")
+            },
+        )
+        model_path = self.model_path
+        cache_path = WEIGHT_CACHE.get(key)
+        if cache_path is not None:
+            logger.info(f"Load the cached weights of model {self.model_uid}")
+            self.model_path = cache_path
+            try:
+                return self._load_model(**kwargs)
+            except Exception:
+                logger.warning(
+                    f"Failed to load the cached weights of model {self.model_uid}",
+                    exc_info=True,
+                )
+            finally:
+                self.model_path = model_path
+
+        model, tokenizer = self._load_model(**kwargs)
+        try:
+            WEIGHT_CACHE.put(
+                key,
+                model_path,
+                lambda path: model.save_pretrained(path, safe_serialization=True),
+                model.get_memory_footprint(),
+            )
+        except Exception:
+            logger.warning(
+                f"Failed to cache the weights of model {self.model_uid}", exc_info=True
+            )
+        return model, tokenizer
+
+    def _load_speculative_model(self, is_device_map_auto: bool, **kwargs):
+        speculative_model = self._pytorch_model_config.get("speculative_model")
+        if not speculative_model:
+            return
+        num_speculative_tokens = int(
+            self._pytorch_model_config["num_speculative_tokens"]
+        )
+        if num_speculative_tokens < 1:
+            raise ValueError(
+                f"num_speculative_tokens should be positive, got {num_speculative_tokens}"
+            )
+        self._pytorch_model_config["num_speculative_tokens"] = num_speculative_tokens
+        if speculative_model == NGRAM_SPECULATIVE_MODEL:
+            self._speculative_model = NGRAM_SPECULATIVE_MODEL
+            return
+
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        # The revision is of the target model.
+        kwargs.pop("revision", None)
+        tokenizer = AutoTokenizer.from_pretrained(
+            speculative_model, trust_remote_code=kwargs["trust_remote_code"]
+        )
+        if tokenizer.get_vocab() != self._tokenizer.get_vocab():
+            raise ValueError(
+                f"The speculative model {speculative_model} should share the "
+                f"tokenizer of the model {self.model_uid}"
+            )
+        model = AutoModelForCausalLM.from_pretrained(
+            speculative_model, low_cpu_mem_usage=True, **kwargs
+        )
+        if not is_device_map_auto:
+            model.to(self._device)
+        self._speculative_model = model.eval()
+        logger.info(
+            f"Load the speculative model {speculative_model} "
+            f"of model {self.model_uid}"
+        )
+
+    def _create_drafter(self):
+        if self._speculative_model == NGRAM_SPECULATIVE_MODEL:
+            return NgramDrafter(
+                int(self._pytorch_model_config["ngram_prompt_lookup_max"]),
+                int(self._pytorch_model_config["ngram_prompt_lookup_min"]),
+            )
+        return DraftModelDrafter(
+            self._speculative_model, self._device, self.get_kv_cache_seq_dim()
+        )
+
+    def get_spec_decode_stats(self) -> Tuple[int, int]:
+        """Return the (drafted, accepted) tokens since the last call."""
+        return self._spec_decode_stats.collect()
+
     def _apply_lora(self):
         if self._peft_model is not None:
             try:
@@ -199,6 +334,23 @@ class PytorchModel(LLM):
             }
             kwargs["max_memory"] = max_memory
 
+        max_gpu_memory = self._pytorch_model_config.get("max_gpu_memory")
+        if max_gpu_memory is not None and self._device == "cuda":
+            kwargs["max_memory"] = {
+                **kwargs.get("max_memory", {}),
+                **{i: max_gpu_memory for i in range(num_gpus)},
+            }
+            # The weights are placed within the budget, also cap the allocator
+            # so that the kv caches and the activations stay within it.
+            from accelerate.utils import convert_file_size_to_int
+
+            max_gpu_memory_bytes = convert_file_size_to_int(max_gpu_memory)
+            for i in range(num_gpus):
+                total = torch.cuda.get_device_properties(i).total_memory
+                torch.cuda.set_per_process_memory_fraction(
+                    min(max_gpu_memory_bytes / total, 1.0), i
+                )
+
         if quantization != "none" and model_format == "pytorch":
             if self._device == "cuda" and self._is_linux():
                 kwargs["device_map"] = "auto"
@@ -240,11 +392,23 @@ class PytorchModel(LLM):
             kwargs.update({"device_map": "auto"})
             is_device_map_auto = True
 
-        self._model, self._tokenizer = self._load_model(**kwargs)
+        if (
+            WEIGHT_CACHE.enabled
+            and quantization == "none"
+            and model_format == "pytorch"
+        ):
+            self._model, self._tokenizer = self._load_model_with_weight_cache(**kwargs)
+        else:
+            self._model, self._tokenizer = self._load_model(**kwargs)
         self._apply_lora()
 
         if not is_device_map_auto:
             self._model.to(self._device)
+        self._load_speculative_model(is_device_map_auto, **kwargs)
+        self._prefix_cache = PrefixCache(
+            int(float(self._pytorch_model_config["prefix_cache_size"]) * 1024**3),
+            self.get_kv_cache_seq_dim(),
+        )
         logger.debug(f"Model Memory: {self._model.get_memory_footprint()}")
 
     @classmethod
@@ -267,31 +431,51 @@ class PytorchModel(LLM):
 
         model_family_name = self.model_family.model_name.lower()
 
-        def generator_wrapper(
-            prompt: str, generate_config: PytorchGenerateConfig
-        ) -> Iterator[CompletionChunk]:
+        def _generate_stream(prompt: str, generate_config: PytorchGenerateConfig):
             if "falcon" in model_family_name:
-                for completion_chunk, completion_usage in generate_stream_falcon(
+                return generate_stream_falcon(
                     self.model_uid,
                     self._model,
                     self._tokenizer,
                     prompt,
                     self._device,
                     generate_config,
-                ):
-                    completion_chunk["usage"] = completion_usage
-                    yield completion_chunk
+                )
+            elif self._speculative_model is not None:
+                return generate_stream_speculative(
+                    self.model_uid,
+                    self._model,
+                    self._tokenizer,
+                    prompt,
+                    self._device,
+                    generate_config,
+                    self._create_drafter(),
+                    self._pytorch_model_config["num_speculative_tokens"],
+                    stats=self._spec_decode_stats,
+                    kv_cache_seq_dim=self.get_kv_cache_seq_dim(),
+                    prefix_cache=self._prefix_cache,
+                    prefill_chunk_size=self._get_prefill_chunk_size(),
+                )
             else:
-                for completion_chunk, completion_usage in generate_stream(
+                return generate_stream(
                     self.model_uid,
                     self._model,
                     self._tokenizer,
                     prompt,
                     self._device,
                     generate_config,
-                ):
-                    completion_chunk["usage"] = completion_usage
-                    yield completion_chunk
+                    prefix_cache=self._prefix_cache,
+                    prefill_chunk_size=self._get_prefill_chunk_size(),
+                )
+
+        def generator_wrapper(
+            prompt: str, generate_config: PytorchGenerateConfig
+        ) -> Iterator[CompletionChunk]:
+            for completion_chunk, completion_usage in _generate_stream(
+                prompt, generate_config
+            ):
+                completion_chunk["usage"] = completion_usage
+                yield completion_chunk
 
         logger.debug(
             "Enter generate, prompt: %s, generate config: %s", prompt, generate_config
@@ -304,26 +488,10 @@ class PytorchModel(LLM):
 
         stream = generate_config.get("stream", False)
         if not stream:
-            if "falcon" in model_family_name:
-                for completion_chunk, completion_usage in generate_stream_falcon(
-                    self.model_uid,
-                    self._model,
-                    self._tokenizer,
-                    prompt,
-                    self._device,
-                    generate_config,
-                ):
-                    pass
-            else:
-                for completion_chunk, completion_usage in generate_stream(
-                    self.model_uid,
-                    self._model,
-                    self._tokenizer,
-                    prompt,
-                    self._device,
-                    generate_config,
-                ):
-                    pass
+            for completion_chunk, completion_usage in _generate_stream(
+                prompt, generate_config
+            ):
+                pass
             completion = Completion(
                 id=completion_chunk["id"],
                 object=completion_chunk["object"],
@@ -336,6 +504,72 @@ class PytorchModel(LLM):
         else:
             return generator_wrapper(prompt, generate_config)
 
+    def support_batching(self) -> bool:
+        """
+        Whether the model can be served by the continuous batching scheduler.
+        Models with their own generate loop are not supported.
+        """
+        if "falcon" in self.model_family.model_name.lower():
+            return False
+        if type(self).generate is not PytorchModel.generate:
+            return False
+        # The speculative decoding runs its own generate loop.
+        if self._speculative_model is not None:
+            return False
+        return not self._model.config.is_encoder_decoder
+
+    def get_max_num_seqs(self) -> int:
+        return self._pytorch_model_config.get("max_num_seqs", 16)
+
+    def _get_prefill_chunk_size(self) -> int:
+        return int(self._pytorch_model_config.get("prefill_chunk_size", 0))
+
+    def get_kv_cache_seq_dim(self) -> int:
+        model_type = str(type(self._model)).lower()
+        # The kv cache of qwen is shaped [batch, seq, heads, dim].
+        if ".modeling_qwen." in model_type:
+            return 1
+        # The kv cache of chatglm is shaped [seq, batch, heads, dim].
+        if ".modeling_chatglm." in model_type:
+            return 0
+        return 2
+
+    def get_kv_cache_batch_dim(self) -> int:
+        if ".modeling_chatglm." in str(type(self._model)).lower():
+            return 1
+        return 0
+
+    def prepare_batch_generate_request(
+        self, prompt: str, generate_config: Optional[PytorchGenerateConfig] = None
+    ) -> "InferenceRequest":
+        from ....core.scheduler import InferenceRequest
+
+        generate_config = self._sanitize_generate_config(generate_config)
+        return InferenceRequest(prompt, generate_config)
+
+    def batch_inference(self, req_list: List["InferenceRequest"]):
+        from .utils import batch_inference_one_step
+
+        batch_inference_one_step(
+            req_list,
+            self.model_uid,
+            self._model,
+            self._tokenizer,
+            self._device,
+            self.get_kv_cache_seq_dim(),
+            self._prefix_cache,
+            self._get_prefill_chunk_size(),
+            self.get_kv_cache_batch_dim(),
+        )
+
+    def batch_stream_response(
+        self, req: "InferenceRequest", chunks: AsyncGenerator[CompletionChunk, None]
+    ) -> AsyncGenerator:
+        return chunks
+
+    def batch_response(self, req: "InferenceRequest", completion: Completion):
+        return completion
+
     def create_embedding(self, input: Union[str, List[str]]) -> Embedding:
         try:
             import torch
@@ -470,13 +704,20 @@ class PytorchChatModel(PytorchModel, ChatModelMixin):
             return False
         return True
 
-    def chat(
+    def support_batching(self) -> bool:
+        # The models with their own `chat`, e.g. chatglm and the vision models,
+        # build their inputs in a way the batched requests can not reproduce.
+        if type(self).chat is not PytorchChatModel.chat:
+            return False
+        return super().support_batching()
+
+    def _get_full_prompt_and_config(
         self,
         prompt: str,
         system_prompt: Optional[str] = None,
         chat_history: Optional[List[ChatCompletionMessage]] = None,
         generate_config: Optional[PytorchGenerateConfig] = None,
-    ) -> Union[ChatCompletion, Iterator[ChatCompletionChunk]]:
+    ):
         assert self.model_family.prompt_style is not None
         prompt_style = self.model_family.prompt_style.copy()
         if system_prompt:
@@ -497,6 +738,18 @@ class PytorchChatModel(PytorchModel, ChatModelMixin):
                 generate_config["stop"] = list(stop) + ["Observation:"]
             else:
                 generate_config["stop"] = "Observation:"
+        return full_prompt, generate_config, tools
+
+    def chat(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        chat_history: Optional[List[ChatCompletionMessage]] = None,
+        generate_config: Optional[PytorchGenerateConfig] = None,
+    ) -> Union[ChatCompletion, Iterator[ChatCompletionChunk]]:
+        full_prompt, generate_config, tools = self._get_full_prompt_and_config(
+            prompt, system_prompt, chat_history, generate_config
+        )
 
         stream = generate_config.get("stream", False)
         if stream:
@@ -511,3 +764,33 @@ class PytorchChatModel(PytorchModel, ChatModelMixin):
                     self.model_family, self.model_uid, c, tools
                 )
             return self._to_chat_completion(c)
+
+    def prepare_batch_chat_request(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        chat_history: Optional[List[ChatCompletionMessage]] = None,
+        generate_config: Optional[PytorchGenerateConfig] = None,
+    ) -> "InferenceRequest":
+        from ....core.scheduler import InferenceRequest
+
+        full_prompt, generate_config, tools = self._get_full_prompt_and_config(
+            prompt, system_prompt, chat_history, generate_config
+        )
+        return InferenceRequest(full_prompt, generate_config, "chat", tools)
+
+    def batch_stream_response(
+        self, req: "InferenceRequest", chunks: AsyncGenerator[CompletionChunk, None]
+    ) -> AsyncGenerator:
+        if req.call_ability == "chat":
+            return self._async_to_chat_completion_chunks(chunks)
+        return chunks
+
+    def batch_response(self, req: "InferenceRequest", completion: Completion):
+        if req.call_ability == "chat":
+            if req.tools:
+                return self._tool_calls_completion(
+                    self.model_family, self.model_uid, completion, req.tools
+                )
+            return self._to_chat_completion(completion)
+        return completion
@@ -36,6 +36,7 @@ from ....types import (
 )
 from ..llm_family import LLMFamilyV1, LLMSpecV1
 from .core import PytorchChatModel, PytorchGenerateConfig
+from .utils import StopStringMatcher
 
 logger = logging.getLogger(__name__)
 
@@ -225,9 +226,7 @@ class DeepSeekVLChatModel(PytorchChatModel):
 
     def _generate(self, streamer, stop_str) -> Completion:
         generated_text = ""
-        for new_text in streamer:
-            if new_text.endswith(stop_str):
-                new_text = new_text[: -len(stop_str)]
+        for new_text in StopStringMatcher(stop_str).filter(streamer):
             generated_text += new_text
 
         c = Completion(
@@ -248,9 +247,7 @@ class DeepSeekVLChatModel(PytorchChatModel):
 
     def _generate_stream(self, streamer, stop_str) -> Iterator[CompletionChunk]:
         completion_id = str(uuid.uuid1())
-        for i, new_text in enumerate(streamer):
-            if new_text.endswith(stop_str):
-                new_text = new_text[: -len(stop_str)]
+        for new_text in StopStringMatcher(stop_str).filter(streamer):
             completion_choice = CompletionChoice(
                 text=new_text, index=0, logprobs=None, finish_reason=None
             )
@@ -27,7 +27,7 @@ from ....types import (
     PytorchGenerateConfig,
 )
 from ..llm_family import LLMFamilyV1, LLMSpecV1
-from .core import PytorchChatModel, PytorchModelConfig
+from .core import PytorchChatModel, PytorchModel, PytorchModelConfig
 
 
 class Internlm2PytorchChatModel(PytorchChatModel):
@@ -88,6 +88,11 @@ class Internlm2PytorchChatModel(PytorchChatModel):
             return False
         return True
 
+    def support_batching(self) -> bool:
+        # The batched requests are built by the INTERNLM2 prompt style, which
+        # gives the same prompt as the `chat` of the model.
+        return PytorchModel.support_batching(self)
+
     def chat(
         self,
         prompt: str,
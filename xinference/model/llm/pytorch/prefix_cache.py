@@ -0,0 +1,219 @@
+# Copyright 2022-2024 XProbe Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+
+def _slice_kv_cache(kv_cache, start: int, length: int, seq_dim: int):
+    return tuple(
+        tuple(t.narrow(seq_dim, start, length) for t in layer) for layer in kv_cache
+    )
+
+
+def _concat_kv_caches(kv_caches: List[Any], seq_dim: int):
+    if len(kv_caches) == 1:
+        return kv_caches[0]
+    return tuple(
+        tuple(torch.cat(tensors, dim=seq_dim) for tensors in zip(*layer_caches))
+        for layer_caches in zip(*kv_caches)
+    )
+
+
+def _clone_kv_cache(kv_cache):
+    return tuple(tuple(t.clone() for t in layer) for layer in kv_cache)
+
+
+def _get_kv_cache_size(kv_cache) -> int:
+    return sum(t.numel() * t.element_size() for layer in kv_cache for t in layer)
+
+
+class _RadixNode:
+    def __init__(
+        self,
+        tokens: Tuple[int, ...],
+        kv_cache,
+        parent: Optional["_RadixNode"],
+    ):
+        # The tokens of the edge from the parent, and their kv cache.
+        self.tokens = tokens
+        self.kv_cache = kv_cache
+        self.parent = parent
+        self.children: Dict[int, "_RadixNode"] = {}
+        self.size = _get_kv_cache_size(kv_cache) if kv_cache is not None else 0
+        self.last_access = 0
+
+
+class PrefixCache:
+    """
+    A radix tree from the token ids to the kv cache of a model.
+
+    Each edge of the tree holds the legacy kv cache, i.e. the tuple of the
+    (key, value) of each layer, of its tokens. A new request looks up the kv
+    cache of its longest cached prefix, and only the rest of its tokens is
+    computed. The least recently used leaves are removed to keep the total size
+    of the kv caches within `max_size` bytes.
+    """
+
+    def __init__(self, max_size: int, seq_dim: int = 2):
+        self._max_size = max_size
+        self._seq_dim = seq_dim
+        self._root = _RadixNode((), None, None)
+        self._size = 0
+        self._clock = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_size > 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def seq_dim(self) -> int:
+        return self._seq_dim
+
+    def _touch(self, node: _RadixNode):
+        access = next(self._clock)
+        while node is not None:
+            node.last_access = access
+            node = node.parent  # type: ignore
+
+    def match(self, token_ids: Sequence[int]) -> Tuple[int, Any]:
+        """
+        Return the length of the longest cached prefix of `token_ids`, and the
+        kv cache of the prefix, or (0, None) if nothing is cached.
+        """
+        if not self.enabled:
+            return 0, None
+        with self._lock:
+            node = self._root
+            kv_caches = []
+            matched = 0
+            while matched < len(token_ids):
+                child = node.children.get(token_ids[matched])
+                if child is None:
+                    break
+                length = 0
+                for a, b in zip(child.tokens, token_ids[matched:]):
+                    if a != b:
+                        break
+                    length += 1
+                if length < len(child.tokens):
+                    kv_caches.append(
+                        _slice_kv_cache(child.kv_cache, 0, length, self._seq_dim)
+                    )
+                else:
+                    kv_caches.append(child.kv_cache)
+                matched += length
+                node = child
+                if length < len(child.tokens):
+                    break
+            if not matched:
+                return 0, None
+            self._touch(node)
+            return matched, _concat_kv_caches(kv_caches, self._seq_dim)
+
+    def _split(self, node: _RadixNode, length: int) -> _RadixNode:
+        """Split the edge of `node` after `length` tokens, return the upper node."""
+        parent = node.parent
+        assert parent is not None
+        # The parts are copied, so that evicting one of them frees its memory.
+        upper = _RadixNode(
+            node.tokens[:length],
+            _clone_kv_cache(_slice_kv_cache(node.kv_cache, 0, length, self._seq_dim)),
+            parent,
+        )
+        upper.last_access = node.last_access
+        parent.children[upper.tokens[0]] = upper
+        node.kv_cache = _clone_kv_cache(
+            _slice_kv_cache(
+                node.kv_cache, length, len(node.tokens) - length, self._seq_dim
+            )
+        )
+        node.tokens = node.tokens[length:]
+        node.size -= upper.size
+        node.parent = upper
+        upper.children[node.tokens[0]] = node
+        return upper
+
+    def insert(self, token_ids: Sequence[int], kv_cache):
+        """
+        Add the kv cache of `token_ids`, it is sliced along the sequence dim of
+        the cache and only the part of the tokens not cached yet is copied.
+        The tokens are not added if their kv cache is larger than the cache.
+        """
+        if not self.enabled or not token_ids:
+            return
+        with self._lock:
+            node = self._root
+            matched = 0
+            while matched < len(token_ids):
+                child = node.children.get(token_ids[matched])
+                if child is None:
+                    break
+                length = 0
+                for a, b in zip(child.tokens, token_ids[matched:]):
+                    if a != b:
+                        break
+                    length += 1
+                if length < len(child.tokens):
+                    child = self._split(child, length)
+                matched += length
+                node = child
+            if matched < len(token_ids):
+                new_kv_cache = _slice_kv_cache(
+                    kv_cache, matched, len(token_ids) - matched, self._seq_dim
+                )
+                if _get_kv_cache_size(new_kv_cache) > self._max_size:
+                    # Evicting every other entry would still not make room for it.
+                    return
+                # Copy the slice, so the cache does not hold the whole kv cache
+                # of the request.
+                new_kv_cache = _clone_kv_cache(new_kv_cache)
+                leaf = _RadixNode(tuple(token_ids[matched:]), new_kv_cache, node)
+                node.children[leaf.tokens[0]] = leaf
+                self._size += leaf.size
+                node = leaf
+            self._touch(node)
+            self._evict()
+
+    def _evict(self):
+        while self._size > self._max_size:
+            leaves = []
+            stack = list(self._root.children.values())
+            while stack:
+                node = stack.pop()
+                if node.children:
+                    stack.extend(node.children.values())
+                else:
+                    leaves.append(node)
+            if not leaves:
+                break
+            leaf = min(leaves, key=lambda n: n.last_access)
+            parent = leaf.parent
+            assert parent is not None
+            del parent.children[leaf.tokens[0]]
+            self._size -= leaf.size
+            leaf.parent = leaf.kv_cache = None
+
+    def clear(self):
+        with self._lock:
+            self._root.children.clear()
+            self._size = 0
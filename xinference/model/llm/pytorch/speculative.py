@@ -0,0 +1,413 @@
+# Copyright 2022-2024 XProbe Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple
+
+import torch
+from transformers.generation.logits_process import LogitsProcessorList
+
+from ....types import CompletionChunk, CompletionUsage, max_tokens_field
+from .utils import (
+    IncrementalDetokenizer,
+    StopStringMatcher,
+    _check_stop_str,
+    _get_completion_chunk,
+    _get_kv_cache_seq_len,
+    _prefill,
+    _to_legacy_kv_cache,
+    get_context_length,
+    prepare_logits_processor,
+)
+
+if TYPE_CHECKING:
+    from .prefix_cache import PrefixCache
+
+logger = logging.getLogger(__name__)
+
+# The `speculative_model` that drafts the tokens by looking up the prompt.
+NGRAM_SPECULATIVE_MODEL = "[ngram]"
+
+
+class SpecDecodeStats:
+    """The number of the drafted and accepted tokens of a model."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._num_draft_tokens = 0
+        self._num_accepted_tokens = 0
+
+    def add(self, num_draft_tokens: int, num_accepted_tokens: int):
+        with self._lock:
+            self._num_draft_tokens += num_draft_tokens
+            self._num_accepted_tokens += num_accepted_tokens
+
+    def collect(self) -> Tuple[int, int]:
+        """Return the (drafted, accepted) tokens since the last collect."""
+        with self._lock:
+            stats = (self._num_draft_tokens, self._num_accepted_tokens)
+            self._num_draft_tokens = self._num_accepted_tokens = 0
+        return stats
+
+
+def _crop_kv_cache(kv_cache, seq_len: int, seq_dim: int):
+    return tuple(
+        tuple(t.narrow(seq_dim, 0, seq_len) for t in layer) for layer in kv_cache
+    )
+
+
+def _process_logits(
+    logits_processor: LogitsProcessorList,
+    token_ids: List[int],
+    logits: torch.Tensor,
+) -> torch.Tensor:
+    """Process the logits of the next token of `token_ids`, shaped [vocab]."""
+    logits = logits.unsqueeze(0).float()
+    if logits_processor:
+        ids = torch.as_tensor([token_ids], device=logits.device)
+        logits = logits_processor(ids, logits)
+    return logits[0]
+
+
+class NgramDrafter:
+    """
+    Draft the tokens following the last n-gram of the sequence where the n-gram
+    appeared before, which works well when the output copies from the prompt,
+    e.g. summarization or code editing.
+    """
+
+    def __init__(self, max_ngram: int = 4, min_ngram: int = 1):
+        self._max_ngram = max_ngram
+        self._min_ngram = min_ngram
+
+    def propose(
+        self, token_ids: List[int], num_tokens: int, *args
+    ) -> Tuple[List[int], Optional[torch.Tensor]]:
+        """
+        Return the draft tokens, and their distributions the draft tokens are
+        sampled from, None means the draft tokens are deterministic.
+        """
+        for n in range(
+            min(self._max_ngram, len(token_ids) - 1), self._min_ngram - 1, -1
+        ):
+            suffix = token_ids[-n:]
+            # Search the most recent occurrence before the suffix itself.
+            for start in range(len(token_ids) - n - 1, -1, -1):
+                if token_ids[start : start + n] == suffix:
+                    return token_ids[start + n : start + n + num_tokens], None
+        return [], None
+
+    def accept(self, num_valid_tokens: int):
+        pass
+
+
+class DraftModelDrafter:
+    """
+    Draft the tokens by a small model sharing the tokenizer of the target model,
+    the kv cache of the draft model is kept between the steps.
+    """
+
+    def __init__(self, model, device, kv_cache_seq_dim: int = 2):
+        self._model = model
+        self._device = device
+        self._seq_dim = kv_cache_seq_dim
+        self._kv_cache = None
+        self._num_cached = 0
+
+    def propose(
+        self,
+        token_ids: List[int],
+        num_tokens: int,
+        logits_processor: LogitsProcessorList,
+        greedy: bool,
+    ) -> Tuple[List[int], Optional[torch.Tensor]]:
+        draft_tokens: List[int] = []
+        draft_probs = []
+        input_ids = token_ids[self._num_cached :]
+        for _ in range(num_tokens):
+            out = self._model(
+                torch.as_tensor([input_ids], device=self._device),
+                past_key_values=self._kv_cache,
+                use_cache=True,
+            )
+            self._kv_cache = _to_legacy_kv_cache(out.past_key_values)
+            self._num_cached += len(input_ids)
+            logits = _process_logits(
+                logits_processor, token_ids + draft_tokens, out.logits[0, -1]
+            )
+            if greedy:
+                token = int(torch.argmax(logits))
+            else:
+                probs = torch.softmax(logits, dim=-1)
+                token = int(torch.multinomial(probs, num_samples=1))
+                draft_probs.append(probs)
+            draft_tokens.append(token)
+            input_ids = [token]
+        return draft_tokens, torch.stack(draft_probs) if draft_probs else None
+
+    def accept(self, num_valid_tokens: int):
+        """Drop the kv cache of the rejected draft tokens."""
+        if self._kv_cache is not None and self._num_cached > num_valid_tokens:
+            self._kv_cache = _crop_kv_cache(
+                self._kv_cache, num_valid_tokens, self._seq_dim
+            )
+            self._num_cached = num_valid_tokens
+
+
+def verify_draft_tokens(
+    logits: torch.Tensor,
+    token_ids: List[int],
+    draft_tokens: List[int],
+    draft_probs: Optional[torch.Tensor],
+    logits_processor: LogitsProcessorList,
+    greedy: bool,
+) -> Tuple[List[int], int]:
+    """
+    Verify the draft tokens with the target model logits of the positions of
+    the last token and the draft tokens, shaped [num_draft_tokens + 1, vocab].
+
+    Return the new tokens and the number of accepted draft tokens. In greedy
+    mode a draft token is accepted if it is the argmax of the target model, so
+    the output is the same as decoding without drafts. Otherwise the rejection
+    sampling keeps the distribution of the target model: a draft token x is
+    accepted with min(1, p(x) / q(x)), and the first rejected one is resampled
+    from max(p - q, 0).
+    """
+    new_tokens: List[int] = []
+    for j, draft_token in enumerate(draft_tokens):
+        target_logits = _process_logits(
+            logits_processor, token_ids + new_tokens, logits[j]
+        )
+        if greedy:
+            token = int(torch.argmax(target_logits))
+            new_tokens.append(token)
+            if token != draft_token:
+                return new_tokens, j
+            continue
+        p = torch.softmax(target_logits, dim=-1)
+        if draft_probs is None:
+            # The draft token is deterministic, q is one hot.
+            q = torch.zeros_like(p)
+            q[draft_token] = 1.0
+        else:
+            q = torch.zeros_like(p)
+            size = min(p.shape[-1], draft_probs.shape[-1])
+            q[:size] = draft_probs[j, :size].to(p.device)
+        if (
+            draft_token < p.shape[-1]
+            and torch.rand(1).item() * q[draft_token] <= p[draft_token]
+        ):
+            new_tokens.append(draft_token)
+            continue
+        residual = torch.clamp(p - q, min=0)
+        if residual.sum() <= 0:
+            residual = p
+        new_tokens.append(int(torch.multinomial(residual, num_samples=1)))
+        return new_tokens, j
+    # All the draft tokens are accepted, take one more from the target model.
+    target_logits = _process_logits(
+        logits_processor, token_ids + new_tokens, logits[len(draft_tokens)]
+    )
+    if greedy:
+        token = int(torch.argmax(target_logits))
+    else:
+        token = int(
+            torch.multinomial(torch.softmax(target_logits, dim=-1), num_samples=1)
+        )
+    new_tokens.append(token)
+    return new_tokens, len(draft_tokens)
+
+
+@torch.inference_mode()
+def generate_stream_speculative(
+    model_uid,
+    model,
+    tokenizer,
+    prompt,
+    device,
+    generate_config,
+    drafter,
+    num_speculative_tokens: int,
+    stats: Optional[SpecDecodeStats] = None,
+    kv_cache_seq_dim: int = 2,
+    prefix_cache: Optional["PrefixCache"] = None,
+    prefill_chunk_size: int = 0,
+) -> Iterator[Tuple[CompletionChunk, CompletionUsage]]:
+    """
+    Like `generate_stream`, but each forward pass of the model verifies the
+    tokens drafted by `drafter` and may produce several tokens.
+    """
+    context_len = get_context_length(model.config)
+    stream_interval = generate_config.get("stream_interval", 2)
+    stream = generate_config.get("stream", False)
+
+    len_prompt = len(prompt)
+
+    temperature = float(generate_config.get("temperature", 1.0))
+    repetition_penalty = float(generate_config.get("repetition_penalty", 1.0))
+    top_p = float(generate_config.get("top_p", 1.0))
+    top_k = int(generate_config.get("top_k", -1))  # -1 means disable
+    max_new_tokens = int(generate_config.get("max_tokens", max_tokens_field.default))
+    echo = bool(generate_config.get("echo", False))
+    stop_matcher = StopStringMatcher(generate_config.get("stop", None))
+    stop_token_ids = generate_config.get("stop_token_ids", None) or []
+    stop_token_ids.append(tokenizer.eos_token_id)
+    greedy = temperature < 1e-5 or top_p < 1e-8
+
+    logits_processor = prepare_logits_processor(
+        temperature, repetition_penalty, top_p, top_k
+    )
+
+    if ".modeling_qwen." in str(type(model)).lower():
+        # TODO: hacky
+        input_ids = tokenizer(prompt, allowed_special="all").input_ids
+    else:
+        input_ids = tokenizer(prompt).input_ids
+
+    max_src_len = context_len - max_new_tokens - num_speculative_tokens - 8
+    if max_src_len < 0:
+        raise ValueError("Max tokens exceeds model's max length")
+    input_ids = input_ids[-max_src_len:]
+    input_echo_len = len(input_ids)
+
+    if prefix_cache is not None and not prefix_cache.enabled:
+        prefix_cache = None
+
+    start = time.time()
+    # The kv cache of the target model covers all the tokens but the last one.
+    num_cached, past_key_values = 0, None
+    if prefix_cache is not None:
+        num_cached, past_key_values = prefix_cache.match(input_ids[:-1])
+    if num_cached < len(input_ids) - 1:
+        out = _prefill(
+            model,
+            input_ids[num_cached:-1],
+            past_key_values,
+            device,
+            prefill_chunk_size,
+        )
+        past_key_values = _to_legacy_kv_cache(out.past_key_values)
+        del out
+        if prefix_cache is not None:
+            prefix_cache.insert(input_ids[:-1], past_key_values)
+
+    token_ids = list(input_ids)
+    output_ids: List[int] = []
+    output = ""
+    last_output_length = 0
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    stopped = False
+    i = 0
+    while len(output_ids) < max_new_tokens:
+        num_draft_tokens = min(
+            num_speculative_tokens, max_new_tokens - len(output_ids) - 1
+        )
+        if num_draft_tokens > 0:
+            draft_tokens, draft_probs = drafter.propose(
+                token_ids, num_draft_tokens, logits_processor, greedy
+            )
+        else:
+            draft_tokens, draft_probs = [], None
+        out = model(
+            torch.as_tensor([token_ids[-1:] + draft_tokens], device=device),
+            use_cache=True,
+            past_key_values=past_key_values,
+        )
+        new_tokens, num_accepted = verify_draft_tokens(
+            out.logits[0],
+            token_ids,
+            draft_tokens,
+            draft_probs,
+            logits_processor,
+            greedy,
+        )
+        if stats is not None and draft_tokens:
+            stats.add(len(draft_tokens), num_accepted)
+        # Drop the kv cache of the rejected draft tokens.
+        past_key_values = _crop_kv_cache(
+            _to_legacy_kv_cache(out.past_key_values),
+            len(token_ids) + num_accepted,
+            kv_cache_seq_dim,
+        )
+        del out
+
+        for token in new_tokens:
+            token_ids.append(token)
+            output_ids.append(token)
+            if token in stop_token_ids or len(output_ids) >= max_new_tokens:
+                stopped = token in stop_token_ids
+                break
+        drafter.accept(len(token_ids) - 1)
+        i += 1
+
+        reach_length = len(output_ids) >= max_new_tokens
+        if i % stream_interval == 0 or reach_length or stopped:
+            if echo:
+                tmp_output_ids = input_ids + output_ids
+                rfind_start = len_prompt
+            else:
+                tmp_output_ids = output_ids
+                rfind_start = 0
+
+            output = detokenizer.decode(tmp_output_ids, final=reach_length or stopped)
+            output, str_stopped, partially_stopped = _check_stop_str(
+                output, stop_matcher, rfind_start
+            )
+            stopped = stopped or str_stopped
+
+            if stream:
+                output = output.strip("�")
+                tmp_output_length = len(output)
+                output = output[last_output_length:]
+                last_output_length = tmp_output_length
+
+            # prevent yielding partial stop sequence
+            if not partially_stopped:
+                yield _get_completion_chunk(
+                    output, None, model_uid, input_echo_len, len(output_ids)
+                )
+
+        if stopped:
+            break
+
+    elapsed_time = time.time() - start
+    logger.info(
+        f"Average generation speed: {len(output_ids) / elapsed_time:.2f} tokens/s, "
+        f"{len(output_ids) / max(i, 1):.2f} tokens per step."
+    )
+
+    # finish stream event, which contains finish reason
+    if stopped:
+        finish_reason = "stop"
+    elif len(output_ids) >= max_new_tokens:
+        finish_reason = "length"
+    else:
+        finish_reason = None
+
+    if prefix_cache is not None and past_key_values is not None:
+        # The kv cache covers all the tokens but the last one.
+        if _get_kv_cache_seq_len(past_key_values, kv_cache_seq_dim) == (
+            len(token_ids) - 1
+        ):
+            prefix_cache.insert(token_ids[:-1], past_key_values)
+
+    yield _get_completion_chunk(
+        "" if stream else output,
+        finish_reason,
+        model_uid,
+        input_echo_len,
+        len(output_ids),
+    )
@@ -0,0 +1,71 @@
+# Copyright 2022-2024 XProbe Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import torch
+
+from ..prefix_cache import PrefixCache
+
+
+def _kv_cache(token_ids, num_layers=2):
+    # The kv cache of a token is the token id itself, shaped [batch, heads, seq, dim].
+    t = torch.tensor(token_ids, dtype=torch.float32).reshape(1, 1, -1, 1)
+    return tuple((t.clone(), t.clone()) for _ in range(num_layers))
+
+
+def _tokens(kv_cache):
+    return kv_cache[0][0].reshape(-1).long().tolist()
+
+
+def test_prefix_cache():
+    # Each token takes 2 layers * 2 tensors * 4 bytes.
+    cache = PrefixCache(16 * 10, seq_dim=2)
+    assert cache.match([1, 2, 3]) == (0, None)
+
+    cache.insert([1, 2, 3, 4], _kv_cache([1, 2, 3, 4]))
+    assert cache.size == 16 * 4
+    num, kv = cache.match([1, 2, 3, 4, 5])
+    assert num == 4 and _tokens(kv) == [1, 2, 3, 4]
+    # Match a part of an edge.
+    num, kv = cache.match([1, 2, 7])
+    assert num == 2 and _tokens(kv) == [1, 2]
+
+    # Split the edge, only the new tokens are added.
+    cache.insert([1, 2, 5, 6], _kv_cache([1, 2, 5, 6]))
+    assert cache.size == 16 * 6
+    num, kv = cache.match([1, 2, 5, 6, 7])
+    assert num == 4 and _tokens(kv) == [1, 2, 5, 6]
+    num, kv = cache.match([1, 2, 3, 4])
+    assert num == 4 and _tokens(kv) == [1, 2, 3, 4]
+
+    # [1, 2, 5, 6] is the least recently used leaf, it is evicted.
+    cache.insert([8, 9, 10, 11, 12], _kv_cache([8, 9, 10, 11, 12]))
+    assert cache.size == 16 * 9
+    assert cache.match([1, 2, 5, 6])[0] == 2
+    assert cache.match([1, 2, 3, 4])[0] == 4
+    assert cache.match([8, 9, 10, 11, 12])[0] == 5
+
+    # Too large to cache, the cached entries are kept.
+    cache.insert(list(range(20, 40)), _kv_cache(list(range(20, 40))))
+    assert cache.match([20, 21])[0] == 0
+    assert cache.size == 16 * 9
+    assert cache.match([1, 2, 3, 4])[0] == 4
+    assert cache.match([8, 9, 10, 11, 12])[0] == 5
+
+    cache.clear()
+    assert cache.size == 0
+    assert cache.match([1, 2, 3, 4]) == (0, None)
+
+    cache = PrefixCache(0)
+    assert not cache.enabled
+    cache.insert([1, 2], _kv_cache([1, 2]))
+    assert cache.match([1, 2]) == (0, None)
@@ -0,0 +1,63 @@
+# Copyright 2022-2024 XProbe Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import torch
+from transformers.generation.logits_process import LogitsProcessorList
+
+from ..speculative import NgramDrafter, SpecDecodeStats, verify_draft_tokens
+
+
+def test_ngram_drafter():
+    drafter = NgramDrafter(max_ngram=3)
+    token_ids = [1, 2, 3, 4, 5, 6, 1, 2, 3]
+    assert drafter.propose(token_ids, 2) == ([4, 5], None)
+    # The most recent occurrence of the longest n-gram is used.
+    token_ids = [7, 3, 8, 2, 3, 9, 1, 2, 3]
+    assert drafter.propose(token_ids, 2) == ([9, 1], None)
+    assert drafter.propose([1, 2, 3], 2) == ([], None)
+
+
+def test_verify_draft_tokens():
+    processor = LogitsProcessorList()
+    logits = torch.full((3, 5), -10.0)
+    logits[0, 1] = logits[1, 2] = logits[2, 3] = 10.0
+    assert verify_draft_tokens(logits, [0], [1, 2], None, processor, True) == (
+        [1, 2, 3],
+        2,
+    )
+    # The first mismatch is replaced by the target token.
+    assert verify_draft_tokens(logits, [0], [1, 4], None, processor, True) == (
+        [1, 2],
+        1,
+    )
+
+    # The rejection sampling keeps the target distribution.
+    torch.manual_seed(0)
+    p = torch.tensor([0.1, 0.2, 0.3, 0.4])
+    q = torch.tensor([[0.4, 0.3, 0.2, 0.1]])
+    logits = torch.log(p).repeat(2, 1)
+    num_samples = 20000
+    counts = torch.zeros(4)
+    for _ in range(num_samples):
+        draft_token = int(torch.multinomial(q[0], 1))
+        new_tokens, _ = verify_draft_tokens(
+            logits, [0], [draft_token], q, processor, False
+        )
+        counts[new_tokens[0]] += 1
+    assert torch.allclose(counts / num_samples, p, atol=0.02)
+
+    stats = SpecDecodeStats()
+    stats.add(4, 3)
+    stats.add(4, 1)
+    assert stats.collect() == (8, 4)
+    assert stats.collect() == (0, 0)
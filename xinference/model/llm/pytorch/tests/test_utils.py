@@ -0,0 +1,223 @@
+# Copyright 2022-2024 XProbe Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import torch
+
+from .....core.scheduler import InferenceRequest
+from ..utils import (
+    IncrementalDetokenizer,
+    StopStringMatcher,
+    _check_stop_str,
+    _merge_kv_caches,
+    _prefill,
+    _prefill_request,
+    _split_kv_cache,
+    batch_inference_one_step,
+)
+
+
+class MockByteTokenizer:
+    """
+    Each token is a byte, the leading space of the text is stripped like
+    the sentencepiece tokenizers.
+    """
+
+    def __init__(self):
+        self.decoded_tokens = 0
+
+    def decode(self, token_ids, **kwargs):
+        self.decoded_tokens += len(token_ids)
+        return bytes(token_ids).decode("utf-8", errors="replace").lstrip(" ")
+
+
+def _encode(text):
+    return list(text.encode("utf-8"))
+
+
+def test_incremental_detokenizer():
+    tokenizer = MockByteTokenizer()
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    text = " hello 你好 world" * 10
+    token_ids = _encode(text)
+    outputs = []
+    for i in range(1, len(token_ids) + 1):
+        outputs.append(detokenizer.decode(token_ids[:i]))
+    assert outputs[-1] == text.lstrip(" ")
+    # The incomplete characters are held back.
+    assert all("�" not in output for output in outputs)
+    assert all(b.startswith(a) for a, b in zip(outputs, outputs[1:]))
+    # Not decoding the whole text at each step.
+    assert tokenizer.decoded_tokens < 5 * len(token_ids)
+
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    assert detokenizer.decode(_encode("ab")) == "ab"
+    token_ids = _encode("ab") + _encode("好")[:2]
+    assert detokenizer.decode(token_ids) == "ab"
+    # Flush the incomplete character at the end.
+    assert detokenizer.decode(token_ids, final=True) == "ab�"
+    detokenizer.rollback()
+    assert detokenizer.decode(token_ids + _encode("好")[2:]) == "ab好"
+
+
+def test_stop_string_matcher():
+    matcher = StopStringMatcher(["</s>", "abcd", "bc"])
+    assert matcher.feed("xx<") is None
+    assert matcher.partial_length == 1
+    assert matcher.feed("/") is None
+    assert matcher.partial_length == 2
+    # "bc" is found inside "abcd".
+    assert matcher.feed("xab") is None
+    assert matcher.feed("cd") == 6
+    assert matcher.partial_length == 0
+    assert matcher.feed("</s>") == 6
+
+    assert StopStringMatcher(None).feed("abc") is None
+    assert StopStringMatcher("").feed("abc") is None
+
+    texts = ["Hello", " wo", "rld<", "/", "s>", "more"]
+    assert list(StopStringMatcher("</s>").filter(texts)) == [
+        "Hello",
+        " wo",
+        "rld",
+    ]
+    assert "".join(StopStringMatcher("<eos>").filter(["a<", "eo", "x"])) == "a<eox"
+
+    matcher = StopStringMatcher(["###"])
+    output, stopped, partially_stopped = _check_stop_str("Hi #", matcher, 0)
+    assert (output, stopped, partially_stopped) == ("Hi #", False, True)
+    output, stopped, partially_stopped = _check_stop_str("Hi ## there", matcher, 0)
+    assert (output, stopped, partially_stopped) == ("Hi ## there", False, False)
+    output, stopped, partially_stopped = _check_stop_str("Hi ## there###x", matcher, 0)
+    assert (output, stopped, partially_stopped) == ("Hi ## there", True, False)
+
+
+class MockIdTokenizer:
+    eos_token_id = 0
+
+    def __call__(self, text, **kwargs):
+        class Encoding:
+            input_ids = [ord(c) % 100 + 1 for c in text]
+
+        return Encoding()
+
+    def decode(self, token_ids, **kwargs):
+        return "".join(chr(ord("a") + t % 26) for t in token_ids)
+
+
+def _tiny_llama():
+    from transformers import LlamaConfig, LlamaForCausalLM
+
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=128,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        max_position_embeddings=256,
+    )
+    return LlamaForCausalLM(config).eval()
+
+
+def test_chunked_prefill():
+    model = _tiny_llama()
+    prompt = "hello, chunked prefill"
+    input_ids = MockIdTokenizer()(prompt).input_ids
+
+    with torch.inference_mode():
+        expected = _prefill(model, input_ids, None, "cpu", 0).logits[:, -1]
+        out = _prefill(model, input_ids, None, "cpu", 5)
+        assert torch.allclose(out.logits[:, -1], expected, atol=1e-4)
+
+        req = InferenceRequest(prompt, {"max_tokens": 16})
+        results = []
+        while req.is_prefill:
+            results.append(
+                _prefill_request(req, model, MockIdTokenizer(), "cpu", 256, None, 8)
+            )
+    assert [num for num, _ in results] == [8, 8, len(input_ids) - 16]
+    assert all(logits is None for _, logits in results[:-1])
+    assert torch.allclose(results[-1][1], expected, atol=1e-4)
+    assert req.num_prefilled_tokens == len(input_ids)
+
+
+def test_batch_kv_cache_reuse():
+    model = _tiny_llama()
+    tokenizer = MockIdTokenizer()
+    generate_config = {"temperature": 0.0, "max_tokens": 8, "stop_token_ids": []}
+
+    def _run(reqs, join_at=None):
+        running = list(reqs if join_at is None else reqs[:-1])
+        kv_caches = []
+        for step in range(16):
+            if step == join_at:
+                running.append(reqs[-1])
+            running = [r for r in running if not r.stopped]
+            if not running:
+                break
+            with torch.inference_mode():
+                batch_inference_one_step(running, "m", model, tokenizer, "cpu")
+            kv_caches.append(running[0].kv_cache)
+        return [r.outputs[-1]["choices"][0]["text"] for r in reqs], kv_caches
+
+    prompts = ["hello there", "a longer prompt", "join later"]
+    expected = [
+        _run([InferenceRequest(p, dict(generate_config, stream=False))])[0][0]
+        for p in prompts
+    ]
+    reqs = [InferenceRequest(p, dict(generate_config, stream=False)) for p in prompts]
+    outputs, kv_caches = _run(reqs, join_at=3)
+    assert outputs == expected
+    # The merged kv cache is built in the first decode step and kept until the
+    # third request joins the batch after its prefill.
+    assert kv_caches[1] is kv_caches[2] is kv_caches[3]
+    assert kv_caches[4] is not kv_caches[3]
+    assert kv_caches[4] is kv_caches[5]
+
+
+def test_merge_kv_caches():
+    # The layouts of [batch, heads, seq, dim] and [seq, batch, heads, dim].
+    for seq_dim, batch_dim in ((2, 0), (0, 1)):
+        kv_caches = []
+        for seq_len in (3, 5):
+            shape = [2, 2, 2, 2]
+            shape[seq_dim], shape[batch_dim] = seq_len, 1
+            kv_caches.append(((torch.randn(shape), torch.randn(shape)),))
+        merged = _merge_kv_caches(kv_caches, [3, 5], seq_dim, batch_dim)
+        assert merged[0][0].shape[batch_dim] == 2
+        assert merged[0][0].shape[seq_dim] == 5
+        for i, (kv_cache, seq_len) in enumerate(zip(kv_caches, [3, 5])):
+            split = _split_kv_cache(merged, i, seq_len, seq_dim, batch_dim)
+            assert torch.equal(split[0][0], kv_cache[0][0])
+            assert torch.equal(split[0][1], kv_cache[0][1])
+
+
+def test_batch_prefill_error():
+    class BadPromptTokenizer(MockIdTokenizer):
+        def __call__(self, text, **kwargs):
+            if text == "bad":
+                raise RuntimeError("Bad prompt")
+            return super().__call__(text, **kwargs)
+
+    model = _tiny_llama()
+    tokenizer = BadPromptTokenizer()
+    generate_config = {"temperature": 0.0, "max_tokens": 8, "stop_token_ids": []}
+    good = InferenceRequest("hello there", dict(generate_config, stream=False))
+    bad = InferenceRequest("bad", dict(generate_config, stream=False))
+    with torch.inference_mode():
+        batch_inference_one_step([good], "m", model, tokenizer, "cpu")
+        batch_inference_one_step([good, bad], "m", model, tokenizer, "cpu")
+    # Only the request failed in the prefill is stopped.
+    assert isinstance(bad.error, RuntimeError) and bad.stopped
+    assert good.error is None and not good.stopped
+    assert len(good.new_tokens) == 2
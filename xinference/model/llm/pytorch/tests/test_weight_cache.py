@@ -0,0 +1,97 @@
+# Copyright 2022-2024 XProbe Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import threading
+import time
+
+import pytest
+
+from ..weight_cache import WeightCache, get_weight_cache_key
+
+
+def _save(path):
+    with open(os.path.join(path, "model.safetensors"), "wb") as f:
+        f.write(b"0" * 100)
+
+
+def test_weight_cache(tmp_path):
+    model_path = tmp_path / "model"
+    model_path.mkdir()
+    (model_path / "config.json").write_text("{}")
+    (model_path / "pytorch_model.bin").write_bytes(b"1" * 100)
+    cache = WeightCache(str(tmp_path / "cache"), 250)
+
+    key1 = get_weight_cache_key(str(model_path), torch_dtype="float16")
+    assert key1 != get_weight_cache_key(str(model_path), torch_dtype="bfloat16")
+    # The replaced weights get a new key.
+    (model_path / "pytorch_model.bin").write_bytes(b"2" * 101)
+    assert key1 != get_weight_cache_key(str(model_path), torch_dtype="float16")
+    key1 = get_weight_cache_key(str(model_path), torch_dtype="float16")
+    assert cache.get(key1) is None
+    path1 = cache.put(key1, str(model_path), _save, 100)
+    assert cache.get(key1) == path1
+    # The weights are saved, the other files are linked.
+    assert sorted(os.listdir(path1)) == ["config.json", "model.safetensors"]
+    assert os.path.islink(os.path.join(path1, "config.json"))
+
+    # Too large to cache.
+    assert cache.put("key2", str(model_path), _save, 300) is None
+
+    time.sleep(0.01)
+    path2 = cache.put("key2", str(model_path), _save, 100)
+    time.sleep(0.01)
+    # key1 becomes the most recently used.
+    assert cache.get(key1) == path1
+    # key2 is evicted to make room for key3.
+    path3 = cache.put("key3", str(model_path), _save, 100)
+    assert cache.get("key2") is None
+    assert not os.path.exists(path2)
+    assert cache.get(key1) == path1
+    assert cache.get("key3") == path3
+
+    def _error_save(path):
+        raise ValueError("mock error")
+
+    with pytest.raises(ValueError, match="mock error"):
+        cache.put("key4", str(model_path), _error_save, 0)
+    assert sorted(
+        name for name in os.listdir(tmp_path / "cache") if not name.startswith(".")
+    ) == sorted([key1, "key3"])
+
+    assert WeightCache(str(tmp_path / "cache"), 0).get(key1) is None
+
+
+def test_weight_cache_concurrent_put(tmp_path):
+    model_path = tmp_path / "model"
+    model_path.mkdir()
+
+    def _slow_save(path):
+        time.sleep(0.05)
+        _save(path)
+
+    # Each thread has its own cache like the processes of the models.
+    cache_dir = str(tmp_path / "cache")
+    threads = [
+        threading.Thread(
+            target=WeightCache(cache_dir, 250).put,
+            args=(f"key{i}", str(model_path), _slow_save, 100),
+        )
+        for i in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    entries = [name for name in os.listdir(cache_dir) if not name.startswith(".")]
+    assert len(entries) == 2
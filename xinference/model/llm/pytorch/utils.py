@@ -12,15 +12,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import gc
+import inspect
 import logging
 import time
 import uuid
 from threading import Thread
-from typing import Iterable, Iterator, Tuple
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import torch
-from transformers import GenerationConfig, TextIteratorStreamer
+from transformers import GenerationConfig, StoppingCriteria, TextIteratorStreamer
 from transformers.generation.logits_process import (
     LogitsProcessorList,
     RepetitionPenaltyLogitsProcessor,
@@ -31,12 +43,17 @@ from transformers.generation.logits_process import (
 
 from ....device_utils import empty_cache
 from ....types import (
+    Completion,
     CompletionChoice,
     CompletionChunk,
     CompletionUsage,
     max_tokens_field,
 )
 
+if TYPE_CHECKING:
+    from ....core.scheduler import InferenceRequest
+    from .prefix_cache import PrefixCache
+
 logger = logging.getLogger(__name__)
 
 
@@ -46,12 +63,116 @@ def is_sentence_complete(output: str):
     return output.endswith(end_symbols)
 
 
-def is_partial_stop(output: str, stop_str: str):
-    """Check whether the output contains a partial stop str."""
-    for i in range(0, min(len(output), len(stop_str))):
-        if stop_str.startswith(output[-i:]):
-            return True
-    return False
+class StopStringMatcher:
+    """
+    Match the stop strings in the streamed text with an Aho-Corasick automaton.
+    The text is fed piece by piece and each char is scanned once, the automaton
+    state carries the possible stop string prefix over to the next piece.
+    """
+
+    def __init__(self, stop: Optional[Union[str, Iterable[str]]]):
+        if stop is None:
+            stop = []
+        elif isinstance(stop, str):
+            stop = [stop]
+        elif not isinstance(stop, Iterable):
+            raise ValueError("Invalid stop field type.")
+        stop = [s for s in stop if s]
+        # The trie of the stop strings, the failure links and the length of the
+        # longest stop string ending at each state.
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._depth: List[int] = [0]
+        self._match: List[int] = [0]
+        for stop_str in stop:
+            state = 0
+            for ch in stop_str:
+                if ch not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._depth.append(self._depth[state] + 1)
+                    self._match.append(0)
+                    self._goto[state][ch] = len(self._goto) - 1
+                state = self._goto[state][ch]
+            self._match[state] = len(stop_str)
+        # Build the failure links in BFS order.
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(ch, 0)
+                self._match[next_state] = max(
+                    self._match[next_state], self._match[self._fail[next_state]]
+                )
+                queue.append(next_state)
+
+        self._state = 0
+        self.num_fed = 0
+        # The position of the first stop string in the fed text.
+        self.stop_pos: Optional[int] = None
+
+    def feed(self, text: str) -> Optional[int]:
+        """
+        Feed the new text, return the position of the first stop string in all
+        the fed text, None if no stop string is found.
+        """
+        if self.stop_pos is not None or len(self._goto) == 1:
+            self.num_fed += len(text)
+            return self.stop_pos
+        goto, fail, match = self._goto, self._fail, self._match
+        state = self._state
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if match[state]:
+                self.stop_pos = self.num_fed + i + 1 - match[state]
+                break
+        self._state = state
+        self.num_fed += len(text)
+        return self.stop_pos
+
+    @property
+    def partial_length(self) -> int:
+        """
+        The length of the longest suffix of the fed text that is the beginning
+        of a stop string.
+        """
+        return 0 if self.stop_pos is not None else self._depth[self._state]
+
+    def filter(self, texts: Iterable[str]) -> Iterator[str]:
+        """
+        Yield the streamed texts until the first stop string, the possible
+        beginning of a stop string is held back until it is decided.
+        """
+        pending = ""
+        for text in texts:
+            stop_pos = self.feed(text)
+            pending += text
+            if stop_pos is not None:
+                emitted = self.num_fed - len(pending)
+                if stop_pos > emitted:
+                    yield pending[: stop_pos - emitted]
+                return
+            safe_length = len(pending) - self.partial_length
+            if safe_length > 0:
+                yield pending[:safe_length]
+                pending = pending[safe_length:]
+        if pending:
+            yield pending
+
+
+class AbortStoppingCriteria(StoppingCriteria):
+    """Stop the `model.generate` running in a thread once the consumer is gone."""
+
+    def __init__(self):
+        self.aborted = False
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.aborted
 
 
 def get_context_length(config):
@@ -93,6 +214,141 @@ def prepare_logits_processor(
     return processor_list
 
 
+def _sample_tokens(
+    logits: torch.Tensor,
+    output_ids: List[int],
+    logits_processor: LogitsProcessorList,
+    temperature: float,
+    repetition_penalty: float,
+    top_p: float,
+    device: str,
+) -> List[int]:
+    """Sample the top 2 candidates from the last token logits of one sequence, shaped [1, vocab]."""
+    if logits_processor:
+        if repetition_penalty > 1.0:
+            tmp_output_ids = torch.as_tensor([output_ids], device=logits.device)
+        else:
+            tmp_output_ids = None
+        last_token_logits = logits_processor(tmp_output_ids, logits)[0]
+    else:
+        last_token_logits = logits[0]
+
+    if device == "mps":
+        # Switch to CPU by avoiding some bugs in mps backend.
+        last_token_logits = last_token_logits.float().to("cpu")
+
+    if temperature < 1e-5 or top_p < 1e-8:  # greedy
+        _, indices = torch.topk(last_token_logits, 2)
+    else:
+        probs = torch.softmax(last_token_logits, dim=-1)
+        indices = torch.multinomial(probs, num_samples=2)
+    return [int(index) for index in indices.tolist()]
+
+
+def _check_stop_str(
+    output: str, matcher: StopStringMatcher, start: int
+) -> Tuple[str, bool, bool]:
+    """
+    Feed the output after `start` that the matcher has not seen, and truncate
+    the output at the stop str.
+    Return the output, whether a stop str is found
+    and whether the output ends with a partial stop str.
+    """
+    stop_pos = matcher.feed(output[start + matcher.num_fed :])
+    if stop_pos is not None:
+        return output[: start + stop_pos], True, False
+    return output, False, matcher.partial_length > 0
+
+
+class IncrementalDetokenizer:
+    """
+    Decode the output tokens incrementally. Each call decodes only the tokens
+    since the last one, with the tokens decoded last time as the prefix, so the
+    leading spaces and the merged spaces are decoded as in the full text.
+    The text ending with an incomplete multi-byte character is held back until
+    the following tokens complete it.
+    """
+
+    def __init__(self, tokenizer):
+        self._tokenizer = tokenizer
+        self.text = ""
+        self._prefix_offset = 0
+        self._read_offset = 0
+        self._last_state: Tuple[str, int, int] = (self.text, 0, 0)
+
+    def _decode(self, token_ids: List[int]) -> str:
+        return self._tokenizer.decode(
+            token_ids,
+            skip_special_tokens=True,
+            spaces_between_special_tokens=False,
+            clean_up_tokenization_spaces=True,
+        )
+
+    def decode(self, token_ids: List[int], final: bool = False) -> str:
+        """
+        Decode the tokens appended to `token_ids` since the last call and
+        return the whole text so far, including the held back text if `final`.
+        """
+        self._last_state = (self.text, self._prefix_offset, self._read_offset)
+        prefix_text = self._decode(token_ids[self._prefix_offset : self._read_offset])
+        new_text = self._decode(token_ids[self._prefix_offset :])
+        if len(new_text) > len(prefix_text) and (
+            final or not new_text.endswith("\ufffd")
+        ):
+            self.text += new_text[len(prefix_text) :]
+            self._prefix_offset = self._read_offset
+            self._read_offset = len(token_ids)
+        return self.text
+
+    def rollback(self):
+        """
+        Undo the last `decode`, when its last token is replaced.
+        """
+        self.text, self._prefix_offset, self._read_offset = self._last_state
+
+
+def _get_completion_chunk(
+    output: str,
+    finish_reason: Optional[str],
+    model_uid: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+) -> Tuple[CompletionChunk, CompletionUsage]:
+    completion_choice = CompletionChoice(
+        text=output, index=0, logprobs=None, finish_reason=finish_reason
+    )
+    completion_chunk = CompletionChunk(
+        id=str(uuid.uuid1()),
+        object="text_completion",
+        created=int(time.time()),
+        model=model_uid,
+        choices=[completion_choice],
+    )
+    completion_usage = CompletionUsage(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+    )
+    return completion_chunk, completion_usage
+
+
+def _prefill(model, input_ids: List[int], past_key_values, device, chunk_size: int):
+    """
+    Compute the kv cache of `input_ids` in chunks of at most `chunk_size` tokens,
+    0 means one chunk, and return the output of the last chunk.
+    """
+    if chunk_size <= 0:
+        chunk_size = len(input_ids)
+    for start in range(0, len(input_ids), chunk_size):
+        out = model(
+            torch.as_tensor([input_ids[start : start + chunk_size]], device=device),
+            use_cache=True,
+            past_key_values=past_key_values,
+        )
+        past_key_values = out.past_key_values
+    return out
+
+
 @torch.inference_mode()
 def generate_stream(
     model_uid,
@@ -102,6 +358,8 @@ def generate_stream(
     device,
     generate_config,
     judge_sent_end=False,
+    prefix_cache: Optional["PrefixCache"] = None,
+    prefill_chunk_size: int = 0,
 ) -> Iterator[Tuple[CompletionChunk, CompletionUsage]]:
     context_len = get_context_length(model.config)
     stream_interval = generate_config.get("stream_interval", 2)
@@ -115,7 +373,7 @@ def generate_stream(
     top_k = int(generate_config.get("top_k", -1))  # -1 means disable
     max_new_tokens = int(generate_config.get("max_tokens", max_tokens_field.default))
     echo = bool(generate_config.get("echo", False))
-    stop_str = generate_config.get("stop", None)
+    stop_matcher = StopStringMatcher(generate_config.get("stop", None))
     stop_token_ids = generate_config.get("stop_token_ids", None) or []
     stop_token_ids.append(tokenizer.eos_token_id)
 
@@ -150,11 +408,19 @@ def generate_stream(
             device=device,
         )
 
+    if model.config.is_encoder_decoder or (
+        prefix_cache is not None and not prefix_cache.enabled
+    ):
+        prefix_cache = None
+
     start = time.time()
     past_key_values = out = None
     sent_interrupt = False
     token = None
     last_output_length = 0
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    # The token ids that the kv cache is computed from.
+    cached_ids = list(input_ids)
     for i in range(max_new_tokens):
         if i == 0:
             if model.config.is_encoder_decoder:
@@ -165,8 +431,27 @@ def generate_stream(
                 )
                 logits = model.lm_head(out[0])
             else:
-                out = model(torch.as_tensor([input_ids], device=device), use_cache=True)
+                num_cached = 0
+                if prefix_cache is not None:
+                    # At least the last prompt token is computed for its logits.
+                    num_cached, past_key_values = prefix_cache.match(input_ids[:-1])
+                    logger.debug(
+                        "Prefix cache hit %d of %d prompt tokens.",
+                        num_cached,
+                        len(input_ids),
+                    )
+                out = _prefill(
+                    model,
+                    input_ids[num_cached:],
+                    past_key_values,
+                    device,
+                    prefill_chunk_size,
+                )
                 logits = out.logits
+                if prefix_cache is not None:
+                    prefix_cache.insert(
+                        input_ids, _to_legacy_kv_cache(out.past_key_values)
+                    )
             past_key_values = out.past_key_values
         else:
             if model.config.is_encoder_decoder:
@@ -189,30 +474,23 @@ def generate_stream(
                     use_cache=True,
                     past_key_values=past_key_values if not sent_interrupt else None,
                 )
+                if sent_interrupt:
+                    cached_ids = list(output_ids)
+                else:
+                    cached_ids.append(token)
                 sent_interrupt = False
                 logits = out.logits
             past_key_values = out.past_key_values
 
-        if logits_processor:
-            if repetition_penalty > 1.0:
-                tmp_output_ids = torch.as_tensor([output_ids], device=logits.device)
-            else:
-                tmp_output_ids = None
-            last_token_logits = logits_processor(tmp_output_ids, logits[:, -1, :])[0]
-        else:
-            last_token_logits = logits[0, -1, :]
-
-        if device == "mps":
-            # Switch to CPU by avoiding some bugs in mps backend.
-            last_token_logits = last_token_logits.float().to("cpu")
-
-        if temperature < 1e-5 or top_p < 1e-8:  # greedy
-            _, indices = torch.topk(last_token_logits, 2)
-            tokens = [int(index) for index in indices.tolist()]
-        else:
-            probs = torch.softmax(last_token_logits, dim=-1)
-            indices = torch.multinomial(probs, num_samples=2)
-            tokens = [int(token) for token in indices.tolist()]
+        tokens = _sample_tokens(
+            logits[:, -1, :],
+            output_ids,
+            logits_processor,
+            temperature,
+            repetition_penalty,
+            top_p,
+            device,
+        )
         token = tokens[0]
         output_ids.append(token)
 
@@ -229,11 +507,8 @@ def generate_stream(
                 tmp_output_ids = output_ids[input_echo_len:]
                 rfind_start = 0
 
-            output = tokenizer.decode(
-                tmp_output_ids,
-                skip_special_tokens=True,
-                spaces_between_special_tokens=False,
-                clean_up_tokenization_spaces=True,
+            output = detokenizer.decode(
+                tmp_output_ids, final=i == max_new_tokens - 1 or stopped
             )
 
             # TODO: For the issue of incomplete sentences interrupting output, apply a patch and others can also modify it to a more elegant way
@@ -243,31 +518,16 @@ def generate_stream(
                     output_ids[-1] = token
                 else:
                     output_ids.pop()
+                # The stop token is not in the output.
+                detokenizer.rollback()
+                output = detokenizer.text
                 stopped = False
                 sent_interrupt = True
 
-            partially_stopped = False
-            if stop_str:
-                if isinstance(stop_str, str):
-                    pos = output.rfind(stop_str, rfind_start)
-                    if pos != -1:
-                        output = output[:pos]
-                        stopped = True
-                    else:
-                        partially_stopped = is_partial_stop(output, stop_str)
-                elif isinstance(stop_str, Iterable):
-                    for each_stop in stop_str:
-                        pos = output.rfind(each_stop, rfind_start)
-                        if pos != -1:
-                            output = output[:pos]
-                            stopped = True
-                            break
-                        else:
-                            partially_stopped = is_partial_stop(output, each_stop)
-                            if partially_stopped:
-                                break
-                else:
-                    raise ValueError("Invalid stop field type.")
+            output, str_stopped, partially_stopped = _check_stop_str(
+                output, stop_matcher, rfind_start
+            )
+            stopped = stopped or str_stopped
 
             if stream:
                 output = output.strip("�")
@@ -277,23 +537,7 @@ def generate_stream(
 
             # prevent yielding partial stop sequence
             if not partially_stopped:
-                completion_choice = CompletionChoice(
-                    text=output, index=0, logprobs=None, finish_reason=None
-                )
-                completion_chunk = CompletionChunk(
-                    id=str(uuid.uuid1()),
-                    object="text_completion",
-                    created=int(time.time()),
-                    model=model_uid,
-                    choices=[completion_choice],
-                )
-                completion_usage = CompletionUsage(
-                    prompt_tokens=input_echo_len,
-                    completion_tokens=i,
-                    total_tokens=(input_echo_len + i),
-                )
-
-                yield completion_chunk, completion_usage
+                yield _get_completion_chunk(output, None, model_uid, input_echo_len, i)
 
         if stopped:
             break
@@ -309,30 +553,18 @@ def generate_stream(
     else:
         finish_reason = None
 
-    if stream:
-        completion_choice = CompletionChoice(
-            text="", index=0, logprobs=None, finish_reason=finish_reason
-        )
-    else:
-        completion_choice = CompletionChoice(
-            text=output, index=0, logprobs=None, finish_reason=finish_reason
-        )
+    if prefix_cache is not None:
+        # Cache the generated tokens too for the next turn of the conversation.
+        past_key_values = _to_legacy_kv_cache(past_key_values)
+        if _get_kv_cache_seq_len(past_key_values, prefix_cache.seq_dim) == len(
+            cached_ids
+        ):
+            prefix_cache.insert(cached_ids, past_key_values)
 
-    completion_chunk = CompletionChunk(
-        id=str(uuid.uuid1()),
-        object="text_completion",
-        created=int(time.time()),
-        model=model_uid,
-        choices=[completion_choice],
-    )
-    completion_usage = CompletionUsage(
-        prompt_tokens=input_echo_len,
-        completion_tokens=i,
-        total_tokens=(input_echo_len + i),
+    yield _get_completion_chunk(
+        "" if stream else output, finish_reason, model_uid, input_echo_len, i
     )
 
-    yield completion_chunk, completion_usage
-
     # clean
     del past_key_values, out
     gc.collect()
@@ -361,7 +593,7 @@ def generate_stream_falcon(
     top_k = int(generate_config.get("top_k", 50))  # -1 means disable
     max_new_tokens = int(generate_config.get("max_tokens", max_tokens_field.default))
     echo = bool(generate_config.get("echo", False))
-    stop_str = generate_config.get("stop", None)
+    stop_matcher = StopStringMatcher(generate_config.get("stop", None))
     stop_token_ids = generate_config.get("stop_token_ids", None) or []
     stop_token_ids.append(tokenizer.eos_token_id)
 
@@ -389,11 +621,13 @@ def generate_stream_falcon(
         eos_token_id=stop_token_ids,
     )
 
+    abort_criteria = AbortStoppingCriteria()
     generation_kwargs = dict(
         inputs=input_ids,
         attention_mask=attention_mask,
         streamer=streamer,
         generation_config=generation_config,
+        stopping_criteria=[abort_criteria],
     )
 
     thread = Thread(target=model.generate, kwargs=generation_kwargs)
@@ -405,89 +639,427 @@ def generate_stream_falcon(
     else:
         output = ""
 
-    last_output_length = 0
-    for i, new_text in enumerate(streamer):
-        output += new_text
-        if i % stream_interval == 0:
-            if echo:
-                rfind_start = len_prompt
-            else:
-                rfind_start = 0
+    try:
+        last_output_length = 0
+        str_stopped = partially_stopped = False
+        full_output = output
+        for i, new_text in enumerate(streamer):
+            full_output += new_text
+            # The matcher is fed on every chunk, so no stop string is skipped.
+            full_output, str_stopped, partially_stopped = _check_stop_str(
+                full_output, stop_matcher, len_prompt if echo else 0
+            )
+            if str_stopped:
+                abort_criteria.aborted = True
+            if i % stream_interval == 0 or str_stopped:
+                output = full_output
+                if stream:
+                    output = output.strip("�")
+                    tmp_output_length = len(output)
+                    output = output[last_output_length:]
+                    last_output_length = tmp_output_length
 
-            partially_stopped = False
-            if stop_str:
-                if isinstance(stop_str, str):
-                    pos = output.rfind(stop_str, rfind_start)
-                    if pos != -1:
-                        output = output[:pos]
-                    else:
-                        partially_stopped = is_partial_stop(output, stop_str)
-                elif isinstance(stop_str, Iterable):
-                    for each_stop in stop_str:
-                        pos = output.rfind(each_stop, rfind_start)
-                        if pos != -1:
-                            output = output[:pos]
-                            break
-                        else:
-                            partially_stopped = is_partial_stop(output, each_stop)
-                            if partially_stopped:
-                                break
-                else:
-                    raise ValueError("Invalid stop field type.")
+                # prevent yielding partial stop sequence
+                if not partially_stopped:
+                    yield _get_completion_chunk(
+                        output, None, model_uid, input_echo_len, i
+                    )
+            if str_stopped:
+                break
+        if stream:
+            # The text after the last yielded chunk.
+            output = full_output.strip("�")[last_output_length:]
+        else:
+            output = full_output.strip()
 
-            if stream:
-                output = output.strip("�")
-                tmp_output_length = len(output)
-                output = output[last_output_length:]
-                last_output_length = tmp_output_length
+        # finish stream event, which contains finish reason
+        if str_stopped:
+            finish_reason = "stop"
+        elif i == max_new_tokens - 1:
+            finish_reason = "length"
+        elif partially_stopped:
+            finish_reason = None
+        else:
+            finish_reason = "stop"
 
-            # prevent yielding partial stop sequence
-            if not partially_stopped:
-                completion_choice = CompletionChoice(
-                    text=output, index=0, logprobs=None, finish_reason=None
-                )
-                completion_chunk = CompletionChunk(
-                    id=str(uuid.uuid1()),
-                    object="text_completion",
-                    created=int(time.time()),
-                    model=model_uid,
-                    choices=[completion_choice],
-                )
-                completion_usage = CompletionUsage(
-                    prompt_tokens=input_echo_len,
-                    completion_tokens=i,
-                    total_tokens=(input_echo_len + i),
-                )
+        yield _get_completion_chunk(output, finish_reason, model_uid, input_echo_len, i)
+    except GeneratorExit:
+        # The consumer is gone, stop the generation thread.
+        abort_criteria.aborted = True
+        raise
 
-                yield completion_chunk, completion_usage
-    output = output.strip()
+    # clean
+    gc.collect()
+    empty_cache()
 
-    # finish stream event, which contains finish reason
-    if i == max_new_tokens - 1:
-        finish_reason = "length"
-    elif partially_stopped:
-        finish_reason = None
-    else:
-        finish_reason = "stop"
 
-    completion_choice = CompletionChoice(
-        text=output, index=0, logprobs=None, finish_reason=finish_reason
+def _get_kv_cache_seq_len(kv_cache, seq_dim: int) -> int:
+    return kv_cache[0][0].shape[seq_dim]
+
+
+def _to_legacy_kv_cache(past_key_values):
+    # Newer transformers may return a `Cache` object instead of the tuple format.
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    return past_key_values
+
+
+def _left_pad(t: torch.Tensor, pad_len: int, seq_dim: int) -> torch.Tensor:
+    if pad_len == 0:
+        return t
+    shape = list(t.shape)
+    shape[seq_dim] = pad_len
+    return torch.cat([t.new_zeros(shape), t], dim=seq_dim)
+
+
+def _merge_kv_caches(
+    kv_caches: List[Any], seq_lens: List[int], seq_dim: int, batch_dim: int = 0
+):
+    """Left pad the kv caches to the same length and concat them along the batch dim."""
+    max_len = max(seq_lens)
+    merged = []
+    for layer_caches in zip(*kv_caches):
+        merged.append(
+            tuple(
+                torch.cat(
+                    [
+                        _left_pad(t, max_len - seq_len, seq_dim)
+                        for t, seq_len in zip(tensors, seq_lens)
+                    ],
+                    dim=batch_dim,
+                )
+                for tensors in zip(*layer_caches)
+            )
+        )
+    return tuple(merged)
+
+
+def _split_kv_cache(
+    kv_cache, index: int, seq_len: int, seq_dim: int, batch_dim: int = 0
+):
+    """Take the kv cache of one sequence out of the batch, without the padding."""
+    return tuple(
+        tuple(
+            t.narrow(batch_dim, index, 1).narrow(
+                seq_dim, t.shape[seq_dim] - seq_len, seq_len
+            )
+            for t in layer
+        )
+        for layer in kv_cache
     )
-    completion_chunk = CompletionChunk(
-        id=str(uuid.uuid1()),
-        object="text_completion",
-        created=int(time.time()),
-        model=model_uid,
-        choices=[completion_choice],
+
+
+class _BatchKVCache:
+    """
+    The merged kv cache of the requests decoded together.
+
+    It is shared by the `kv_cache` of the requests in the batch and kept between
+    the decode steps, it is only rebuilt when a request joins or leaves the
+    batch. The cache is freed once all its requests have dropped it.
+    """
+
+    def __init__(
+        self,
+        request_ids: List[str],
+        seq_lens: List[int],
+        kv_cache,
+        seq_dim: int,
+        batch_dim: int,
+    ):
+        self.request_ids = request_ids
+        self.seq_lens = seq_lens
+        self.kv_cache = kv_cache
+        self.seq_dim = seq_dim
+        self.batch_dim = batch_dim
+
+    def get(self, request_id: str):
+        """Return the kv cache of one request and its length."""
+        index = self.request_ids.index(request_id)
+        seq_len = self.seq_lens[index]
+        kv_cache = _split_kv_cache(
+            self.kv_cache, index, seq_len, self.seq_dim, self.batch_dim
+        )
+        return kv_cache, seq_len
+
+    @classmethod
+    def merge(
+        cls, reqs: List["InferenceRequest"], seq_dim: int, batch_dim: int
+    ) -> "_BatchKVCache":
+        kv_caches, seq_lens = [], []
+        for r in reqs:
+            if isinstance(r.kv_cache, _BatchKVCache):
+                kv_cache, seq_len = r.kv_cache.get(r.request_id)
+            else:
+                kv_cache = r.kv_cache
+                seq_len = _get_kv_cache_seq_len(kv_cache, seq_dim)
+            kv_caches.append(kv_cache)
+            seq_lens.append(seq_len)
+        return cls(
+            [r.request_id for r in reqs],
+            seq_lens,
+            _merge_kv_caches(kv_caches, seq_lens, seq_dim, batch_dim),
+            seq_dim,
+            batch_dim,
+        )
+
+
+def _init_sampling_params(req: "InferenceRequest", tokenizer):
+    generate_config = req.generate_config
+    temperature = float(generate_config.get("temperature", 1.0))
+    repetition_penalty = float(generate_config.get("repetition_penalty", 1.0))
+    top_p = float(generate_config.get("top_p", 1.0))
+    top_k = int(generate_config.get("top_k", -1))  # -1 means disable
+    stop_token_ids = generate_config.get("stop_token_ids", None) or []
+    if isinstance(stop_token_ids, int):
+        stop_token_ids = [stop_token_ids]
+    stop_token_ids = list(stop_token_ids)
+    stop_token_ids.append(tokenizer.eos_token_id)
+    req.sampling_params = {
+        "temperature": temperature,
+        "repetition_penalty": repetition_penalty,
+        "top_p": top_p,
+        "max_new_tokens": int(
+            generate_config.get("max_tokens", max_tokens_field.default)
+        ),
+        "echo": bool(generate_config.get("echo", False)),
+        "stop_matcher": StopStringMatcher(generate_config.get("stop", None)),
+        "stop_token_ids": stop_token_ids,
+        "stream_interval": generate_config.get("stream_interval", 2),
+        "logits_processor": prepare_logits_processor(
+            temperature, repetition_penalty, top_p, top_k
+        ),
+        "detokenizer": IncrementalDetokenizer(tokenizer),
+    }
+
+
+def _prefill_request(
+    req: "InferenceRequest",
+    model,
+    tokenizer,
+    device,
+    context_len: int,
+    prefix_cache: Optional["PrefixCache"] = None,
+    max_num_tokens: int = 0,
+) -> Tuple[int, Optional[torch.Tensor]]:
+    """
+    Compute the kv cache of at most `max_num_tokens` more prompt tokens of the
+    request, 0 means all of them. Return the number of the computed tokens, and
+    the logits of the last prompt token once the whole prompt is computed,
+    otherwise None.
+    """
+    if not req.sampling_params:
+        _init_sampling_params(req, tokenizer)
+        if ".modeling_qwen." in str(type(model)).lower():
+            # TODO: hacky
+            input_ids = tokenizer(req.prompt, allowed_special="all").input_ids
+        else:
+            input_ids = tokenizer(req.prompt).input_ids
+
+        max_src_len = context_len - req.sampling_params["max_new_tokens"] - 8
+        if max_src_len < 0:
+            raise ValueError("Max tokens exceeds model's max length")
+        req.prompt_tokens = input_ids[-max_src_len:]
+
+        if prefix_cache is not None:
+            # At least the last prompt token is computed for its logits.
+            req.num_prefilled_tokens, req.kv_cache = prefix_cache.match(
+                req.prompt_tokens[:-1]
+            )
+
+    start = req.num_prefilled_tokens
+    end = len(req.prompt_tokens)
+    if max_num_tokens > 0:
+        end = min(end, start + max_num_tokens)
+    out = model(
+        torch.as_tensor([req.prompt_tokens[start:end]], device=device),
+        use_cache=True,
+        past_key_values=req.kv_cache,
     )
-    completion_usage = CompletionUsage(
-        prompt_tokens=input_echo_len,
-        completion_tokens=i,
-        total_tokens=(input_echo_len + i),
+    req.kv_cache = _to_legacy_kv_cache(out.past_key_values)
+    req.num_prefilled_tokens = end
+    if end < len(req.prompt_tokens):
+        return end - start, None
+    if prefix_cache is not None:
+        prefix_cache.insert(req.prompt_tokens, req.kv_cache)
+    req.is_prefill = False
+    return end - start, out.logits[:, -1, :]
+
+
+def _process_new_token(
+    req: "InferenceRequest", logits: torch.Tensor, model_uid: str, tokenizer, device
+):
+    """Sample the next token of the request and append the produced outputs."""
+    params = req.sampling_params
+    token = _sample_tokens(
+        logits,
+        req.prompt_tokens + req.new_tokens,
+        params["logits_processor"],
+        params["temperature"],
+        params["repetition_penalty"],
+        params["top_p"],
+        device,
+    )[0]
+    req.new_tokens.append(token)
+    num_new_tokens = len(req.new_tokens)
+    stopped = token in params["stop_token_ids"]
+    reach_length = num_new_tokens >= params["max_new_tokens"]
+    if (
+        (num_new_tokens - 1) % params["stream_interval"] != 0
+        and not reach_length
+        and not stopped
+    ):
+        return
+
+    if params["echo"]:
+        output_ids = req.prompt_tokens + req.new_tokens
+        rfind_start = len(req.prompt)
+    else:
+        output_ids = req.new_tokens
+        rfind_start = 0
+    output = params["detokenizer"].decode(output_ids, final=stopped or reach_length)
+    output, str_stopped, partially_stopped = _check_stop_str(
+        output, params["stop_matcher"], rfind_start
     )
+    stopped = stopped or str_stopped
 
-    yield completion_chunk, completion_usage
+    if stopped:
+        finish_reason = "stop"
+    elif reach_length:
+        finish_reason = "length"
+    else:
+        finish_reason = None
 
-    # clean
-    gc.collect()
-    empty_cache()
+    prompt_tokens = len(req.prompt_tokens)
+    if req.stream:
+        output = output.strip("�")
+        tmp_output_length = len(output)
+        output = output[req.last_output_length :]
+        req.last_output_length = tmp_output_length
+        if not partially_stopped:
+            chunk, usage = _get_completion_chunk(
+                output, None, model_uid, prompt_tokens, num_new_tokens
+            )
+            chunk["usage"] = usage
+            req.outputs.append(chunk)
+        if finish_reason is not None:
+            chunk, usage = _get_completion_chunk(
+                "", finish_reason, model_uid, prompt_tokens, num_new_tokens
+            )
+            chunk["usage"] = usage
+            req.outputs.append(chunk)
+    elif finish_reason is not None:
+        chunk, usage = _get_completion_chunk(
+            output, finish_reason, model_uid, prompt_tokens, num_new_tokens
+        )
+        req.outputs.append(
+            Completion(
+                id=chunk["id"],
+                object=chunk["object"],
+                created=chunk["created"],
+                model=chunk["model"],
+                choices=chunk["choices"],
+                usage=usage,
+            )
+        )
+
+    if finish_reason is not None:
+        req.stopped = True
+        req.finish_reason = finish_reason
+
+
+@torch.inference_mode()
+def batch_inference_one_step(
+    req_list: List["InferenceRequest"],
+    model_uid,
+    model,
+    tokenizer,
+    device,
+    kv_cache_seq_dim: int = 2,
+    prefix_cache: Optional["PrefixCache"] = None,
+    prefill_chunk_size: int = 0,
+    kv_cache_batch_dim: int = 0,
+):
+    """
+    Advance every running request by one token.
+    New requests are prefilled one by one, running requests are decoded in one batch
+    with their kv caches left padded to the same length. The merged kv cache of the
+    batch is kept between the steps until a request joins or leaves the batch.
+    If `prefill_chunk_size` is positive, at most that many prompt tokens are
+    prefilled in one step, so a long prompt is prefilled over several steps in
+    between the decode steps of the running requests.
+    The prompts are looked up in the prefix cache if given, and the kv caches of
+    the finished requests are added to it.
+    """
+    if prefix_cache is not None and not prefix_cache.enabled:
+        prefix_cache = None
+    context_len = get_context_length(model.config)
+    decode_reqs = [r for r in req_list if not r.is_prefill and not r.stopped]
+    prefill_reqs = [r for r in req_list if r.is_prefill and not r.stopped]
+
+    if decode_reqs:
+        batch = decode_reqs[0].kv_cache
+        if not isinstance(batch, _BatchKVCache) or batch.request_ids != [
+            r.request_id for r in decode_reqs
+        ]:
+            batch = _BatchKVCache.merge(
+                decode_reqs, kv_cache_seq_dim, kv_cache_batch_dim
+            )
+            for r in decode_reqs:
+                r.kv_cache = batch
+        seq_lens = batch.seq_lens
+        max_len = max(seq_lens)
+        attention_mask = torch.zeros(
+            (len(decode_reqs), max_len + 1), dtype=torch.long, device=device
+        )
+        for i, seq_len in enumerate(seq_lens):
+            attention_mask[i, max_len - seq_len :] = 1
+        kwargs = {}
+        if "position_ids" in inspect.signature(model.forward).parameters:
+            kwargs["position_ids"] = torch.as_tensor(
+                [[seq_len] for seq_len in seq_lens], device=device
+            )
+        out = model(
+            input_ids=torch.as_tensor(
+                [[r.new_tokens[-1]] for r in decode_reqs], device=device
+            ),
+            attention_mask=attention_mask,
+            past_key_values=batch.kv_cache,
+            use_cache=True,
+            **kwargs,
+        )
+        batch.kv_cache = _to_legacy_kv_cache(out.past_key_values)
+        batch.seq_lens = [seq_len + 1 for seq_len in seq_lens]
+        for i, r in enumerate(decode_reqs):
+            _process_new_token(
+                r, out.logits[i : i + 1, -1, :], model_uid, tokenizer, device
+            )
+            if r.stopped and prefix_cache is not None:
+                # The last sampled token is not computed yet.
+                prefix_cache.insert(
+                    r.prompt_tokens + r.new_tokens[:-1],
+                    batch.get(r.request_id)[0],
+                )
+        del out
+
+    # The prompt tokens left to prefill in this step.
+    budget = prefill_chunk_size
+    for r in prefill_reqs:
+        # The failure of one request, e.g. a bad prompt or out of memory in
+        # the prefill, only stops the request itself.
+        try:
+            num_tokens, logits = _prefill_request(
+                r, model, tokenizer, device, context_len, prefix_cache, budget
+            )
+            if logits is not None:
+                _process_new_token(r, logits, model_uid, tokenizer, device)
+        except Exception as e:
+            if not isinstance(e, ValueError):
+                logger.exception("Prefill failed, request: %s", r.request_id)
+            r.error = e
+            r.stopped = True
+            r.kv_cache = None
+            continue
+        if prefill_chunk_size > 0:
+            budget -= num_tokens
+            if budget <= 0:
+                break
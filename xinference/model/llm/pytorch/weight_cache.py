@@ -0,0 +1,188 @@
+# Copyright 2022-2024 XProbe Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Callable, List, Optional, Tuple
+
+from filelock import FileLock
+
+logger = logging.getLogger(__name__)
+
+# The files holding the weights, they are not linked into a cache entry since
+# the entry has its own weights.
+WEIGHT_FILE_SUFFIXES = (
+    ".bin",
+    ".safetensors",
+    ".pt",
+    ".pth",
+    ".ckpt",
+    ".h5",
+    ".msgpack",
+    ".gguf",
+    ".index.json",
+)
+
+
+def _get_weight_file_stats(model_path: str) -> List[Tuple[str, int, int]]:
+    stats = []
+    for name in sorted(os.listdir(model_path)):
+        if name.endswith(WEIGHT_FILE_SUFFIXES):
+            st = os.stat(os.path.join(model_path, name))
+            stats.append((name, st.st_size, st.st_mtime_ns))
+    return stats
+
+
+def get_weight_cache_key(model_path: str, **kwargs) -> str:
+    """
+    The key of the weights loaded from `model_path` with the load arguments.
+    The size and the modification time of the weight files are part of the
+    key, so that the replaced weights are not loaded from the cache.
+    """
+    spec = [
+        os.path.realpath(model_path),
+        _get_weight_file_stats(model_path),
+        sorted((k, str(v)) for k, v in kwargs.items()),
+    ]
+    return hashlib.md5(json.dumps(spec).encode("utf-8")).hexdigest()
+
+
+def _get_dir_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            file_path = os.path.join(root, name)
+            if not os.path.islink(file_path):
+                size += os.path.getsize(file_path)
+    return size
+
+
+class WeightCache:
+    """
+    A size bounded cache of model weights in host memory.
+
+    Each entry is a model directory under `cache_dir`, normally on a tmpfs like
+    `/dev/shm`, holding the loaded weights as safetensors, with the other files
+    of the model linked from the original directory. Loading a model from an
+    entry maps the weights from memory instead of reading and parsing the
+    checkpoint files. The entries outlive the processes of the models, the least
+    recently used ones are removed to keep the total size within `max_size`.
+    The entries are added and removed under a file lock in `cache_dir`, which
+    is shared by the processes of the models.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int):
+        self._cache_dir = cache_dir
+        self._max_size = max_size
+        self._lock = FileLock(os.path.join(cache_dir, ".lock"))
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_size > 0
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self._cache_dir, key)
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._get_path(key)
+        if not self.enabled or not os.path.isdir(path):
+            return None
+        try:
+            # The modification time orders the entries for eviction.
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def _list_entries(self) -> List[Tuple[float, str]]:
+        if not os.path.isdir(self._cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self._cache_dir):
+            path = os.path.join(self._cache_dir, name)
+            # The hidden entries are being written.
+            if not name.startswith(".") and os.path.isdir(path):
+                entries.append((os.path.getmtime(path), path))
+        return sorted(entries)
+
+    def _evict(self, size: int):
+        for name in os.listdir(self._cache_dir):
+            path = os.path.join(self._cache_dir, name)
+            # Left by the processes exited while writing, the others write
+            # under the lock.
+            if name.startswith(".") and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+        entries = [(path, _get_dir_size(path)) for _, path in self._list_entries()]
+        total_size = sum(entry_size for _, entry_size in entries)
+        for path, entry_size in entries:
+            if total_size + size <= self._max_size:
+                break
+            logger.info("Remove the cached weights %s", path)
+            # The processes that mapped the files keep them until they exit.
+            shutil.rmtree(path, ignore_errors=True)
+            total_size -= entry_size
+
+    def put(
+        self,
+        key: str,
+        model_path: str,
+        save: Callable[[str], None],
+        size: int,
+    ) -> Optional[str]:
+        """
+        Add the weights of `model_path` to the cache.
+
+        `save` writes the weights into the given directory, `size` is their
+        estimated size in bytes. Return the path of the entry, or None if the
+        weights do not fit in the cache.
+        """
+        if not self.enabled or size > self._max_size:
+            return None
+        os.makedirs(self._cache_dir, exist_ok=True)
+        with self._lock:
+            return self._put(key, model_path, save, size)
+
+    def _put(
+        self,
+        key: str,
+        model_path: str,
+        save: Callable[[str], None],
+        size: int,
+    ) -> str:
+        path = self._get_path(key)
+        if os.path.isdir(path):
+            # Added by another process while waiting for the lock.
+            return path
+        self._evict(size)
+        tmp_path = tempfile.mkdtemp(prefix=f".{key}.", dir=self._cache_dir)
+        try:
+            save(tmp_path)
+            for name in os.listdir(model_path):
+                if name.endswith(WEIGHT_FILE_SUFFIXES) or os.path.exists(
+                    os.path.join(tmp_path, name)
+                ):
+                    continue
+                os.symlink(
+                    os.path.realpath(os.path.join(model_path, name)),
+                    os.path.join(tmp_path, name),
+                )
+            os.rename(tmp_path, path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        return path
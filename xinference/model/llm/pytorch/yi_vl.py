@@ -36,6 +36,7 @@ from ....types import (
 )
 from ..llm_family import LLMFamilyV1, LLMSpecV1
 from .core import PytorchChatModel, PytorchGenerateConfig
+from .utils import AbortStoppingCriteria, StopStringMatcher
 
 logger = logging.getLogger(__name__)
 
@@ -177,6 +178,7 @@ class YiVLChatModel(PytorchChatModel):
         stopping_criteria = KeywordsStoppingCriteria(
             keywords, self._tokenizer, input_ids
         )
+        abort_criteria = AbortStoppingCriteria()
         streamer = TextIteratorStreamer(
             self._tokenizer, timeout=60, skip_prompt=True, skip_special_tokens=True
         )
@@ -192,7 +194,7 @@ class YiVLChatModel(PytorchChatModel):
             "do_sample": True,
             "top_p": float(top_p),
             "temperature": float(temperature),
-            "stopping_criteria": [stopping_criteria],
+            "stopping_criteria": [stopping_criteria, abort_criteria],
             "use_cache": True,
             "max_new_tokens": min(int(max_new_tokens), 1536),
         }
@@ -200,7 +202,7 @@ class YiVLChatModel(PytorchChatModel):
         t.start()
 
         if stream:
-            it = self._generate_stream(streamer, stop_str)
+            it = self._generate_stream(streamer, stop_str, abort_criteria)
             return self._to_chat_completion_chunks(it)
         else:
             c = self._generate(streamer, stop_str)
@@ -208,10 +210,8 @@ class YiVLChatModel(PytorchChatModel):
 
     def _generate(self, streamer, stop_str) -> Completion:
         generated_text = ""
-        for new_text in streamer:
+        for new_text in StopStringMatcher(stop_str).filter(streamer):
             generated_text += new_text
-            if generated_text.endswith(stop_str):
-                generated_text = generated_text[: -len(stop_str)]
 
         c = Completion(
             id=str(uuid.uuid1()),
@@ -229,10 +229,12 @@ class YiVLChatModel(PytorchChatModel):
         )
         return c
 
-    def _generate_stream(self, streamer, stop_str) -> Iterator[CompletionChunk]:
+    def _generate_stream(
+        self, streamer, stop_str, abort_criteria: AbortStoppingCriteria
+    ) -> Iterator[CompletionChunk]:
         completion_id = str(uuid.uuid1())
-        for i, new_text in enumerate(streamer):
-            if not new_text.endswith(stop_str):
+        try:
+            for new_text in StopStringMatcher(stop_str).filter(streamer):
                 completion_choice = CompletionChoice(
                     text=new_text, index=0, logprobs=None, finish_reason=None
                 )
@@ -250,6 +252,10 @@ class YiVLChatModel(PytorchChatModel):
                 )
                 chunk["usage"] = completion_usage
                 yield chunk
+        except GeneratorExit:
+            # The consumer is gone, stop the generation thread.
+            abort_criteria.aborted = True
+            raise
 
         completion_choice = CompletionChoice(
             text="", index=0, logprobs=None, finish_reason="stop"
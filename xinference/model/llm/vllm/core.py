@@ -348,56 +348,66 @@ class VLLMModel(LLM):
         async def stream_results() -> AsyncGenerator[CompletionChunk, None]:
             previous_texts = [""] * sanitized_generate_config["n"]
             tools_token_filter = ChatModelMixin._tools_token_filter(self.model_family)
-            async for _request_output in results_generator:
-                chunk = self._convert_request_output_to_completion_chunk(
-                    request_id=request_id,
-                    model=self.model_uid,
-                    request_output=_request_output,
-                )
-
-                for i, choice in enumerate(chunk["choices"]):
-                    delta = choice["text"][len(previous_texts[i]) :]
-                    previous_texts[i] = choice["text"]
-                    choice["text"] = delta
-
-                if tools:
-                    # only handle the first choice
-                    choice = chunk["choices"][0]
-                    if choice["finish_reason"] is not None:
-                        # use previous text for evaluation temporarily
-                        choice_delta = choice["text"]
-                        choice["text"] = previous_texts[0]
-                        _content, func, args = ChatModelMixin._eval_tool_arguments(
-                            self.model_family, chunk, tools
-                        )
-                        choice["text"] = choice_delta
-                        if func is not None:
-                            choice["text"] = None
-                            choice["finish_reason"] = "tool_calls"
-                            choice["tool_calls"] = [
-                                ToolCalls(
-                                    id=str(uuid.uuid4()),
-                                    type="function",
-                                    function=ToolCallFunction(
-                                        name=func,
-                                        arguments=json.dumps(args, ensure_ascii=False),
-                                    ),
-                                )
-                            ]
-                    # use a filter function to skip Qwen's react thought process
-                    elif not tools_token_filter(previous_texts[0]):
-                        continue
-                prompt_tokens = len(_request_output.prompt_token_ids)
-                completion_tokens = sum(
-                    len(output.token_ids) for output in _request_output.outputs
-                )
-                total_tokens = prompt_tokens + completion_tokens
-                chunk["usage"] = CompletionUsage(
-                    prompt_tokens=prompt_tokens,
-                    completion_tokens=completion_tokens,
-                    total_tokens=total_tokens,
-                )
-                yield chunk
+            finished = False
+            try:
+                async for _request_output in results_generator:
+                    chunk = self._convert_request_output_to_completion_chunk(
+                        request_id=request_id,
+                        model=self.model_uid,
+                        request_output=_request_output,
+                    )
+
+                    for i, choice in enumerate(chunk["choices"]):
+                        delta = choice["text"][len(previous_texts[i]) :]
+                        previous_texts[i] = choice["text"]
+                        choice["text"] = delta
+
+                    if tools:
+                        # only handle the first choice
+                        choice = chunk["choices"][0]
+                        if choice["finish_reason"] is not None:
+                            # use previous text for evaluation temporarily
+                            choice_delta = choice["text"]
+                            choice["text"] = previous_texts[0]
+                            _content, func, args = ChatModelMixin._eval_tool_arguments(
+                                self.model_family, chunk, tools
+                            )
+                            choice["text"] = choice_delta
+                            if func is not None:
+                                choice["text"] = None
+                                choice["finish_reason"] = "tool_calls"
+                                choice["tool_calls"] = [
+                                    ToolCalls(
+                                        id=str(uuid.uuid4()),
+                                        type="function",
+                                        function=ToolCallFunction(
+                                            name=func,
+                                            arguments=json.dumps(
+                                                args, ensure_ascii=False
+                                            ),
+                                        ),
+                                    )
+                                ]
+                        # use a filter function to skip Qwen's react thought process
+                        elif not tools_token_filter(previous_texts[0]):
+                            continue
+                    prompt_tokens = len(_request_output.prompt_token_ids)
+                    completion_tokens = sum(
+                        len(output.token_ids) for output in _request_output.outputs
+                    )
+                    total_tokens = prompt_tokens + completion_tokens
+                    chunk["usage"] = CompletionUsage(
+                        prompt_tokens=prompt_tokens,
+                        completion_tokens=completion_tokens,
+                        total_tokens=total_tokens,
+                    )
+                    yield chunk
+                finished = True
+            finally:
+                if not finished:
+                    # The consumer is gone, abort the request to stop generating.
+                    logger.info("Abort request %s", request_id)
+                    await self._engine.abort(request_id)
 
         if stream:
             return stream_results()
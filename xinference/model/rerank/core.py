@@ -17,7 +17,7 @@ import logging
 import os
 import uuid
 from collections import defaultdict
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union, cast
 
 import numpy as np
 
@@ -165,21 +165,73 @@ class RerankModel:
         return_documents: Optional[bool],
         **kwargs,
     ) -> Rerank:
+        result = self.batch_rerank(
+            [(documents, query, top_n, max_chunks_per_doc, return_documents, kwargs)]
+        )[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def batch_rerank(
+        self,
+        requests: List[
+            Tuple[List[str], str, Optional[int], Optional[int], Optional[bool], Dict]
+        ],
+    ) -> List[Union[Rerank, Exception]]:
+        """
+        Rerank several requests at once. The [query, doc] pairs of all the requests
+        are scored in one call, then sorted per request.
+        An invalid request gets its exception as the result.
+        """
         self._counter += 1
         if self._counter % RERANK_EMPTY_CACHE_COUNT == 0:
             logger.debug("Empty rerank cache.")
             gc.collect()
             empty_cache()
         assert self._model is not None
-        if kwargs:
-            raise ValueError("rerank hasn't support extra parameter.")
-        if max_chunks_per_doc is not None:
-            raise ValueError("rerank hasn't support `max_chunks_per_doc` parameter.")
-        sentence_combinations = [[query, doc] for doc in documents]
-        if self._model_spec.type == "normal":
-            similarity_scores = self._model.predict(sentence_combinations)
+
+        results: List[Optional[Union[Rerank, Exception]]] = [None] * len(requests)
+        sentence_combinations: List[List[str]] = []
+        spans: List[Tuple[int, int, int]] = []
+        for i, (documents, query, _, max_chunks_per_doc, _, kwargs) in enumerate(
+            requests
+        ):
+            if kwargs:
+                results[i] = ValueError("rerank hasn't support extra parameter.")
+                continue
+            if max_chunks_per_doc is not None:
+                results[i] = ValueError(
+                    "rerank hasn't support `max_chunks_per_doc` parameter."
+                )
+                continue
+            start = len(sentence_combinations)
+            sentence_combinations.extend([[query, doc] for doc in documents])
+            spans.append((i, start, len(sentence_combinations)))
+
+        if sentence_combinations:
+            if self._model_spec.type == "normal":
+                similarity_scores = self._model.predict(sentence_combinations)
+            else:
+                similarity_scores = self._model.compute_score(sentence_combinations)
+            # compute_score returns a float for a single pair.
+            similarity_scores = np.atleast_1d(similarity_scores)
         else:
-            similarity_scores = self._model.compute_score(sentence_combinations)
+            similarity_scores = np.array([])
+
+        for i, start, end in spans:
+            documents, _, top_n, _, return_documents, _ = requests[i]
+            results[i] = self._to_rerank(
+                documents, similarity_scores[start:end], top_n, return_documents
+            )
+        return cast(List[Union[Rerank, Exception]], results)
+
+    @staticmethod
+    def _to_rerank(
+        documents: List[str],
+        similarity_scores: np.ndarray,
+        top_n: Optional[int],
+        return_documents: Optional[bool],
+    ) -> Rerank:
         sim_scores_argsort = list(reversed(np.argsort(similarity_scores)))
         if top_n is not None:
             sim_scores_argsort = sim_scores_argsort[:top_n]
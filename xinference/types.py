@@ -264,6 +264,7 @@ class LlamaCppModelConfig(TypedDict, total=False):
     n_gqa: Optional[int]  # (TEMPORARY) must be 8 for llama2 70b
     rms_norm_eps: Optional[float]  # (TEMPORARY)
     verbose: bool
+    n_parallel: int
 
 
 class PytorchGenerateConfig(TypedDict, total=False):
@@ -292,6 +293,13 @@ class PytorchModelConfig(TypedDict, total=False):
     gptq_groupsize: int
     gptq_act_order: bool
     trust_remote_code: bool
+    max_num_seqs: int
+    prefix_cache_size: float
+    prefill_chunk_size: int
+    speculative_model: Optional[str]
+    num_speculative_tokens: int
+    ngram_prompt_lookup_max: int
+    ngram_prompt_lookup_min: int
 
 
 def get_pydantic_model_from_method(